@@ -1,125 +1,195 @@
 # app.py
-import os, re, time, traceback, random
-from typing import Tuple, Optional, List, Callable, Any
-import gradio as gr
+import os, re, time, heapq, base64, itertools, traceback, random, threading, asyncio, uuid
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait
+from typing import TYPE_CHECKING, Tuple, Optional, List, Callable, Any, Iterator, Dict
+
+import batch_pipeline
+import image_store
+import metrics
+import rate_limit
+import recipe_schema
+import recipe_store
+import singleflight
+import title_dedup
+from response_cache import get_cache, make_key
+
+if TYPE_CHECKING:
+    import gradio as gr  # imported by build_ui only
 
 # ================= OpenAI client =================
-try:
-    from openai import OpenAI
-except Exception:
-    OpenAI = None
+# The SDK takes about half a second to import, so it loads with the first client:
+# headless.py and scripts that only read the stores start without it.
+httpx = OpenAI = AsyncOpenAI = None
 
-OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
-OPENAI_IMAGE_MODEL = os.environ.get("OPENAI_IMAGE_MODEL", "gpt-image-1")
-
-def _client_or_error() -> Tuple[Optional["OpenAI"], Optional[str]]:
+def _load_sdk() -> bool:
+    global httpx, OpenAI, AsyncOpenAI
     if OpenAI is None:
-        return None, "OpenAI SDK not installed. Add openai>=1.50.0 to requirements.txt"
-    if not os.getenv("OPENAI_API_KEY"):
-        return None, "Missing OPENAI_API_KEY environment variable"
-    try:
-        return OpenAI(), None
-    except Exception as e:
-        return None, f"Failed to initialize OpenAI client: {e}"
-
-# ================= helpers =================
-def _split_lines_keep_nonempty(text: str) -> List[str]:
-    return [ln for ln in (l.strip() for l in text.splitlines()) if ln]
-
-def _parse_titles_unique_numbered(text: str) -> List[str]:
-    seen = set()
-    out = []
-    for raw in _split_lines_keep_nonempty(text):
-        cleaned = re.sub(r"^\s*(?:\d+\s*[.)]|[-*•]+)\s*", "", raw, count=1).strip()
-        if cleaned:
-            key = cleaned.lower()
-            if key not in seen:
-                seen.add(key)
-                out.append(cleaned)
-    return [f"{i + 1}. {t}" for i, t in enumerate(out)]
-
-def _strip_markdown(md: str) -> str:
-    if not md:
-        return ""
-    txt = re.sub(r"[*_`]{1,2}", "", md)
-    txt = re.sub(r"^•\s*", "- ", txt, flags=re.MULTILINE)
-    txt = re.sub(r"^#+\s*", "", txt, flags=re.MULTILINE)
-    txt = re.sub(r"\n{3,}", "\n\n", txt)
-    return txt.strip()
-
-def _first_bullet_enforcer(md: str) -> str:
-    def _fix(section: str, text: str) -> str:
-        pattern = rf"(\*\*{re.escape(section)}:\*\*)"
-        text = re.sub(pattern + r"\s*", r"\1\n", text, flags=re.IGNORECASE)
-        text = re.sub(rf"(\*\*{re.escape(section)}:\*\*\n)(?!•)", r"\1", text, flags=re.IGNORECASE)
-        return text
-    md = _fix("Ingredients", md)
-    md = _fix("Storage", md)
-    return md
-
-def _safe_backoff(fn: Callable[[], Any], retries: int = 3, base: float = 0.8) -> Any:
-    for attempt in range(retries):
         try:
-            return fn()
+            import httpx as _httpx
+            from openai import OpenAI as _OpenAI, AsyncOpenAI as _AsyncOpenAI
         except Exception:
-            if attempt == retries - 1:
-                raise
-            sleep_s = base * (2 ** attempt) + random.random() * 0.25
-            time.sleep(sleep_s)
-
-# ================= prompts =================
-LIST_SYSTEM = (
-    "You are ChatGPT. When asked for recipe titles, respond with titles only, one per line. "
-    "No commentary or numbering unless explicitly requested. Titles must be realistic, literal recipes."
-)
-LIST_USER_TEMPLATE = (
-    "Generate exactly {count} recipe titles for the subje
-
-
-britt@Skittles MINGW64 ~/Documents/RecipeCards (main)
-$ git add app.py
-# create app.py in the current folder
-cat > app.py << 'PY'
-# app.py
-import os, re, time, traceback, random
-from typing import Tuple, Optional, List, Callable, Any
-import gradio as gr
-
-# ================= OpenAI client =================
-try:
-    from openai import OpenAI
-except Exception:
-    OpenAI = None
+            return False
+        httpx, OpenAI, AsyncOpenAI = _httpx, _OpenAI, _AsyncOpenAI
+    return True
+
+def warm() -> None:
+    """Load the lazily imported SDK and nutrient table now, so the first request does not pay for them."""
+    _load_sdk()
+    if NUTRITION_ENGINE:
+        try:
+            import nutrition
+            nutrition.get_table()
+        except Exception:
+            pass  # the first card reports the problem
 
 OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
 OPENAI_IMAGE_MODEL = os.environ.get("OPENAI_IMAGE_MODEL", "gpt-image-1")
 
-def _client_or_error() -> Tuple[Optional["OpenAI"], Optional[str]]:
-    if OpenAI is None:
+# Title engine: large counts are split into batches that run concurrently.
+TITLE_BATCH_SIZE = int(os.environ.get("TITLE_BATCH_SIZE", 50))
+TITLE_MAX_CONCURRENCY = int(os.environ.get("TITLE_MAX_CONCURRENCY", 8))
+TITLE_AVOID_SAMPLE = int(os.environ.get("TITLE_AVOID_SAMPLE", 150))  # seen titles fed back per batch
+# Near-duplicates ("Classic Peach Cobbler" / "Peach Cobbler (Classic)") are dropped too, within a list and,
+# when TITLE_DEDUP_CORPUS is set, against every title produced before (title_dedup; threshold is
+# TITLE_DEDUP_THRESHOLD). Off by default: the corpus only grows, so refreshed lists for one subject shrink.
+TITLE_DEDUP_CORPUS = os.environ.get("TITLE_DEDUP_CORPUS", "0").strip().lower() not in ("0", "false", "no", "off", "")
+
+# Nutrition facts on generated cards are recomputed locally from the ingredients (nutrition.py)
+# instead of trusting the model's estimate, when enough ingredients match the nutrient table.
+NUTRITION_ENGINE = os.environ.get("NUTRITION_ENGINE", "1").strip().lower() not in ("0", "false", "no", "off")
+
+# Shared pool for overlapping independent API calls (recipe text + image).
+GENERATION_WORKERS = int(os.environ.get("GENERATION_WORKERS", 16))
+_generation_pool = ThreadPoolExecutor(max_workers=GENERATION_WORKERS, thread_name_prefix="recipe-gen")
+_pending_images: Dict[str, Tuple[str, "asyncio.Task"]] = {}  # UI token -> (title, image task)
+
+# Identical concurrent requests share one API call: cards by cache key (UI streams, sync
+# calls, packs and the prefetcher all join the same flight), photos by title.
+_card_flight = singleflight.SingleFlight("card")
+_image_flight = singleflight.SingleFlight("image")
+_card_streams: Dict[str, singleflight.SharedStream] = {}  # cache key -> UI stream in progress (event loop only)
+
+# Async UI path: caps on in-flight API calls across the app and per browser session,
+# plus Gradio queue settings (concurrent runs per event, max queued events).
+APP_MAX_INFLIGHT = int(os.environ.get("APP_MAX_INFLIGHT", 32))
+SESSION_MAX_INFLIGHT = int(os.environ.get("SESSION_MAX_INFLIGHT", 8))
+UI_CONCURRENCY_LIMIT = int(os.environ.get("UI_CONCURRENCY_LIMIT", 64))
+UI_QUEUE_MAX = int(os.environ.get("UI_QUEUE_MAX", 512))
+
+# Expected completion size per chat call, for tokens-per-minute pacing.
+CHAT_COMPLETION_ESTIMATE = int(os.environ.get("CHAT_COMPLETION_ESTIMATE", 700))
+
+# Output-token budget (max_completion_tokens) per prompt kind, so a runaway reply stops at a
+# known size; 0 sends none. Title batches get TOKEN_BUDGET_PER_TITLE per requested title and
+# packs the model's output limit (see _PackSizer).
+TOKEN_BUDGETS = {
+    "card": int(os.environ.get("TOKEN_BUDGET_CARD", 1200)),
+    "card_bariatric": int(os.environ.get("TOKEN_BUDGET_CARD_BARIATRIC", 1500)),
+    "pair": int(os.environ.get("TOKEN_BUDGET_PAIR", 2800)),
+    "repair": int(os.environ.get("TOKEN_BUDGET_REPAIR", 800)),
+}
+TOKEN_BUDGET_PER_TITLE = int(os.environ.get("TOKEN_BUDGET_PER_TITLE", 24))
+# A card cut off at its budget (finish_reason "length") is never cached or stored: it is asked
+# again once with this many times the budget, then fails. 1 or less fails straight away.
+TOKEN_BUDGET_RETRY = float(os.environ.get("TOKEN_BUDGET_RETRY", 2))
+# Send a prompt_cache_key per prompt kind, so calls sharing a prompt prefix reach the same
+# provider-side prompt cache (only prompts past its minimum size are cached; see the prompts
+# section). Turn off for OpenAI-compatible servers that reject the field.
+OPENAI_PROMPT_CACHE_KEYS = os.environ.get("OPENAI_PROMPT_CACHE_KEYS", "1").strip().lower() not in ("0", "false", "no", "off")
+
+# Shared HTTP pool: one keep-alive pool per process instead of one per call.
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", 64))
+OPENAI_MAX_KEEPALIVE = int(os.environ.get("OPENAI_MAX_KEEPALIVE", 32))
+OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", 60))
+OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", 120))
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get("OPENAI_CONNECT_TIMEOUT", 10))
+
+_client_lock = threading.Lock()
+_clients = {}  # kind -> (fingerprint, client)
+
+def _client_fingerprint() -> tuple:
+    return tuple(os.getenv(k) for k in
+                 ("OPENAI_API_KEY", "OPENAI_BASE_URL", "OPENAI_MODEL", "OPENAI_IMAGE_MODEL", "OPENAI_BACKEND"))
+
+def _mock_backend() -> bool:
+    """OPENAI_BACKEND=mock sends every call to the in-process stand-in server in mock_openai.py."""
+    return os.getenv("OPENAI_BACKEND", "openai").strip().lower() == "mock"
+
+def _backend_options() -> dict:
+    if not _mock_backend():
+        return {}
+    import mock_openai
+    return dict(base_url=mock_openai.ensure_server().base_url, api_key="mock")
+
+def _refresh_models() -> None:
+    global OPENAI_MODEL, OPENAI_IMAGE_MODEL
+    OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
+    OPENAI_IMAGE_MODEL = os.environ.get("OPENAI_IMAGE_MODEL", "gpt-image-1")
+
+def _http_options() -> dict:
+    return dict(
+        limits=httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS,
+                            max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+                            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY),
+        timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+    )
+
+def _shared_client(kind: str, key: tuple, build: Callable[[], Any]) -> Tuple[Optional[Any], Optional[str]]:
+    if not _load_sdk():
         return None, "OpenAI SDK not installed. Add openai>=1.50.0 to requirements.txt"
-    if not os.getenv("OPENAI_API_KEY"):
+    if not os.getenv("OPENAI_API_KEY") and not _mock_backend():
         return None, "Missing OPENAI_API_KEY environment variable"
+    with _client_lock:
+        cached = _clients.get(kind)
+        if cached and cached[0] == key:
+            return cached[1], None
+        try:
+            client = build()
+        except Exception as e:
+            return None, f"Failed to initialize OpenAI client: {e}"
+        _refresh_models()
+        _clients[kind] = (key, client)
+        return client, None
+
+def _client_or_error() -> Tuple[Optional["OpenAI"], Optional[str]]:
+    """Return the process-wide client, rebuilt only when the key or model env vars change."""
+    return _shared_client(
+        "sync", _client_fingerprint(),
+        lambda: OpenAI(http_client=httpx.Client(**_http_options()), max_retries=0, **_backend_options()),
+    )
+
+def _async_client_or_error() -> Tuple[Optional["AsyncOpenAI"], Optional[str]]:
+    """Async counterpart of _client_or_error; pooled per event loop."""
     try:
-        return OpenAI(), None
-    except Exception as e:
-        return None, f"Failed to initialize OpenAI client: {e}"
+        loop_id = id(asyncio.get_running_loop())
+    except RuntimeError:
+        loop_id = None
+    return _shared_client(
+        f"async:{loop_id}", _client_fingerprint(),
+        lambda: AsyncOpenAI(http_client=httpx.AsyncClient(**_http_options()), max_retries=0,
+                            **_backend_options()),
+    )
 
 # ================= helpers =================
 def _split_lines_keep_nonempty(text: str) -> List[str]:
     return [ln for ln in (l.strip() for l in text.splitlines()) if ln]
 
-def _parse_titles_unique_numbered(text: str) -> List[str]:
-    seen = set()
+def _parse_titles(text: str) -> List[str]:
     out = []
     for raw in _split_lines_keep_nonempty(text):
         cleaned = re.sub(r"^\s*(?:\d+\s*[.)]|[-*•]+)\s*", "", raw, count=1).strip()
         if cleaned:
-            key = cleaned.lower()
-            if key not in seen:
-                seen.add(key)
-                out.append(cleaned)
-    return [f"{i + 1}. {t}" for i, t in enumerate(out)]
+            out.append(cleaned)
+    return out
+
+def _number_titles(titles: List[str]) -> List[str]:
+    return [f"{i + 1}. {t}" for i, t in enumerate(titles)]
+
+def _parse_titles_unique_numbered(text: str) -> List[str]:
+    return _number_titles(title_dedup.dedupe(_parse_titles(text)))
 
+@metrics.instrument("recipe_postprocess_seconds", step="strip_markdown")
 def _strip_markdown(md: str) -> str:
     if not md:
         return ""
@@ -129,6 +199,12 @@ def _strip_markdown(md: str) -> str:
     txt = re.sub(r"\n{3,}", "\n\n", txt)
     return txt.strip()
 
+def _strip_markdown_line(line: str) -> str:
+    txt = re.sub(r"[*_`]{1,2}", "", line)
+    txt = re.sub(r"^•\s*", "- ", txt)
+    return re.sub(r"^#+\s*", "", txt)
+
+@metrics.instrument("recipe_postprocess_seconds", step="first_bullet_enforcer")
 def _first_bullet_enforcer(md: str) -> str:
     def _fix(section: str, text: str) -> str:
         pattern = rf"(\*\*{re.escape(section)}:\*\*)"
@@ -139,24 +215,234 @@ def _first_bullet_enforcer(md: str) -> str:
     md = _fix("Storage", md)
     return md
 
-def _safe_backoff(fn: Callable[[], Any], retries: int = 3, base: float = 0.8) -> Any:
+def _finish_markdown(md: str, bariatric: bool) -> str:
+    """Final post-processing of a markdown card: bullets, then locally computed nutrition facts."""
+    md = _first_bullet_enforcer(md)
+    if not NUTRITION_ENGINE:
+        return md
+    import nutrition  # pandas; loaded with the first card
+    return nutrition.fill_markdown(md, bariatric)
+
+_BULLET_HEADER_RE = re.compile(r"^\*\*(?:Ingredients|Storage):\*\*$", re.IGNORECASE)
+
+class _CardStream:
+    """Builds a recipe card from streamed deltas.
+
+    Completed lines go through _first_bullet_enforcer and _strip_markdown once and
+    are kept, so each update only re-processes the unfinished last line while the
+    markdown and the plain-text copy stay in step.
+    """
+
+    def __init__(self):
+        self.raw = ""
+        self._pending = ""
+        self._md_lines: List[str] = []
+        self._txt_lines: List[str] = []
+        self._after_header = False
+
+    def feed(self, delta: str) -> bool:
+        """Add a delta; returns True when at least one line was completed."""
+        self.raw += delta
+        self._pending += delta
+        *complete, self._pending = self._pending.split("\n")
+        for line in complete:
+            self._commit(line)
+        return bool(complete)
+
+    def _render_line(self, line: str) -> List[str]:
+        if self._after_header:
+            line = line.lstrip()
+        return _first_bullet_enforcer(line).rstrip("\n").split("\n")
+
+    def _commit(self, line: str) -> None:
+        if not line.strip() and (self._after_header or not self._md_lines):
+            return  # the enforcer folds blank lines under a header; leading blanks are stripped
+        for part in self._render_line(line):
+            self._md_lines.append(part)
+            self._txt_lines.append(_strip_markdown_line(part))
+        self._after_header = bool(_BULLET_HEADER_RE.match(self._md_lines[-1].strip()))
+
+    def markdown(self) -> str:
+        tail = self._render_line(self._pending) if self._pending.strip() else []
+        return "\n".join(self._md_lines + tail).strip()
+
+    def text(self) -> str:
+        tail = self._render_line(self._pending) if self._pending.strip() else []
+        txt = "\n".join(self._txt_lines + [_strip_markdown_line(t) for t in tail])
+        return re.sub(r"\n{3,}", "\n\n", txt).strip()
+
+def _retry_delay(e: Exception, attempt: int, retries: int, base: float,
+                 limiter: Optional[rate_limit.AdaptiveRateLimiter], op: str) -> Optional[float]:
+    """Seconds to wait before the next attempt, or None to give up; counted in the metrics."""
+    kind = rate_limit.classify_error(e)
+    rate_limit.breaker.record(kind)
+    delay = rate_limit.next_delay(e, attempt, base, random.random() * 0.25, limiter)
+    if delay is None or attempt == retries - 1:
+        metrics.inc("recipe_api_errors_total", op=op, error=kind)
+        return None
+    metrics.inc("recipe_api_retries_total", op=op, error=kind)
+    metrics.inc("recipe_api_backoff_seconds_total", delay, op=op)
+    return delay
+
+def _quota_wait(limiter: Optional[rate_limit.AdaptiveRateLimiter], tokens: int, op: str) -> float:
+    wait = limiter.reserve(tokens) if limiter is not None else 0.0
+    if wait > 0:
+        metrics.inc("recipe_api_quota_wait_seconds_total", wait, op=op)
+    return wait
+
+def _safe_backoff(fn: Callable[[], Any], retries: int = 3, base: float = 0.8,
+                  limiter: Optional[rate_limit.AdaptiveRateLimiter] = None, tokens: int = 0, op: str = "chat") -> Any:
+    """Call ``fn`` with quota pacing, error-class-aware retries and the circuit breaker.
+
+    Each attempt first waits for ``limiter`` (requests and ~``tokens`` tokens). Only
+    rate-limit, server, network and unknown errors are retried, honoring Retry-After;
+    client errors (bad request, auth) raise at once, as does an open breaker.
+    """
     for attempt in range(retries):
+        trial = rate_limit.breaker.check()
         try:
-            return fn()
-        except Exception:
-            if attempt == retries - 1:
+            wait = _quota_wait(limiter, tokens, op)
+            if wait > 0:
+                time.sleep(wait)
+            result = fn()
+        except Exception as e:
+            trial = False  # _retry_delay records the outcome
+            delay = _retry_delay(e, attempt, retries, base, limiter, op)
+            if delay is None:
+                raise
+            time.sleep(delay)
+        else:
+            trial = False
+            rate_limit.breaker.record(None)
+            if limiter is not None:
+                limiter.on_success()
+            return result
+        finally:
+            if trial:  # interrupted before an outcome: do not leave the breaker waiting on it
+                rate_limit.breaker.release()
+
+async def _safe_backoff_async(fn: Callable[[], Any], retries: int = 3, base: float = 0.8,
+                              limiter: Optional[rate_limit.AdaptiveRateLimiter] = None, tokens: int = 0,
+                              op: str = "chat") -> Any:
+    """_safe_backoff for coroutines; sleeps with asyncio so the event loop keeps serving others."""
+    for attempt in range(retries):
+        trial = rate_limit.breaker.check()
+        try:
+            wait = _quota_wait(limiter, tokens, op)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            result = await fn()
+        except Exception as e:
+            trial = False
+            delay = _retry_delay(e, attempt, retries, base, limiter, op)
+            if delay is None:
                 raise
-            sleep_s = base * (2 ** attempt) + random.random() * 0.25
-            time.sleep(sleep_s)
+            await asyncio.sleep(delay)
+        else:
+            trial = False
+            rate_limit.breaker.record(None)
+            if limiter is not None:
+                limiter.on_success()
+            return result
+        finally:
+            if trial:  # cancelled (e.g. the UI stream closed) before an outcome
+                rate_limit.breaker.release()
+
+class _ApiLimiter:
+    """Global and per-session caps on in-flight async API calls, with queue-depth counters.
+
+    A session can hold at most ``session_limit`` slots, so one user's 1000-title
+    job leaves global slots free for everyone else's single recipe.
+    """
+
+    def __init__(self, global_limit: int, session_limit: int):
+        self.global_limit = max(int(global_limit), 1)
+        self.session_limit = max(int(session_limit), 1)
+        self._global: Optional[asyncio.Semaphore] = None
+        self._sessions: Dict[str, list] = {}  # session -> [semaphore, holders + waiters]
+        self.waiting = 0
+        self.inflight = 0
+        self.peak_waiting = 0
+        self.completed = 0
+
+    @asynccontextmanager
+    async def slot(self, session: Optional[str] = None):
+        if self._global is None:
+            self._global = asyncio.Semaphore(self.global_limit)
+        entry = None
+        if session:
+            entry = self._sessions.setdefault(session, [asyncio.Semaphore(self.session_limit), 0])
+            entry[1] += 1
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        acquired_session = acquired_global = False
+        try:
+            if entry:
+                await entry[0].acquire()
+                acquired_session = True
+            await self._global.acquire()
+            acquired_global = True
+            self.waiting -= 1
+            self.inflight += 1
+            try:
+                yield
+            finally:
+                self.inflight -= 1
+                self.completed += 1
+        finally:
+            if not acquired_global:
+                self.waiting -= 1
+            else:
+                self._global.release()
+            if entry:
+                if acquired_session:
+                    entry[0].release()
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._sessions.pop(session, None)
+
+    def snapshot(self) -> Dict[str, int]:
+        return dict(inflight=self.inflight, waiting=self.waiting, peak_waiting=self.peak_waiting,
+                    active_sessions=len(self._sessions), completed=self.completed,
+                    global_limit=self.global_limit, session_limit=self.session_limit)
+
+_api_limiter = _ApiLimiter(APP_MAX_INFLIGHT, SESSION_MAX_INFLIGHT)
+
+def _metric_gauges():
+    """Limiter, rate-limit and cache state as gauges, read on each /metrics scrape."""
+    for name, value in _api_limiter.snapshot().items():
+        yield f"recipe_api_limiter_{name}", {}, value
+    rl = rate_limit.snapshot()
+    for op in ("chat", "image"):
+        for name in ("rpm", "factor", "throttled", "paused_for"):
+            if isinstance(rl[op].get(name), (int, float)):
+                yield f"recipe_rate_limit_{name}", {"op": op}, rl[op][name]
+    yield "recipe_circuit_open", {}, 0 if rl["breaker"] == "closed" else 1
+    for name, value in get_cache().stats().items():
+        if isinstance(value, (int, float)):
+            yield f"recipe_cache_{name}", {}, value
+    yield "recipe_prefetch_queued", {}, len(_prefetcher)
+
+metrics.collect(_metric_gauges)
 
 # ================= prompts =================
+# Every prompt puts its static part (instructions, template) first and the title, subject or
+# title list last, so all calls of one kind share a prefix. Providers only cache prompts of
+# 1024 tokens or more: the single-card, pack and markdown pair prompts are shorter, so today
+# only structured (RECIPE_OUTPUT=json) pair calls reuse a cached prefix (`python
+# token_budget.py` shows each kind). Templates show RECIPE_TITLE_PLACEHOLDER where the card's title goes.
+RECIPE_TITLE_PLACEHOLDER = "Recipe Title"
+
 LIST_SYSTEM = (
     "You are ChatGPT. When asked for recipe titles, respond with titles only, one per line. "
     "No commentary or numbering unless explicitly requested. Titles must be realistic, literal recipes."
 )
 LIST_USER_TEMPLATE = (
-    "Generate exactly {count} recipe titles for the subject: {subject}.\n"
-    "Return titles only, one per line."
+    "Return titles only, one per line.\n"
+    "Generate exactly {count} recipe titles for the subject: {subject}."
+)
+LIST_AVOID_TEMPLATE = (
+    "\nThese titles already exist. Do not repeat them or close variations of them:\n{avoid}"
 )
 
 RECIPE_SYSTEM_STANDARD = (
@@ -195,12 +481,14 @@ Calories X | Protein X g | Total Fat X g (Y g sat | 0 g trans) | Carbohydrates X
 """
 
 RECIPE_USER_TEMPLATE_STANDARD = (
-    "Write a recipe card titled '{title}' using the exact markdown structure shown below. "
-    "Ensure the first bullet under 'Ingredients:' and 'Storage:' begins on the next line. "
-    "Include a complete ingredient list with no missing items.\n\n" + RECIPE_TEMPLATE_STANDARD
+    "Use the exact markdown structure shown below, with the requested title in place of '"
+    + RECIPE_TITLE_PLACEHOLDER + "'. Ensure the first bullet under 'Ingredients:' and 'Storage:' begins on the "
+    "next line. Include a complete ingredient list with no missing items.\n\n"
+    + RECIPE_TEMPLATE_STANDARD.format(title=RECIPE_TITLE_PLACEHOLDER)
+    + "\nWrite the recipe card titled '{title}'."
 )
 
-RECIPE_SYSTEM_BARIATRIC = (
+BARIATRIC_GUIDELINES = (
     "You are generating a recipe card optimized for bariatric patients following a four stage program:\n"
     "Stage 1: Clear liquids and protein supplements\n"
     "Stage 2: Modified liquids strained or blended\n"
@@ -209,6 +497,9 @@ RECIPE_SYSTEM_BARIATRIC = (
     "Select the appropriate stage s for the recipe based on texture and ingredients. "
     "Prioritize lean protein, moderate healthy fats, limited added sugars, modest portions, and stage appropriate textures. "
     "Do not mention any program or hospital name on the card. "
+)
+
+RECIPE_SYSTEM_BARIATRIC = BARIATRIC_GUIDELINES + (
     "The output must follow the same markdown structure as the standard recipe including bullet placement rules."
 )
 
@@ -248,73 +539,1503 @@ Calories X | Protein X g | Fat X g (Y g sat | 0 g trans) | Carbohydrates X g | F
 """
 
 RECIPE_USER_TEMPLATE_BARIATRIC = (
-    "Write a bariatric recipe titled '{title}' in the exact markdown structure below. "
-    "Each section must start on a new line with bullets directly beneath 'Ingredients:' and 'Storage:'. "
+    "Use the exact markdown structure below, with the requested title in place of '" + RECIPE_TITLE_PLACEHOLDER
+    + "'. Each section must start on a new line with bullets directly beneath 'Ingredients:' and 'Storage:'. "
     "Ensure the ingredient list is fully populated with no missing bullets. Do not mention any hospital or program names.\n\n"
-    + RECIPE_TEMPLATE_BARIATRIC
+    + RECIPE_TEMPLATE_BARIATRIC.format(title=RECIPE_TITLE_PLACEHOLDER)
+    + "\nWrite the bariatric recipe titled '{title}'."
 )
 
+# Structured output (RECIPE_OUTPUT=json): the layout lives in recipe_schema, so the
+# prompts only describe the content.
+RECIPE_JSON_SYSTEM_STANDARD = (
+    "Return a single realistic recipe card as JSON matching the provided schema. "
+    "Include a complete ingredient list with quantities, short clear direction steps, "
+    "storage notes and estimated nutrition per serving."
+)
+RECIPE_JSON_SYSTEM_BARIATRIC = BARIATRIC_GUIDELINES + (
+    "Return the card as JSON matching the provided schema, with a complete ingredient list, "
+    "stage appropriate directions, bariatric substitutions and estimated nutrition per serving."
+)
+RECIPE_JSON_USER_STANDARD = "Write a recipe card titled '{title}'."
+RECIPE_JSON_USER_BARIATRIC = "Write a bariatric recipe titled '{title}'."
+
+# Packed requests (chatgpt_generate_recipe_pack): several numbered titles per call, the
+# instructions and template sent once. Markdown cards are split on the RECIPE_PACK_MARKER lines.
+RECIPE_PACK_MARKER = "=== RECIPE {n} ==="
+RECIPE_PACK_SYSTEM_STANDARD = (
+    "Output one recipe card per requested title, each using the exact markdown layout below. "
+    "Each section must begin on its own line, with the first bullet appearing directly under the 'Ingredients:' "
+    "and 'Storage:' headers. Include a complete, realistic ingredient list. Preserve bold labels and spacing exactly."
+)
+RECIPE_PACK_SYSTEM_BARIATRIC = BARIATRIC_GUIDELINES + (
+    "Write one card per requested title. Every card must follow the same markdown structure as the standard "
+    "recipe including bullet placement rules."
+)
+RECIPE_PACK_LAYOUT = (
+    "Start each card with a line '" + RECIPE_PACK_MARKER.format(n="n") + "' where n is the title's number, "
+    "followed by the card in the exact markdown structure below. Include a complete ingredient list in every card.\n\n"
+)
+RECIPE_PACK_USER = "\nWrite {count} recipe cards, one for each numbered title below, in the same order.\n\n{titles}"
+RECIPE_PACK_JSON_SYSTEM_STANDARD = (
+    "Return realistic recipe cards as JSON matching the provided schema, one card per requested title. "
+    "Each card has a complete ingredient list with quantities, short clear direction steps, "
+    "storage notes and estimated nutrition per serving."
+)
+RECIPE_PACK_JSON_SYSTEM_BARIATRIC = BARIATRIC_GUIDELINES + (
+    "Return one card per requested title as JSON matching the provided schema, each with a complete ingredient "
+    "list, stage appropriate directions, bariatric substitutions and estimated nutrition per serving."
+)
+RECIPE_PACK_JSON_USER = (
+    "Write one recipe card for each numbered title below, as the 'recipes' array in the same order. "
+    "Keep every title exactly as written.\n\n{count} titles:\n{titles}"
+)
+
+# Both variants of one title (chatgpt_generate_recipe_pair): the dish is worked out once and
+# written twice. Markdown cards are split on the RECIPE_PAIR_MARKERS lines.
+RECIPE_PAIR_MARKERS = ("=== STANDARD ===", "=== BARIATRIC ===")
+RECIPE_PAIR_SYSTEM = (
+    "Output two recipe cards for the same dish: a standard card, then a bariatric version of it, each using the "
+    "exact markdown layout shown for it. Each section must begin on its own line, with the first bullet appearing "
+    "directly under the 'Ingredients:' and 'Storage:' headers. Include a complete, realistic ingredient list in both "
+    "cards. Preserve bold labels and spacing exactly.\nFor the bariatric card: " + BARIATRIC_GUIDELINES
+)
+RECIPE_PAIR_USER = (
+    "Start the standard card with a line '" + RECIPE_PAIR_MARKERS[0] + "' and the bariatric card with a line '"
+    + RECIPE_PAIR_MARKERS[1] + "', each followed by the card in the exact markdown structure shown below, with the "
+    "requested title in place of '" + RECIPE_TITLE_PLACEHOLDER + "'. The bariatric card adapts the same dish: its "
+    "stages, textures, portions and substitutions. Do not mention any hospital or program names.\n\n"
+    + RECIPE_PAIR_MARKERS[0] + "\n" + RECIPE_TEMPLATE_STANDARD.format(title=RECIPE_TITLE_PLACEHOLDER) + "\n"
+    + RECIPE_PAIR_MARKERS[1] + "\n" + RECIPE_TEMPLATE_BARIATRIC.format(title=RECIPE_TITLE_PLACEHOLDER)
+    + "\nWrite the standard and the bariatric recipe card titled '{title}'."
+)
+RECIPE_PAIR_JSON_SYSTEM = (
+    "Return two recipe cards for the same dish as JSON matching the provided schema. 'standard' is a realistic "
+    "recipe card with a complete ingredient list with quantities, short clear direction steps, storage notes and "
+    "estimated nutrition per serving. 'bariatric' adapts the same dish, with stage appropriate directions, "
+    "bariatric substitutions and estimated nutrition per serving.\nFor the bariatric card: " + BARIATRIC_GUIDELINES
+)
+RECIPE_PAIR_JSON_USER = "Write a standard and a bariatric recipe card titled '{title}'."
+
 # ================= image generator =================
-def chatgpt_generate_image(title: str) -> Optional[str]:
+IMAGE_PROMPT_TEMPLATE = "Professional plating photo of {title}, natural lighting, clean background."
+
+OPENAI_IMAGE_SIZE = os.environ.get("OPENAI_IMAGE_SIZE", "1024x1024")
+OPENAI_IMAGE_QUALITY = os.environ.get("OPENAI_IMAGE_QUALITY", "")  # e.g. "low"/"medium" on gpt-image-1; empty = provider default
+
+def _image_request(title: str) -> dict:
+    req = dict(model=OPENAI_IMAGE_MODEL, prompt=IMAGE_PROMPT_TEMPLATE.format(title=title), size=OPENAI_IMAGE_SIZE)
+    if OPENAI_IMAGE_QUALITY:
+        req["quality"] = OPENAI_IMAGE_QUALITY
+    return req
+
+def _image_bytes(img: Any) -> Tuple[Optional[bytes], str]:
+    """First generated image as bytes: inline base64, or downloaded once from its temporary URL."""
+    item = img.data[0] if img and img.data else None
+    if item is None:
+        return None, ""
+    if getattr(item, "b64_json", None):
+        return base64.b64decode(item.b64_json), "b64_json"
+    if getattr(item, "url", None):
+        return image_store.fetch(item.url), item.url
+    return None, ""
+
+def _generate_image_uncached(title: str) -> Optional[str]:
     client, err = _client_or_error()
     if err:
         return None
-    prompt = f"Professional plating photo of {title}, natural lighting, clean background."
     try:
-        def _call():
-            return client.images.generate(model=OPENAI_IMAGE_MODEL, prompt=prompt, size="1024x1024")
-        img = _safe_backoff(_call, retries=2)
-        return img.data[0].url if img and img.data else None
+        with metrics.timed("recipe_image_seconds", mode="sync"):
+            def _call():
+                return client.images.generate(**_image_request(title))
+            img = _safe_backoff(_call, retries=2, limiter=rate_limit.image_limiter, op="image")
+            data, source = _image_bytes(img)
+            sha = image_store.get_store().put(title, data, source) if data else None
     except Exception:
         traceback.print_exc()
+        sha = None
+    if sha is None:
+        metrics.inc("recipe_image_failures_total", mode="sync")
+    return sha
+
+def chatgpt_generate_image(title: str, refresh: bool = False) -> Optional[str]:
+    """Content hash of the stored photo for ``title`` (see image_store); generated only when none is stored."""
+    if not refresh:
+        sha = image_store.get_store().lookup(title)
+        if sha:
+            return sha
+    return _image_flight.do(recipe_store.title_key(title), lambda: _generate_image_uncached(title))
+
+async def _agenerate_image_uncached(title: str, session: Optional[str] = None) -> Optional[str]:
+    client, err = _async_client_or_error()
+    if err:
         return None
+    try:
+        with metrics.timed("recipe_image_seconds", mode="async"):
+            async def _call():
+                async with _api_limiter.slot(session):
+                    return await client.images.generate(**_image_request(title))
+            img = await _safe_backoff_async(_call, retries=2, limiter=rate_limit.image_limiter, op="image")
+            # Download and resizing block, so they run off the event loop.
+            data, source = await asyncio.to_thread(_image_bytes, img)
+            sha = await asyncio.to_thread(image_store.get_store().put, title, data, source) if data else None
+    except Exception:
+        traceback.print_exc()
+        sha = None
+    if sha is None:
+        metrics.inc("recipe_image_failures_total", mode="async")
+    return sha
+
+async def achatgpt_generate_image(title: str, refresh: bool = False, session: Optional[str] = None) -> Optional[str]:
+    if not refresh:
+        sha = image_store.get_store().lookup(title)
+        if sha:
+            return sha
+    return await _image_flight.ado(recipe_store.title_key(title),
+                                   lambda: _agenerate_image_uncached(title, session=session))
+
+def recipe_photo(title: str, refresh: bool = False) -> str:
+    """Print-resolution photo path for the databank Photo column ("" when no image could be made)."""
+    sha = chatgpt_generate_image(title, refresh)
+    return image_store.get_store().variant_path(sha, "print") if sha else ""
 
 # ================= chat completions =================
-def _chat(model: str, system_prompt: str, user_prompt: str) -> str:
+class _Truncated(RuntimeError):
+    """A reply that stopped at its output-token limit (finish_reason "length")."""
+
+def _truncated(resp: Any) -> bool:
+    return getattr(resp.choices[0], "finish_reason", None) == "length"
+
+def _request_options(kind: str, response_format: Optional[dict], max_tokens: Optional[int],
+                     stream: bool = False) -> dict:
+    """Extra chat.completions.create arguments: structured output, the kind's output-token
+    budget (TOKEN_BUDGETS unless ``max_tokens`` is given), its prompt-cache key, and usage on streams."""
+    extra: Dict[str, Any] = {"response_format": response_format} if response_format else {}
+    budget = TOKEN_BUDGETS.get(kind, 0) if max_tokens is None else max_tokens
+    if budget:
+        extra["max_completion_tokens"] = int(budget)
+    if OPENAI_PROMPT_CACHE_KEYS:
+        extra["extra_body"] = {"prompt_cache_key": f"recipe-{kind}"}
+    if stream:
+        extra["stream_options"] = {"include_usage": True}
+    return extra
+
+def _count_tokens(usage: Any, prompt_estimate: int, text: str, kind: str = "chat") -> None:
+    """Prompt, cached prompt and completion tokens from the response's usage, per prompt kind.
+
+    Without usage (a stream cut short) they are estimated at ~4 characters per token.
+    """
+    prompt = getattr(usage, "prompt_tokens", None)
+    completion = getattr(usage, "completion_tokens", None)
+    cached = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None) or 0
+    metrics.inc("recipe_api_tokens_total", prompt if prompt is not None else prompt_estimate,
+                op="chat", kind=kind, direction="in")
+    metrics.inc("recipe_api_tokens_total", cached, op="chat", kind=kind, direction="cached")
+    metrics.inc("recipe_api_tokens_total", completion if completion is not None else rate_limit.estimate_tokens(text),
+                op="chat", kind=kind, direction="out")
+
+def token_usage() -> Dict[str, Dict[str, int]]:
+    """Chat tokens so far by prompt kind: {"in", "cached", "out"} (cached is part of in)."""
+    out: Dict[str, Dict[str, int]] = {}
+    for key, value in metrics.REGISTRY.counter_values("recipe_api_tokens_total").items():
+        labels = dict(key)
+        if labels.get("op") == "chat":
+            out.setdefault(labels.get("kind", "chat"), {"in": 0, "cached": 0, "out": 0})[labels["direction"]] += int(value)
+    return out
+
+def _chat_response(model: str, system_prompt: str, user_prompt: str, response_format: Optional[dict] = None,
+                   completion: int = CHAT_COMPLETION_ESTIMATE, kind: str = "chat",
+                   max_tokens: Optional[int] = None) -> Tuple[Any, str]:
+    """(full response, stripped text) of one completion, for callers that need usage or finish_reason.
+
+    ``completion`` is the expected completion size, for the limiter's token pacing; ``kind``
+    names the prompt for its output budget, prompt-cache key and token accounting.
+    """
+    client, err = _client_or_error()
+    if err:
+        raise RuntimeError(err)
+    extra = _request_options(kind, response_format, max_tokens)
+    def _call():
+        return client.chat.completions.create(
+            model=model,
+            messages=[{"role": "system", "content": system_prompt},
+                      {"role": "user", "content": user_prompt}],
+            temperature=0.7,
+            **extra,
+        )
+    try:
+        with metrics.timed("recipe_api_seconds", op="chat", mode="sync"):
+            resp = _safe_backoff(_call, retries=3, limiter=rate_limit.chat_limiter,
+                                 tokens=rate_limit.estimate_tokens(system_prompt, user_prompt, completion=completion))
+        text = (resp.choices[0].message.content or "").strip()
+    except Exception as e:
+        raise RuntimeError(f"{type(e).__name__}: {e}")
+    _count_tokens(getattr(resp, "usage", None), rate_limit.estimate_tokens(system_prompt, user_prompt), text, kind)
+    return resp, text
+
+def _chat(model: str, system_prompt: str, user_prompt: str, response_format: Optional[dict] = None,
+          kind: str = "chat", max_tokens: Optional[int] = None) -> str:
+    return _chat_response(model, system_prompt, user_prompt, response_format, kind=kind, max_tokens=max_tokens)[1]
+
+def _chat_stream(model: str, system_prompt: str, user_prompt: str, response_format: Optional[dict] = None,
+                 kind: str = "chat", max_tokens: Optional[int] = None) -> Iterator[str]:
+    """Streamed variant of _chat yielding content deltas.
+
+    Retries only cover opening the stream; once tokens have been yielded a failure
+    is raised rather than replayed, so callers never see duplicated text. A reply cut
+    off at its output-token limit raises _Truncated after its last delta.
+    """
     client, err = _client_or_error()
     if err:
         raise RuntimeError(err)
+    extra = _request_options(kind, response_format, max_tokens, stream=True)
     def _call():
-        resp = client.chat.completions.create(
+        return client.chat.completions.create(
             model=model,
             messages=[{"role": "system", "content": system_prompt},
                       {"role": "user", "content": user_prompt}],
             temperature=0.7,
+            stream=True,
+            **extra,
         )
-        return (resp.choices[0].message.content or "").strip()
+    parts: List[str] = []
+    usage = finish = None
+    start = time.perf_counter()
     try:
-        return _safe_backoff(_call, retries=3)
+        with metrics.timed("recipe_api_seconds", op="chat", mode="stream"):
+            stream = _safe_backoff(_call, retries=3, limiter=rate_limit.chat_limiter,
+                                   tokens=rate_limit.estimate_tokens(system_prompt, user_prompt, completion=CHAT_COMPLETION_ESTIMATE))
+            for chunk in stream:
+                usage = getattr(chunk, "usage", None) or usage  # the last chunk, with include_usage
+                if chunk.choices:
+                    finish = chunk.choices[0].finish_reason or finish
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if not parts:
+                        metrics.observe("recipe_api_first_token_seconds", time.perf_counter() - start, op="chat", mode="stream")
+                    parts.append(chunk.choices[0].delta.content)
+                    yield parts[-1]
     except Exception as e:
         raise RuntimeError(f"{type(e).__name__}: {e}")
+    finally:
+        _count_tokens(usage, rate_limit.estimate_tokens(system_prompt, user_prompt), "".join(parts), kind)
+    if finish == "length":
+        raise _Truncated(f"reply cut off at {extra.get('max_completion_tokens', 'the model')} output tokens")
+
+async def _achat(model: str, system_prompt: str, user_prompt: str, session: Optional[str] = None,
+                 response_format: Optional[dict] = None, kind: str = "chat",
+                 max_tokens: Optional[int] = None) -> str:
+    """Async _chat on the shared AsyncOpenAI client, gated by _api_limiter."""
+    client, err = _async_client_or_error()
+    if err:
+        raise RuntimeError(err)
+    extra = _request_options(kind, response_format, max_tokens)
+    async def _call():
+        async with _api_limiter.slot(session):
+            return await client.chat.completions.create(
+                model=model,
+                messages=[{"role": "system", "content": system_prompt},
+                          {"role": "user", "content": user_prompt}],
+                temperature=0.7,
+                **extra,
+            )
+    try:
+        with metrics.timed("recipe_api_seconds", op="chat", mode="async"):
+            resp = await _safe_backoff_async(
+                _call, retries=3, limiter=rate_limit.chat_limiter,
+                tokens=rate_limit.estimate_tokens(system_prompt, user_prompt, completion=CHAT_COMPLETION_ESTIMATE))
+        text = (resp.choices[0].message.content or "").strip()
+    except Exception as e:
+        raise RuntimeError(f"{type(e).__name__}: {e}")
+    _count_tokens(getattr(resp, "usage", None), rate_limit.estimate_tokens(system_prompt, user_prompt), text, kind)
+    return text
+
+async def _achat_stream(model: str, system_prompt: str, user_prompt: str, session: Optional[str] = None,
+                        response_format: Optional[dict] = None, completion: int = CHAT_COMPLETION_ESTIMATE,
+                        kind: str = "chat", max_tokens: Optional[int] = None):
+    """Async _chat_stream; holds one limiter slot for the life of the stream."""
+    client, err = _async_client_or_error()
+    if err:
+        raise RuntimeError(err)
+    extra = _request_options(kind, response_format, max_tokens, stream=True)
+    async def _call():
+        return await client.chat.completions.create(
+            model=model,
+            messages=[{"role": "system", "content": system_prompt},
+                      {"role": "user", "content": user_prompt}],
+            temperature=0.7,
+            stream=True,
+            **extra,
+        )
+    parts: List[str] = []
+    usage = finish = None
+    start = time.perf_counter()
+    try:
+        with metrics.timed("recipe_api_seconds", op="chat", mode="astream"):
+            async with _api_limiter.slot(session):
+                stream = await _safe_backoff_async(
+                    _call, retries=3, limiter=rate_limit.chat_limiter,
+                    tokens=rate_limit.estimate_tokens(system_prompt, user_prompt, completion=completion))
+                async for chunk in stream:
+                    usage = getattr(chunk, "usage", None) or usage
+                    if chunk.choices:
+                        finish = chunk.choices[0].finish_reason or finish
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if not parts:
+                            metrics.observe("recipe_api_first_token_seconds", time.perf_counter() - start,
+                                            op="chat", mode="astream")
+                        parts.append(chunk.choices[0].delta.content)
+                        yield parts[-1]
+    except Exception as e:
+        raise RuntimeError(f"{type(e).__name__}: {e}")
+    finally:
+        _count_tokens(usage, rate_limit.estimate_tokens(system_prompt, user_prompt), "".join(parts), kind)
+    if finish == "length":
+        raise _Truncated(f"reply cut off at {extra.get('max_completion_tokens', 'the model')} output tokens")
+
+# ================= title engine =================
+def _title_batch_prompt(subject: str, count: int, avoid: List[str]) -> str:
+    prompt = LIST_USER_TEMPLATE.format(subject=subject, count=count)
+    if avoid:
+        prompt += LIST_AVOID_TEMPLATE.format(avoid="\n".join(avoid))
+    return prompt
+
+class _TitleCollector:
+    """Bookkeeping shared by the thread and asyncio title engines.
+
+    Tracks unique titles (near-duplicates dropped by title_dedup), plans the next batch prompts so requested-but-pending
+    counts never exceed what is still missing, and enforces the call budget.
+    """
+
+    def __init__(self, subject: str, count: int, batch_size: Optional[int], max_concurrency: Optional[int]):
+        self.subject = subject
+        self.count = max(int(count), 0)
+        self.batch_size = max(int(batch_size or TITLE_BATCH_SIZE), 1)
+        self.max_concurrency = max(int(max_concurrency or TITLE_MAX_CONCURRENCY), 1)
+        self.titles: List[str] = []
+        self.deduper = title_dedup.TitleDeduper(corpus=title_dedup.get_corpus() if TITLE_DEDUP_CORPUS else None)
+        self.calls_left = 2 * (-(-self.count // self.batch_size)) + 2
+        self.last_error: Optional[Exception] = None
+        self.cache_key = make_key("titles", OPENAI_MODEL, LIST_SYSTEM, LIST_USER_TEMPLATE, subject.strip(), self.count)
+        self.max_tokens = TOKEN_BUDGET_PER_TITLE * self.batch_size + 32 if TOKEN_BUDGET_PER_TITLE else 0
+
+    @property
+    def done(self) -> bool:
+        return len(self.titles) >= self.count
+
+    def next_batches(self, inflight: Dict[Any, int]) -> List[Tuple[int, str]]:
+        out = []
+        pending = sum(inflight.values())
+        while self.calls_left > 0 and len(inflight) + len(out) < self.max_concurrency:
+            missing = self.count - len(self.titles) - pending
+            if missing <= 0:
+                break
+            n = min(self.batch_size, missing)
+            # Near-duplicate filtering drops part of every batch, so ask for a few spare titles;
+            # only ``n`` count as pending and add() discards whatever is not needed.
+            ask = min(self.batch_size, n + max(2, n // 5))
+            out.append((n, _title_batch_prompt(self.subject, ask, self.titles[-TITLE_AVOID_SAMPLE:])))
+            pending += n
+            self.calls_left -= 1
+        return out
+
+    def add(self, text: str) -> bool:
+        if self.done:
+            return False
+        kept = self.deduper.filter(_parse_titles(text), limit=self.count - len(self.titles))
+        self.titles.extend(kept)
+        return bool(kept)
+
+    def finish(self) -> None:
+        if TITLE_DEDUP_CORPUS and self.titles:
+            title_dedup.get_corpus().add(self.titles, self.subject.strip())
+        if self.done:
+            get_cache().set(self.cache_key, self.titles)
+        elif not self.titles:
+            if self.last_error is not None:
+                raise RuntimeError(str(self.last_error))
+            raise RuntimeError("Empty response for titles")
+
+def iter_titles(subject: str, count: int, batch_size: Optional[int] = None,
+                max_concurrency: Optional[int] = None, refresh: bool = False) -> Iterator[List[str]]:
+    """Yield the growing list of unique (unnumbered) titles each time a batch finishes.
+
+    Batches of up to ``batch_size`` titles run concurrently, each one told about the
+    titles already collected, and shortfalls from duplicates are re-requested until
+    ``count`` unique titles exist or the call budget runs out. Complete lists are
+    cached per subject and count; ``refresh=True`` bypasses the cached list.
+    """
+    col = _TitleCollector(subject, count, batch_size, max_concurrency)
+    if col.count == 0:
+        return
+    cached = None if refresh else get_cache().get(col.cache_key)
+    if cached:
+        yield list(cached)
+        return
+
+    inflight: Dict[Future, int] = {}
+    pool = ThreadPoolExecutor(max_workers=col.max_concurrency)
+    try:
+        def _top_up():
+            for n, prompt in col.next_batches(inflight):
+                inflight[pool.submit(metrics.bind(_chat), OPENAI_MODEL, LIST_SYSTEM, prompt,
+                                     kind="titles", max_tokens=col.max_tokens)] = n
+
+        _top_up()
+        while inflight and not col.done:
+            done, _ = wait(list(inflight), return_when=FIRST_COMPLETED)
+            added = False
+            for fut in done:
+                inflight.pop(fut)
+                try:
+                    added = col.add(fut.result()) or added
+                except Exception as e:
+                    col.last_error = e
+            if not col.done:
+                _top_up()
+            if added:
+                yield list(col.titles)
+    finally:
+        # Don't wait on batches that are no longer needed.
+        pool.shutdown(wait=False, cancel_futures=True)
+    col.finish()
+
+async def aiter_titles(subject: str, count: int, batch_size: Optional[int] = None,
+                       max_concurrency: Optional[int] = None, refresh: bool = False,
+                       session: Optional[str] = None):
+    """asyncio counterpart of iter_titles for the UI; API calls go through _api_limiter."""
+    col = _TitleCollector(subject, count, batch_size, max_concurrency)
+    if col.count == 0:
+        return
+    cached = None if refresh else get_cache().get(col.cache_key)
+    if cached:
+        yield list(cached)
+        return
+
+    inflight: Dict[asyncio.Task, int] = {}
+    try:
+        def _top_up():
+            for n, prompt in col.next_batches(inflight):
+                task = asyncio.create_task(_achat(OPENAI_MODEL, LIST_SYSTEM, prompt, session=session,
+                                                  kind="titles", max_tokens=col.max_tokens))
+                inflight[task] = n
+
+        _top_up()
+        while inflight and not col.done:
+            done, _ = await asyncio.wait(list(inflight), return_when=asyncio.FIRST_COMPLETED)
+            added = False
+            for task in done:
+                inflight.pop(task)
+                try:
+                    added = col.add(task.result()) or added
+                except Exception as e:
+                    col.last_error = e
+            if not col.done:
+                _top_up()
+            if added:
+                yield list(col.titles)
+    finally:
+        for task in inflight:
+            task.cancel()
+    col.finish()
+
+def chatgpt_generate_titles(subject: str, count: int, refresh: bool = False) -> List[str]:
+    titles: List[str] = []
+    for titles in iter_titles(subject, count, refresh=refresh):
+        pass
+    return _number_titles(titles)
+
+STREAM_MIN_INTERVAL = float(os.environ.get("STREAM_MIN_INTERVAL", 0.1))  # seconds between UI updates
+
+# Card format: "markdown" (default) keeps the free-form template and the regex
+# post-processing; "json" opts into schema-validated structured output (recipe_schema).
+# The two are cached under different requests, so switching regenerates cards once.
+RECIPE_OUTPUT = os.environ.get("RECIPE_OUTPUT", "markdown").strip().lower()
+RECIPE_REPAIR_ATTEMPTS = int(os.environ.get("RECIPE_REPAIR_ATTEMPTS", 2))  # follow-up calls for invalid fields
+
+def _structured() -> bool:
+    return RECIPE_OUTPUT == "json"
+
+def _card_kind(bariatric: bool) -> str:
+    return "card_bariatric" if bariatric else "card"
+
+def _card_budgets(kind: str) -> List[Optional[int]]:
+    """Output budgets to ask for one card with: its kind's, then a larger one if that cut it off."""
+    budget = TOKEN_BUDGETS.get(kind, 0)
+    if not budget:
+        return [None]
+    larger = min(int(budget * TOKEN_BUDGET_RETRY), OPENAI_MAX_OUTPUT_TOKENS)
+    return [budget, larger] if larger > budget else [budget]
+
+def _cut_off(title: str, kind: str, budget: Optional[int], last: bool) -> None:
+    metrics.inc("recipe_truncated_total", kind=kind, outcome="failed" if last else "retried")
+    if last:
+        raise _Truncated(f"Recipe card for '{title}' was cut off at {budget or 'the model limit of'} output tokens")
+
+def _card_reply(title: str, kind: str, system_msg: str, user_msg: str,
+                response_format: Optional[dict] = None) -> str:
+    """A card's complete reply; one cut off at its output budget is asked again with a larger one."""
+    budgets = _card_budgets(kind)
+    for n, budget in enumerate(budgets, 1):
+        resp, text = _chat_response(OPENAI_MODEL, system_msg, user_msg, response_format=response_format,
+                                    kind=kind, max_tokens=budget)
+        if not _truncated(resp):
+            return text
+        _cut_off(title, kind, budget, n == len(budgets))
+    return ""
+
+def _card_stream(title: str, kind: str, system_msg: str, user_msg: str,
+                 response_format: Optional[dict] = None) -> Iterator[Optional[str]]:
+    """_chat_stream retried like _card_reply; None before a retry means the card starts over."""
+    budgets = _card_budgets(kind)
+    for n, budget in enumerate(budgets, 1):
+        try:
+            yield from _chat_stream(OPENAI_MODEL, system_msg, user_msg, response_format, kind=kind, max_tokens=budget)
+            return
+        except _Truncated:
+            _cut_off(title, kind, budget, n == len(budgets))
+            yield None
+
+async def _acard_stream(title: str, kind: str, system_msg: str, user_msg: str, session: Optional[str] = None,
+                        response_format: Optional[dict] = None):
+    budgets = _card_budgets(kind)
+    for n, budget in enumerate(budgets, 1):
+        try:
+            async for delta in _achat_stream(OPENAI_MODEL, system_msg, user_msg, session=session,
+                                             response_format=response_format, kind=kind, max_tokens=budget):
+                yield delta
+            return
+        except _Truncated:
+            _cut_off(title, kind, budget, n == len(budgets))
+            yield None
+
+def _recipe_json_request(title: str, bariatric: bool) -> Tuple[str, str, str]:
+    if bariatric:
+        system_msg, user_template = RECIPE_JSON_SYSTEM_BARIATRIC, RECIPE_JSON_USER_BARIATRIC
+    else:
+        system_msg, user_template = RECIPE_JSON_SYSTEM_STANDARD, RECIPE_JSON_USER_STANDARD
+    key = make_key("recipe_json", recipe_schema.SCHEMA_VERSION, OPENAI_MODEL, system_msg, user_template,
+                   title.strip(), bool(bariatric))
+    return key, system_msg, user_template.format(title=title)
+
+def _check_card(text: str, title: str, bariatric: bool) -> Tuple[Dict[str, Any], List[str]]:
+    try:
+        data = recipe_schema.parse(text)
+    except ValueError:
+        data = {}
+    if not data.get("title"):
+        data["title"] = title
+    return recipe_schema.validate(data, bariatric)
+
+def _merge_fix(recipe: Dict[str, Any], invalid: List[str], text: str, bariatric: bool) -> List[str]:
+    try:
+        data = recipe_schema.parse(text)
+    except ValueError:
+        return invalid
+    fixed, still_invalid = recipe_schema.validate(data, bariatric, only=invalid)
+    recipe.update(fixed)
+    return still_invalid
+
+def _finish_card(title: str, recipe: Dict[str, Any], invalid: List[str]) -> Dict[str, Any]:
+    if invalid:
+        raise RuntimeError(f"Recipe card for '{title}' has invalid fields: {', '.join(invalid)}")
+    if not NUTRITION_ENGINE:
+        return recipe
+    import nutrition
+    return nutrition.fill_card(recipe)
+
+def _repair_card(title: str, bariatric: bool, system_msg: str,
+                 recipe: Dict[str, Any], invalid: List[str]) -> Dict[str, Any]:
+    """Re-request only the invalid fields, up to RECIPE_REPAIR_ATTEMPTS times."""
+    for _ in range(RECIPE_REPAIR_ATTEMPTS):
+        if not invalid:
+            break
+        text = _chat(OPENAI_MODEL, system_msg, recipe_schema.repair_prompt(title, recipe, invalid),
+                     response_format=recipe_schema.response_format(bariatric, only=invalid), kind="repair")
+        invalid = _merge_fix(recipe, invalid, text, bariatric)
+    return _finish_card(title, recipe, invalid)
+
+async def _arepair_card(title: str, bariatric: bool, system_msg: str, recipe: Dict[str, Any],
+                        invalid: List[str], session: Optional[str] = None) -> Dict[str, Any]:
+    for _ in range(RECIPE_REPAIR_ATTEMPTS):
+        if not invalid:
+            break
+        text = await _achat(OPENAI_MODEL, system_msg, recipe_schema.repair_prompt(title, recipe, invalid),
+                            session=session, response_format=recipe_schema.response_format(bariatric, only=invalid),
+                            kind="repair")
+        invalid = _merge_fix(recipe, invalid, text, bariatric)
+    return await asyncio.to_thread(_finish_card, title, recipe, invalid)  # nutrition lookups block
+
+def _existing_card(key: str, title: str, bariatric: bool, refresh: bool) -> Any:
+    """A card to serve without calling the API: from the recipe store, else the response cache.
+
+    Cards only found in the cache (generated before the store existed) are copied
+    into the store. The card is a dict when structured, markdown otherwise.
+    """
+    if refresh:
+        return None
+    card = recipe_store.lookup(title, bariatric, _structured())
+    if not card:
+        card = get_cache().get(key)
+        if card:
+            recipe_store.save(title, bariatric, card, OPENAI_MODEL)
+    return card or None
 
-def chatgpt_generate_titles(subject: str, count: int) -> List[str]:
-    text = _chat(OPENAI_MODEL, LIST_SYSTEM, LIST_USER_TEMPLATE.format(subject=subject, count=count))
-    if not text.strip():
-        raise RuntimeError("Empty response for titles")
-    return _parse_titles_unique_numbered(text)
+def chatgpt_generate_recipe_card(title: str, bariatric: bool = False, refresh: bool = False) -> Dict[str, Any]:
+    """Structured card (see recipe_schema), validated, repaired field by field, cached and stored.
 
-def chatgpt_generate_recipe(title: str, bariatric: bool = False) -> str:
+    Concurrent calls for the same card share one generation.
+    """
+    key = _recipe_json_request(title, bariatric)[0]
+    existing = _existing_card(key, title, bariatric, refresh)
+    if existing:
+        return existing
+    return _card_flight.do(key, lambda: _new_recipe_card(title, bariatric, refresh))
+
+def _new_recipe_card(title: str, bariatric: bool, refresh: bool) -> Dict[str, Any]:
+    key, system_msg, user_msg = _recipe_json_request(title, bariatric)
+    def _compute():
+        text = _card_reply(title, _card_kind(bariatric), system_msg, user_msg,
+                           response_format=recipe_schema.response_format(bariatric))
+        recipe, invalid = _check_card(text, title, bariatric)
+        return _repair_card(title, bariatric, system_msg, recipe, invalid)
+    recipe = get_cache().get_or_compute(key, _compute, refresh=refresh)
+    recipe_store.save(title, bariatric, recipe, OPENAI_MODEL)
+    return recipe
+
+class _JsonCardStream:
+    """Renders a streamed JSON card from whatever fields have arrived so far."""
+
+    def __init__(self, bariatric: bool):
+        self.bariatric = bariatric
+        self.raw = ""
+
+    def feed(self, delta: str) -> None:
+        self.raw += delta
+
+    def snapshot(self) -> Tuple[str, str]:
+        recipe = recipe_schema.preview(recipe_schema.parse_partial(self.raw), self.bariatric)
+        return (recipe_schema.render_markdown(recipe, self.bariatric),
+                recipe_schema.render_text(recipe, self.bariatric))
+
+class _Finished:
+    """The card a stream ended with, for the callers waiting on it (the cache may be off or stale)."""
+
+    def __init__(self):
+        self.card: Any = None
+
+def _card_outputs(recipe: Dict[str, Any], bariatric: bool) -> Tuple[str, str]:
+    return recipe_schema.render_markdown(recipe, bariatric), recipe_schema.render_text(recipe, bariatric)
+
+def _iter_recipe_json(title: str, bariatric: bool, refresh: bool,
+                      done: Optional[_Finished] = None) -> Iterator[Tuple[str, str]]:
+    key, system_msg, user_msg = _recipe_json_request(title, bariatric)
+    card = _JsonCardStream(bariatric)
+    last = 0.0
+    for delta in _card_stream(title, _card_kind(bariatric), system_msg, user_msg,
+                              response_format=recipe_schema.response_format(bariatric)):
+        if delta is None:
+            card = _JsonCardStream(bariatric)
+            continue
+        card.feed(delta)
+        now = time.monotonic()
+        if now - last >= STREAM_MIN_INTERVAL:
+            last = now
+            yield card.snapshot()
+
+    recipe, invalid = _check_card(card.raw, title, bariatric)
+    recipe = _repair_card(title, bariatric, system_msg, recipe, invalid)
+    get_cache().set(key, recipe)
+    recipe_store.save(title, bariatric, recipe, OPENAI_MODEL)
+    if done is not None:
+        done.card = recipe
+    yield _card_outputs(recipe, bariatric)
+
+async def _aiter_recipe_json(title: str, bariatric: bool, refresh: bool, session: Optional[str] = None,
+                             done: Optional[_Finished] = None):
+    _, system_msg, user_msg = _recipe_json_request(title, bariatric)
+    card = _JsonCardStream(bariatric)
+    last = 0.0
+    async for delta in _acard_stream(title, _card_kind(bariatric), system_msg, user_msg, session=session,
+                                     response_format=recipe_schema.response_format(bariatric)):
+        if delta is None:
+            card = _JsonCardStream(bariatric)
+            continue
+        card.feed(delta)
+        now = time.monotonic()
+        if now - last >= STREAM_MIN_INTERVAL:
+            last = now
+            yield card.snapshot()
+
+    recipe, invalid = _check_card(card.raw, title, bariatric)
+    recipe = await _arepair_card(title, bariatric, system_msg, recipe, invalid, session=session)
+    await asyncio.to_thread(_store_card, title, bariatric, recipe)
+    if done is not None:
+        done.card = recipe
+    yield _card_outputs(recipe, bariatric)
+
+def _recipe_request(title: str, bariatric: bool) -> Tuple[str, str, str]:
     if bariatric:
-        system_msg = RECIPE_SYSTEM_BARIATRIC
-        user_msg = RECIPE_USER_TEMPLATE_BARIATRIC.format(title=title)
+        system_msg, user_template = RECIPE_SYSTEM_BARIATRIC, RECIPE_USER_TEMPLATE_BARIATRIC
     else:
-        system_msg = RECIPE_SYSTEM_STANDARD
-        user_msg = RECIPE_USER_TEMPLATE_STANDARD.format(title=title)
-
-    recipe_md = _chat(OPENAI_MODEL, system_msg, user_msg)
-    recipe_md = _first_bullet_enforcer(recipe_md)
-
-    image_url = chatgpt_generate_image(title)
-    if image_url:
-        recipe_md = (
-            f'<div class="fade-in"><img src="{image_url}" alt="{title}" '
-            f'style="max-width:100%;border-radius:12px;margin-bottom:15px;"></div>\n\n'
-            + recipe_md
-        )
+        system_msg, user_template = RECIPE_SYSTEM_STANDARD, RECIPE_USER_TEMPLATE_STANDARD
+    key = make_key("recipe", OPENAI_MODEL, system_msg, user_template, title.strip(), bool(bariatric))
+    return key, system_msg, user_template.format(title=title)
+
+def chatgpt_generate_recipe_text(title: str, bariatric: bool = False, refresh: bool = False) -> str:
+    if _structured():
+        return recipe_schema.render_markdown(chatgpt_generate_recipe_card(title, bariatric, refresh), bariatric)
+    key = _recipe_request(title, bariatric)[0]
+    existing = _existing_card(key, title, bariatric, refresh)
+    if existing:
+        return existing
+    return _card_flight.do(key, lambda: _new_recipe_text(title, bariatric, refresh))
+
+def _new_recipe_text(title: str, bariatric: bool, refresh: bool) -> str:
+    key, system_msg, user_msg = _recipe_request(title, bariatric)
+    recipe_md = get_cache().get_or_compute(
+        key, lambda: _finish_markdown(_card_reply(title, _card_kind(bariatric), system_msg, user_msg),
+                                      bariatric) or None,
+        refresh=refresh,
+    )
+    recipe_store.save(title, bariatric, recipe_md, OPENAI_MODEL)
+    return recipe_md or ""
+
+def _card_key(title: str, bariatric: bool) -> str:
+    return (_recipe_json_request if _structured() else _recipe_request)(title, bariatric)[0]
+
+def _card_snapshot(card: Any, bariatric: bool) -> Tuple[str, str]:
+    if isinstance(card, dict):
+        return _card_outputs(card, bariatric)
+    return card, _strip_markdown(card)
+
+def _resolve_card(key: str, fut: Future, done: _Finished, error: Optional[BaseException]) -> None:
+    """Hand the card a stream finished with (or why there is none) to the callers waiting on it."""
+    if done.card is None and not isinstance(error, Exception):
+        error = RuntimeError("the stream generating this card stopped before it finished")
+    _card_flight.resolve(key, fut, done.card, None if done.card is not None else error)
+
+def _resolve_claim(key: str, fut: Future, card: Any) -> None:
+    """Resolve a claimed card with its card, or the Exception it failed with (None: never made)."""
+    if card is None:
+        card = RuntimeError("generation stopped before this card")
+    if isinstance(card, Exception):
+        _card_flight.resolve(key, fut, error=card)
+    else:
+        _card_flight.resolve(key, fut, card)
+
+def iter_recipe_text(title: str, bariatric: bool = False, refresh: bool = False) -> Iterator[Tuple[str, str]]:
+    """Stream a recipe card as (markdown, plain text) snapshots.
+
+    Stored and cached cards are yielded whole. The last snapshot is the fully post-processed
+    card, identical to what chatgpt_generate_recipe_text returns. When the same card is
+    already being generated elsewhere, its finished result is yielded instead of a second call.
+    """
+    key = _card_key(title, bariatric)
+    cached = _existing_card(key, title, bariatric, refresh)
+    if cached:
+        yield _card_snapshot(cached, bariatric)
+        return
+    fut, leader = _card_flight.claim(key)
+    if not leader:
+        yield _card_snapshot(fut.result(), bariatric)
+        return
+    error: Optional[BaseException] = None
+    done = _Finished()
+    try:
+        yield from (_iter_recipe_json if _structured() else _iter_recipe_md)(title, bariatric, refresh, done)
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _resolve_card(key, fut, done, error)
+
+def _iter_recipe_md(title: str, bariatric: bool, refresh: bool,
+                    done: Optional[_Finished] = None) -> Iterator[Tuple[str, str]]:
+    key, system_msg, user_msg = _recipe_request(title, bariatric)
+    card = _CardStream()
+    last = 0.0
+    for delta in _card_stream(title, _card_kind(bariatric), system_msg, user_msg):
+        if delta is None:
+            card = _CardStream()
+            continue
+        line_done = card.feed(delta)
+        now = time.monotonic()
+        if line_done or now - last >= STREAM_MIN_INTERVAL:
+            last = now
+            yield card.markdown(), card.text()
+
+    recipe_md = _finish_markdown(card.raw.strip(), bariatric)
+    if recipe_md:
+        get_cache().set(key, recipe_md)
+        recipe_store.save(title, bariatric, recipe_md, OPENAI_MODEL)
+        if done is not None:
+            done.card = recipe_md
+    yield recipe_md, _strip_markdown(recipe_md)
+
+async def aiter_recipe_text(title: str, bariatric: bool = False, refresh: bool = False,
+                            session: Optional[str] = None):
+    """asyncio counterpart of iter_recipe_text for the UI.
+
+    The stream runs in its own task (_card_streams), so a second handler asking for the
+    same card follows it from its latest snapshot, and a handler that goes away does not
+    stop it for the others. A card being made by a prefetch, pack or sync call is awaited.
+    """
+    key = _card_key(title, bariatric)
+    cached = _existing_card(key, title, bariatric, refresh)
+    if cached:
+        yield _card_snapshot(cached, bariatric)
+        return
+    shared = _card_streams.get(key)
+    if shared is not None:
+        metrics.inc("recipe_coalesced_total", kind="card")
+    else:
+        fut, leader = _card_flight.claim(key)
+        if not leader:
+            yield _card_snapshot(await asyncio.shield(asyncio.wrap_future(fut)), bariatric)
+            return
+        done = _Finished()
+        source = (_aiter_recipe_json if _structured() else _aiter_recipe_md)(title, bariatric, refresh, session, done)
+        shared = _share_card_stream(key, fut, source, done)
+    async for snapshot in shared.follow():
+        yield snapshot
+
+def _share_card_stream(key: str, fut: Future, source, done: _Finished) -> singleflight.SharedStream:
+    """Run ``source`` as the card's stream in _card_streams; its end resolves the claimed ``fut``
+    with the card ``source`` left in ``done``."""
+    def _done(error: Optional[BaseException]) -> None:
+        _card_streams.pop(key, None)
+        _resolve_card(key, fut, done, error)
+    shared = _card_streams[key] = singleflight.SharedStream(source, on_done=_done)
+    return shared
+
+async def _aiter_recipe_md(title: str, bariatric: bool, refresh: bool, session: Optional[str] = None,
+                           done: Optional[_Finished] = None):
+    _, system_msg, user_msg = _recipe_request(title, bariatric)
+    card = _CardStream()
+    last = 0.0
+    async for delta in _acard_stream(title, _card_kind(bariatric), system_msg, user_msg, session=session):
+        if delta is None:
+            card = _CardStream()
+            continue
+        line_done = card.feed(delta)
+        now = time.monotonic()
+        if line_done or now - last >= STREAM_MIN_INTERVAL:
+            last = now
+            yield card.markdown(), card.text()
+
+    recipe_md = await asyncio.to_thread(_finish_markdown, card.raw.strip(), bariatric)
+    if recipe_md:
+        await asyncio.to_thread(_store_card, title, bariatric, recipe_md)
+        if done is not None:
+            done.card = recipe_md
+    yield recipe_md, _strip_markdown(recipe_md)
+
+# ================= packed generation =================
+# Batches send several titles per completion call: the instructions (and, for markdown,
+# the template) are paid once per pack, and one round trip returns many cards.
+RECIPE_PACK_MAX = int(os.environ.get("RECIPE_PACK_MAX", 8))          # cards per call at most; 1 disables packing
+RECIPE_PACK_RETRIES = int(os.environ.get("RECIPE_PACK_RETRIES", 1))  # re-packs of malformed cards before single calls
+OPENAI_MAX_OUTPUT_TOKENS = int(os.environ.get("OPENAI_MAX_OUTPUT_TOKENS", 16384))  # the model's completion limit
+RECIPE_PACK_HEADROOM = 0.75  # share of the output limit a pack is planned to fill
+
+_PACK_SPLIT_RE = re.compile(r"^\s*=+\s*RECIPE\s+(\d+)\s*=+\s*$", re.IGNORECASE | re.MULTILINE)
+
+class _PackSizer:
+    """Cards per packed call, sized so the expected completion fits the output-token limit.
+
+    Starts from CHAT_COMPLETION_ESTIMATE per card and follows the completion tokens cards
+    actually use. A truncated reply (finish_reason "length") shows where the model really
+    stops, which lowers the limit for every later pack.
+    """
+
+    def __init__(self, limit: int = OPENAI_MAX_OUTPUT_TOKENS, max_cards: int = RECIPE_PACK_MAX):
+        self.limit = max(int(limit), 1)
+        self.max_cards = max(int(max_cards), 1)
+        self.per_card = {False: float(CHAT_COMPLETION_ESTIMATE), True: CHAT_COMPLETION_ESTIMATE * 1.3}
+        self._lock = threading.Lock()
+
+    def size(self, bariatric: bool) -> int:
+        with self._lock:
+            fit = int(self.limit * RECIPE_PACK_HEADROOM // self.per_card[bool(bariatric)])
+        return max(1, min(self.max_cards, fit))
+
+    def expected(self, bariatric: bool, cards: int) -> int:
+        with self._lock:
+            return int(self.per_card[bool(bariatric)] * cards)
+
+    def record(self, bariatric: bool, completion_tokens: Optional[int], cards: int, truncated: bool) -> None:
+        with self._lock:
+            per = self.per_card[bool(bariatric)]
+            if truncated and completion_tokens:
+                self.limit = max(min(self.limit, int(completion_tokens)), 1)  # where the model really stops
+            elif truncated:
+                per *= 1.5
+            if completion_tokens and cards:
+                per = 0.7 * per + 0.3 * (completion_tokens / cards)
+            self.per_card[bool(bariatric)] = per
+
+_pack_sizer = _PackSizer()
+
+def recipe_pack_size(bariatric: bool = False) -> int:
+    """How many titles chatgpt_generate_recipe_pack currently sends per call."""
+    return _pack_sizer.size(bariatric)
+
+def _pack_request(titles: List[str], bariatric: bool) -> Tuple[str, str, Optional[dict]]:
+    numbered = "\n".join(f"{i}. '{t}'" for i, t in enumerate(titles, 1))
+    if _structured():
+        system_msg = RECIPE_PACK_JSON_SYSTEM_BARIATRIC if bariatric else RECIPE_PACK_JSON_SYSTEM_STANDARD
+        user_msg = RECIPE_PACK_JSON_USER.format(count=len(titles), titles=numbered)
+        return system_msg, user_msg, recipe_schema.pack_response_format(bariatric)
+    system_msg = RECIPE_PACK_SYSTEM_BARIATRIC if bariatric else RECIPE_PACK_SYSTEM_STANDARD
+    template = RECIPE_TEMPLATE_BARIATRIC if bariatric else RECIPE_TEMPLATE_STANDARD
+    user_msg = (RECIPE_PACK_LAYOUT + RECIPE_PACK_MARKER.format(n=1) + "\n"
+                + template.format(title=RECIPE_TITLE_PLACEHOLDER)
+                + RECIPE_PACK_USER.format(count=len(titles), titles=numbered))
+    return system_msg, user_msg, None
+
+def _split_pack(text: str, titles: List[str], bariatric: bool) -> Tuple[Dict[str, Any], int]:
+    """Cards of a packed reply that passed validation, by requested title, and how many came back at all."""
+    if _structured():
+        by_key = {recipe_store.title_key(t): t for t in titles}
+        entries, unclaimed = [], list(titles)
+        for pos, data in enumerate(recipe_schema.parse_pack(text)):
+            title = by_key.get(recipe_store.title_key(data.get("title", "")))
+            if title is None and pos < len(titles) and titles[pos] in unclaimed:
+                title = titles[pos]  # the model reworded the title; trust the order
+            if title in unclaimed:
+                unclaimed.remove(title)
+                entries.append((title, data))
+        cards = {}
+        for title, data in entries:
+            data["title"] = title
+            recipe, invalid = recipe_schema.validate(data, bariatric)
+            if not invalid:
+                cards[title] = _finish_card(title, recipe, invalid)
+        return cards, len(entries)
+    parts = _PACK_SPLIT_RE.split(text)
+    cards, seen = {}, 0
+    for num, body in zip(parts[1::2], parts[2::2]):
+        n = int(num)
+        if not 1 <= n <= len(titles) or titles[n - 1] in cards:
+            continue
+        seen += 1
+        md = _finish_markdown(body.strip(), bariatric)
+        row = batch_pipeline.parse_recipe_card(md)
+        if row["Ingredients"] and row["Directions"]:
+            cards[titles[n - 1]] = md
+    return cards, seen
+
+def _generate_pack(titles: List[str], bariatric: bool) -> Dict[str, Any]:
+    """One packed call; the valid cards are cached and stored exactly like single-title cards."""
+    system_msg, user_msg, response_format = _pack_request(titles, bariatric)
+    resp, text = _chat_response(OPENAI_MODEL, system_msg, user_msg, response_format=response_format,
+                                completion=_pack_sizer.expected(bariatric, len(titles)), kind="pack",
+                                max_tokens=_pack_sizer.limit)
+    truncated = getattr(resp.choices[0], "finish_reason", None) == "length"
+    cards, returned = _split_pack(text, titles, bariatric)
+    usage = getattr(resp, "usage", None)
+    _pack_sizer.record(bariatric, getattr(usage, "completion_tokens", None), returned, truncated)
+    metrics.inc("recipe_pack_calls_total", truncated="yes" if truncated else "no")
+    metrics.inc("recipe_pack_cards_total", len(cards), outcome="ok")
+    metrics.inc("recipe_pack_cards_total", returned - len(cards), outcome="malformed")
+    metrics.inc("recipe_pack_cards_total", len(titles) - returned, outcome="missing")
+    for title, card in cards.items():
+        get_cache().set(_card_key(title, bariatric), card)
+        recipe_store.save(title, bariatric, card, OPENAI_MODEL)
+    return cards
+
+def chatgpt_generate_recipe_pack(titles: List[str], bariatric: bool = False,
+                                 refresh: bool = False) -> Dict[str, Any]:
+    """Cards for several titles with as few completion calls as possible.
+
+    Stored and cached cards are reused; the rest go out recipe_pack_size() titles per call.
+    Only the titles whose cards came back missing or malformed are packed again, up to
+    RECIPE_PACK_RETRIES times, and then generated one call each. Returns title -> card
+    (dict when structured, markdown otherwise) or the Exception that title failed with.
+    """
+    out: Dict[str, Any] = {}
+    todo, claims, joined = [], {}, {}
+    for title in dict.fromkeys(titles):
+        key = _card_key(title, bariatric)
+        card = _existing_card(key, title, bariatric, refresh)
+        if card:
+            out[title] = card
+            continue
+        # Titles another caller is already generating are waited for, not packed again.
+        fut, leader = _card_flight.claim(key)
+        (claims if leader else joined)[title] = (key, fut)
+        if leader:
+            todo.append(title)
+    try:
+        for _ in range(RECIPE_PACK_RETRIES + 1):
+            if len(todo) < 2:
+                break
+            size, missing = _pack_sizer.size(bariatric), []
+            if size < 2:
+                break
+            for lo in range(0, len(todo), size):
+                group = todo[lo:lo + size]
+                try:
+                    cards = _generate_pack(group, bariatric)
+                except Exception:
+                    traceback.print_exc()
+                    cards = {}
+                out.update(cards)
+                missing.extend(t for t in group if t not in cards)
+            todo = missing
+        single = _new_recipe_card if _structured() else _new_recipe_text
+        for title in todo:
+            try:
+                out[title] = single(title, bariatric, refresh) or RuntimeError("empty card")
+            except Exception as e:
+                out[title] = e
+    finally:
+        for title, (key, fut) in claims.items():
+            _resolve_claim(key, fut, out.get(title))
+    for title, (key, fut) in joined.items():
+        try:
+            out[title] = fut.result()
+        except Exception as e:
+            out[title] = e
+    return out
+
+# ================= both variants =================
+# The standard and the bariatric card of one title from a single completion call: the dish
+# is worked out once and both cards share one image. Each card is validated, cached and
+# stored under its single-variant key, so later requests for either variant find it; a
+# variant the reply left missing or invalid gets its own call.
+_PAIR_SPLIT_RE = re.compile(r"^\s*=+\s*(STANDARD|BARIATRIC)\s*=+\s*$", re.IGNORECASE | re.MULTILINE)
+_PAIR_TAIL_RE = re.compile(r"\n\s*=+[^\n]*$")  # a marker line still arriving
+
+def _pair_request(title: str) -> Tuple[str, str, Optional[dict]]:
+    if _structured():
+        return RECIPE_PAIR_JSON_SYSTEM, RECIPE_PAIR_JSON_USER.format(title=title), recipe_schema.pair_response_format()
+    return RECIPE_PAIR_SYSTEM, RECIPE_PAIR_USER.format(title=title), None
+
+def _pair_parts(text: str) -> Dict[bool, Any]:
+    """Each variant's part of a (possibly partial) pair reply, by bariatric flag: JSON object or markdown."""
+    if _structured():
+        data = recipe_schema.parse_partial(text)
+        return {b: data[name] for b, name in ((False, "standard"), (True, "bariatric"))
+                if isinstance(data.get(name), dict) and data[name]}
+    parts = _PAIR_SPLIT_RE.split(text)
+    out: Dict[bool, Any] = {}
+    for name, body in zip(parts[1::2], parts[2::2]):
+        bariatric = name.lower() == "bariatric"
+        if bariatric not in out and body.strip():
+            out[bariatric] = body.strip()
+    return out
+
+def _last_variant(text: str) -> Optional[bool]:
+    """The variant a pair reply was writing when it stopped (None: neither had started)."""
+    if _structured():
+        starts = {b: text.find(f'"{name}"') for b, name in ((False, "standard"), (True, "bariatric"))}
+    else:
+        starts = {m.group(1).lower() == "bariatric": m.start() for m in _PAIR_SPLIT_RE.finditer(text)}
+    starts = {b: pos for b, pos in starts.items() if pos >= 0}
+    return max(starts, key=starts.get) if starts else None
+
+def _check_pair(text: str, title: str, truncated: bool = False) -> Dict[bool, Tuple[Any, List[str]]]:
+    """(card, invalid fields) of each variant a pair reply produced. Markdown cards come back finished.
+
+    In a ``truncated`` reply the variant written last is the one the output limit cut off; it is dropped.
+    """
+    out = {}
+    parts = _pair_parts(text)
+    if truncated:
+        parts.pop(_last_variant(text), None)
+        metrics.inc("recipe_truncated_total", kind="pair", outcome="retried")
+    for bariatric, part in parts.items():
+        if isinstance(part, dict):
+            part["title"] = title
+            out[bariatric] = recipe_schema.validate(part, bariatric)
+            continue
+        md = _finish_markdown(part, bariatric)
+        row = batch_pipeline.parse_recipe_card(md)
+        if row["Ingredients"] and row["Directions"]:
+            out[bariatric] = (md, [])
+    return out
+
+def _store_card(title: str, bariatric: bool, card: Any) -> None:
+    get_cache().set(_card_key(title, bariatric), card)
+    recipe_store.save(title, bariatric, card, OPENAI_MODEL)
+
+def _count_pair(cards: Dict[bool, Any]) -> None:
+    metrics.inc("recipe_pair_cards_total", len(cards), outcome="ok")
+    metrics.inc("recipe_pair_cards_total", 2 - len(cards), outcome="fallback")
+
+def _generate_pair(title: str) -> Dict[bool, Any]:
+    """One pair call; the cards that came back valid (after field repairs) are cached and stored."""
+    system_msg, user_msg, response_format = _pair_request(title)
+    resp, text = _chat_response(OPENAI_MODEL, system_msg, user_msg, response_format=response_format,
+                                completion=2 * CHAT_COMPLETION_ESTIMATE, kind="pair")
+    cards = {}
+    for bariatric, (card, invalid) in _check_pair(text, title, _truncated(resp)).items():
+        if isinstance(card, dict):
+            try:
+                card = _repair_card(title, bariatric, _recipe_json_request(title, bariatric)[1], card, invalid)
+            except Exception:
+                traceback.print_exc()
+                continue
+        _store_card(title, bariatric, card)
+        cards[bariatric] = card
+    _count_pair(cards)
+    return cards
+
+def chatgpt_generate_recipe_pair(title: str, refresh: bool = False) -> Tuple[Any, Any]:
+    """(standard, bariatric) cards of one title, both from a single completion call.
+
+    Stored and cached variants are reused and a variant another caller is generating is
+    waited for, so the pair call only goes out when both are missing. Each entry is the
+    card (dict when structured, markdown otherwise) or the Exception it failed with.
+    """
+    out: Dict[bool, Any] = {}
+    claims, joined = {}, {}
+    for bariatric in (False, True):
+        key = _card_key(title, bariatric)
+        card = _existing_card(key, title, bariatric, refresh)
+        if card:
+            out[bariatric] = card
+            continue
+        fut, leader = _card_flight.claim(key)
+        (claims if leader else joined)[bariatric] = (key, fut)
+    try:
+        if len(claims) == 2:
+            try:
+                out.update(_generate_pair(title))
+            except Exception:
+                traceback.print_exc()
+        single = _new_recipe_card if _structured() else _new_recipe_text
+        for bariatric in claims:
+            if bariatric not in out:
+                try:
+                    out[bariatric] = single(title, bariatric, refresh) or RuntimeError("empty card")
+                except Exception as e:
+                    out[bariatric] = e
+    finally:
+        for bariatric, (key, fut) in claims.items():
+            _resolve_claim(key, fut, out.get(bariatric))
+    for bariatric, (key, fut) in joined.items():
+        try:
+            out[bariatric] = fut.result()
+        except Exception as e:
+            out[bariatric] = e
+    return out[False], out[True]
+
+class _PairStream:
+    """Renders both cards of a streamed pair reply from whatever has arrived so far."""
+
+    def __init__(self):
+        self.raw = ""
+
+    def feed(self, delta: str) -> None:
+        self.raw += delta
+
+    def snapshot(self) -> Tuple[Optional[Tuple[str, str]], Optional[Tuple[str, str]]]:
+        parts = _pair_parts(self.raw)
+        return self._render(parts.get(False), False), self._render(parts.get(True), True)
+
+    @staticmethod
+    def _render(part: Any, bariatric: bool) -> Optional[Tuple[str, str]]:
+        if not part:
+            return None
+        if isinstance(part, dict):
+            return _card_outputs(recipe_schema.preview(part, bariatric), bariatric)
+        md = _first_bullet_enforcer(_PAIR_TAIL_RE.sub("", part))
+        return md, _strip_markdown(md)
+
+async def _aiter_recipe_pair(title: str, refresh: bool, session: Optional[str] = None,
+                             done: Optional[Dict[bool, _Finished]] = None):
+    """(standard, bariatric) snapshots of one pair call; see aiter_recipe_pair. Each variant's
+    finished card is left in ``done``."""
+    done = done or {False: _Finished(), True: _Finished()}
+    system_msg, user_msg, response_format = _pair_request(title)
+    pair = _PairStream()
+    last = 0.0
+    truncated = False
+    try:
+        async for delta in _achat_stream(OPENAI_MODEL, system_msg, user_msg, session=session,
+                                         response_format=response_format, completion=2 * CHAT_COMPLETION_ESTIMATE,
+                                         kind="pair"):
+            pair.feed(delta)
+            now = time.monotonic()
+            if now - last >= STREAM_MIN_INTERVAL:
+                last = now
+                yield pair.snapshot()
+    except _Truncated:
+        truncated = True
+    except Exception:
+        traceback.print_exc()  # whatever is missing gets its own call below
+
+    latest: List[Any] = [None, None]
+    cards = {}
+    checked = await asyncio.to_thread(_check_pair, pair.raw, title, truncated)
+    for bariatric, (card, invalid) in checked.items():
+        if isinstance(card, dict):
+            try:
+                card = await _arepair_card(title, bariatric, _recipe_json_request(title, bariatric)[1], card,
+                                           invalid, session=session)
+            except Exception:
+                traceback.print_exc()
+                continue
+        await asyncio.to_thread(_store_card, title, bariatric, card)
+        cards[bariatric] = card
+        done[bariatric].card = card
+        latest[bariatric] = _card_snapshot(card, bariatric)
+    _count_pair(cards)
+    yield tuple(latest)
+    for bariatric in (False, True):
+        if bariatric in cards:
+            continue
+        try:
+            async for snapshot in (_aiter_recipe_json if _structured() else _aiter_recipe_md)(
+                    title, bariatric, refresh, session, done[bariatric]):
+                latest[bariatric] = snapshot
+                yield tuple(latest)
+        except Exception as e:
+            latest[bariatric] = e
+            yield tuple(latest)
+
+async def _pair_variant(pair: singleflight.SharedStream, bariatric: bool):
+    """One variant of a shared pair stream, as a single-card stream for _card_streams."""
+    async for snapshot in pair.follow():
+        part = snapshot[bariatric]
+        if isinstance(part, Exception):
+            raise part
+        if part is not None:
+            yield part
+
+async def _awaited_card(fut: Future, bariatric: bool):
+    yield _card_snapshot(await asyncio.shield(asyncio.wrap_future(fut)), bariatric)
+
+async def _amerge_pair(streams: List[Any]):
+    """Interleave a standard and a bariatric snapshot stream into (standard, bariatric) pairs."""
+    queue: asyncio.Queue = asyncio.Queue()
+    end = object()
+    async def _pump(bariatric: int, stream) -> None:
+        try:
+            async for snapshot in stream:
+                queue.put_nowait((bariatric, snapshot))
+        except Exception as e:
+            queue.put_nowait((bariatric, e))
+        queue.put_nowait((bariatric, end))
+    tasks = [asyncio.create_task(_pump(b, stream)) for b, stream in enumerate(streams)]
+    latest: List[Any] = [None, None]
+    running = len(tasks)
+    try:
+        while running:
+            bariatric, item = await queue.get()
+            if item is end:
+                running -= 1
+                continue
+            latest[bariatric] = item
+            yield tuple(latest)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def aiter_recipe_pair(title: str, refresh: bool = False, session: Optional[str] = None):
+    """asyncio stream of a title's standard and bariatric cards from one completion call, for the UI.
+
+    Yields (standard, bariatric) pairs; each is a (markdown, plain text) snapshot, None
+    until that card starts, or the Exception it failed with. While the pair streams, each
+    variant is also in _card_streams, so single-variant handlers follow it. When either
+    card is already stored, cached or being generated, the two variants come from their
+    own streams instead and are merged.
+    """
+    keys = [_card_key(title, b) for b in (False, True)]
+    claims: List[Tuple[Future, bool]] = []
+    if not any(key in _card_streams or _existing_card(key, title, b, refresh)
+               for b, key in zip((False, True), keys)):
+        claims = [_card_flight.claim(key) for key in keys]
+    if claims and all(leader for _, leader in claims):
+        done = {False: _Finished(), True: _Finished()}
+        pair = singleflight.SharedStream(_aiter_recipe_pair(title, refresh, session, done))
+        for bariatric, key, (fut, _) in zip((False, True), keys, claims):
+            _share_card_stream(key, fut, _pair_variant(pair, bariatric), done[bariatric])
+        async for snapshot in pair.follow():
+            yield snapshot
+        return
+    streams = []
+    for bariatric, key in zip((False, True), keys):
+        if not claims:
+            streams.append(aiter_recipe_text(title, bariatric, refresh, session))
+        elif claims[bariatric][1]:
+            done = _Finished()
+            source = (_aiter_recipe_json if _structured() else _aiter_recipe_md)(
+                title, bariatric, refresh, session, done)
+            streams.append(_share_card_stream(key, claims[bariatric][0], source, done).follow())
+        else:
+            streams.append(_awaited_card(claims[bariatric][0], bariatric))
+    async for snapshot in _amerge_pair(streams):
+        yield snapshot
+
+# ================= prefetch =================
+# Speculative generation of the cards a user is likely to open next: the top titles of a
+# fresh list and the row just selected. Off by default (it spends API calls on cards nobody
+# may open); the UI checkbox starts from RECIPE_PREFETCH.
+RECIPE_PREFETCH = os.environ.get("RECIPE_PREFETCH", "0").strip().lower() in ("1", "true", "yes", "on")
+RECIPE_PREFETCH_TOP_K = int(os.environ.get("RECIPE_PREFETCH_TOP_K", 5))
+RECIPE_PREFETCH_WORKERS = int(os.environ.get("RECIPE_PREFETCH_WORKERS", 2))
+RECIPE_PREFETCH_IMAGES = os.environ.get("RECIPE_PREFETCH_IMAGES", "0").strip().lower() in ("1", "true", "yes", "on")
+PREFETCH_SELECTED, PREFETCH_LIST = 0, 1  # queue priorities, lowest first
+
+class _Prefetcher:
+    """Low-priority background queue of card generations.
+
+    Jobs run on a few daemon threads in priority order, and only while no interactive
+    API call is waiting in _api_limiter. Listing new titles cancels the session's jobs
+    that have not started; started ones finish, since their cards go to the cache and
+    the store either way. Running jobs hold their cards' _card_flight entries, so a user
+    who clicks a title that is being prefetched waits for that call instead of a new one.
+    """
+
+    def __init__(self, workers: int = RECIPE_PREFETCH_WORKERS):
+        self.workers = max(int(workers), 1)
+        self._heap: List[tuple] = []  # (priority, seq, session, epoch, titles, bariatric, run)
+        self._cv = threading.Condition()
+        self._seq = itertools.count()
+        self._epochs: Dict[Optional[str], int] = {}
+        self._threads: List[threading.Thread] = []
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def submit(self, session: Optional[str], titles: List[str], bariatric: bool, priority: int = PREFETCH_LIST) -> None:
+        titles = [t for t in titles if t and not _existing_card(_card_key(t, bariatric), t, bariatric, False)]
+        if not titles:
+            return
+        with self._cv:
+            job = (priority, next(self._seq), session, self._epochs.get(session, 0), titles, bool(bariatric),
+                   metrics.bind(self._run))
+            heapq.heappush(self._heap, job)
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._worker, name=f"prefetch-{len(self._threads)}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            self._cv.notify()
+        metrics.inc("recipe_prefetch_total", len(titles), outcome="queued")
+
+    def cancel(self, session: Optional[str]) -> None:
+        """Drop the session's queued jobs (they are skipped when they come up)."""
+        with self._cv:
+            self._epochs[session] = self._epochs.get(session, 0) + 1
+
+    def _worker(self) -> None:
+        while True:
+            with self._cv:
+                while not self._heap:
+                    self._cv.wait()
+                _, _, session, epoch, titles, bariatric, run = heapq.heappop(self._heap)
+                cancelled = epoch != self._epochs.get(session, 0)
+            if cancelled:
+                metrics.inc("recipe_prefetch_total", len(titles), outcome="cancelled")
+                continue
+            while _api_limiter.waiting:
+                time.sleep(0.05)  # interactive calls first
+            try:
+                run(titles, bariatric)
+            except Exception:
+                traceback.print_exc()
+                metrics.inc("recipe_prefetch_total", len(titles), outcome="failed")
+
+    def _run(self, titles: List[str], bariatric: bool) -> None:
+        if len(titles) > 1:
+            cards = chatgpt_generate_recipe_pack(titles, bariatric)
+            failed = sum(isinstance(c, Exception) for c in cards.values())
+        else:
+            (chatgpt_generate_recipe_card if _structured() else chatgpt_generate_recipe_text)(titles[0], bariatric)
+            failed = 0
+        if RECIPE_PREFETCH_IMAGES:
+            for title in titles:
+                chatgpt_generate_image(title)
+        metrics.inc("recipe_prefetch_total", len(titles) - failed, outcome="done")
+        metrics.inc("recipe_prefetch_total", failed, outcome="failed")
+
+_prefetcher = _Prefetcher()
+
+def _image_html(title: str, image_key: Optional[str]) -> str:
+    """Inline the stored thumbnail, so the browser never fetches the full-size image."""
+    src = image_store.get_store().data_uri(image_key, "thumb") if image_key else None
+    if not src:
+        return ""
+    return (
+        f'<div class="fade-in"><img src="{src}" alt="{title}" '
+        f'style="max-width:100%;border-radius:12px;margin-bottom:15px;"></div>'
+    )
+
+def start_image(title: str, refresh: bool = False) -> Future:
+    return _generation_pool.submit(metrics.bind(chatgpt_generate_image), title, refresh)
+
+def start_recipe(title: str, bariatric: bool = False, refresh: bool = False) -> Tuple[Future, Future]:
+    """Issue the recipe text and image requests at the same time; returns (text, image) futures."""
+    image_future = start_image(title, refresh)
+    text_future = _generation_pool.submit(metrics.bind(chatgpt_generate_recipe_text), title, bariatric, refresh)
+    return text_future, image_future
+
+def chatgpt_generate_recipe(title: str, bariatric: bool = False, refresh: bool = False) -> str:
+    text_future, image_future = start_recipe(title, bariatric=bariatric, refresh=refresh)
+    recipe_md = text_future.result()
+    image_html = _image_html(title, image_future.result())
+    if image_html:
+        recipe_md = image_html + "\n\n" + recipe_md
     return recipe_md
 
 # ================= UI =================
+TITLE_PAGE_SIZE = int(os.environ.get("TITLE_PAGE_SIZE", 50))  # title table rows sent to the browser at once
+LIBRARY_PAGE_SIZE = int(os.environ.get("LIBRARY_PAGE_SIZE", 50))  # recipe store search results per page
+
+def _session_id(request: Optional["gr.Request"]) -> Optional[str]:
+    return getattr(request, "session_hash", None) if request is not None else None
+
+def _ui_trace(handler: str) -> str:
+    """Start a trace for one UI event; every API call made while handling it is recorded under the ID."""
+    metrics.inc("recipe_ui_events_total", handler=handler)
+    return metrics.new_trace()
+
+def _title_records(titles: List[str]) -> List[Dict[str, Any]]:
+    """Titles as records with a stable id (their list number), kept server side in gr.State."""
+    return [{"id": i + 1, "title": t} for i, t in enumerate(titles)]
+
+def _title_by_id(records: List[Dict[str, Any]], title_id: Any) -> Optional[str]:
+    try:
+        rec = records[int(title_id) - 1]
+    except (TypeError, ValueError, IndexError):
+        return None
+    return rec["title"] if rec["id"] == int(title_id) else None
+
+def _title_page(records: List[Dict[str, Any]], query: str, page: int) -> Tuple[List[List[Any]], int, str]:
+    """One page of the (filtered) records as table rows, the clamped page number and a label."""
+    terms = (query or "").lower().split()
+    matches = [r for r in records if all(t in r["title"].lower() for t in terms)] if terms else records
+    pages = max(1, -(-len(matches) // TITLE_PAGE_SIZE))
+    page = min(max(int(page or 1), 1), pages)
+    start = (page - 1) * TITLE_PAGE_SIZE
+    rows = [[r["id"], r["title"]] for r in matches[start:start + TITLE_PAGE_SIZE]]
+    shown = f"{len(matches)} of {len(records)}" if terms else f"{len(records)}"
+    return rows, page, f"Page {page} of {pages} · {shown} titles"
+
+def _library_page(query: str, variant: str, page: int) -> Tuple[List[List[Any]], int, str]:
+    """One page of recipe store search results as table rows, the clamped page number and a label."""
+    variant = (variant or "").lower()
+    variant = variant if variant in recipe_store.VARIANTS else None
+    page = max(int(page or 1), 1)
+    store = recipe_store.get_store()
+    t0 = time.perf_counter()
+    found, total = store.search(query, variant, limit=LIBRARY_PAGE_SIZE, offset=(page - 1) * LIBRARY_PAGE_SIZE)
+    pages = max(1, -(-total // LIBRARY_PAGE_SIZE))
+    if page > pages:
+        page = pages
+        found, total = store.search(query, variant, limit=LIBRARY_PAGE_SIZE, offset=(page - 1) * LIBRARY_PAGE_SIZE)
+    ms = (time.perf_counter() - t0) * 1000
+    rows = [[r["id"], r["title"], r["variant"].title(), time.strftime("%Y-%m-%d %H:%M", time.localtime(r["updated_at"]))]
+            for r in found]
+    shown = f"{recipe_store.COUNT_CAP}+" if total > recipe_store.COUNT_CAP else f"{total}"
+    return rows, page, f"Page {page} of {pages}{'+' if total > recipe_store.COUNT_CAP else ''} · {shown} recipes · {ms:.0f} ms"
+
 def build_ui():
+    import gradio as gr  # only the UI needs it; headless.py imports this module without it
+    threading.Thread(target=warm, name="warm", daemon=True).start()
     _, ready_err = _client_or_error()
     is_ready = ready_err is None
     initial_status = f"**Error:** {ready_err}" if ready_err else ""
@@ -383,68 +2104,166 @@ def build_ui():
                     generate_btn = gr.Button("Generate Titles", variant="primary", interactive=is_ready)
                     recipe_btn = gr.Button("Recipe", variant="secondary", elem_classes="linklike", interactive=False)
 
-                bariatric_enable = gr.Checkbox(label="Enable Bariatric generation", value=False)
+                with gr.Row():
+                    bariatric_enable = gr.Checkbox(label="Enable Bariatric generation", value=False)
+                    both_enable = gr.Checkbox(label="Standard and bariatric together (one call)", value=False)
+                    regenerate = gr.Checkbox(label="Regenerate (skip cache)", value=False)
+                    prefetch_enable = gr.Checkbox(label="Prefetch recipes for the top titles", value=RECIPE_PREFETCH)
 
+                with gr.Row():
+                    title_search = gr.Textbox(label="Search titles", placeholder="Filter the list…", scale=4)
+                    prev_page_btn = gr.Button("◀ Prev", scale=0, min_width=90)
+                    next_page_btn = gr.Button("Next ▶", scale=0, min_width=90)
+                page_label = gr.Markdown()
                 table = gr.Dataframe(headers=["#", "Title"], datatype=["number", "str"], interactive=False, wrap=True)
                 copy_titles_box = gr.Textbox(lines=10, interactive=False, show_copy_button=True)
-                raw_titles_state = gr.State([])
-                selected_title_state = gr.State(None)
+                titles_state = gr.State([])  # [{"id", "title"}] for the whole list; the table shows one page
+                page_state = gr.State(1)
+                selected_id_state = gr.State(None)
+
+                with gr.Accordion("Cache & load", open=False):
+                    cache_stats_md = gr.Markdown()
+                    cache_stats_btn = gr.Button("Refresh stats", size="sm")
 
             with gr.Tab("Recipe Generator"):
+                recipe_image = gr.HTML()
                 recipe_md = gr.Markdown(value="Select a title and click Recipe.")
                 recipe_copy_box = gr.Textbox(lines=18, interactive=False, show_copy_button=True)
 
             with gr.Tab("Bariatric Recipe Generator"):
                 bari_loading = gr.Markdown(visible=False)
+                bari_recipe_image = gr.HTML()
                 bari_recipe_md = gr.Markdown(value="Enable Bariatric and click Recipe to generate here.")
                 bari_recipe_copy_box = gr.Textbox(lines=18, interactive=False, show_copy_button=True)
+                image_token_state = gr.State(None)
 
-        def _run_generate(subject, num):
-            client, err = _client_or_error()
+            with gr.Tab("Batch Generator"):
+                gr.Markdown("Generate cards for every title in the list above, or for an uploaded title file.")
+                with gr.Row():
+                    batch_file = gr.File(label="Title file (.txt, .csv, .jsonl)", file_types=[".txt", ".csv", ".jsonl"])
+                    with gr.Column():
+                        batch_variants = gr.CheckboxGroup(["Standard", "Bariatric"], value=["Standard"], label="Variants")
+                        batch_workers = gr.Slider(1, 32, value=batch_pipeline.BATCH_WORKERS, step=1, label="Workers")
+                        batch_photos = gr.Checkbox(value=batch_pipeline.BATCH_PHOTOS, label="Generate photos (fills the Photo column)")
+                batch_btn = gr.Button("Generate All Recipes", variant="primary", interactive=is_ready)
+                batch_status = gr.Markdown()
+                batch_table = gr.Dataframe(headers=["Title", "Variant", "Servings", "Ingredients"], interactive=False, wrap=True)
+                batch_csv = gr.File(label="Recipes CSV for recipe_builder", interactive=False)
+
+            with gr.Tab("Recipe Library"):
+                gr.Markdown("Every generated card, searchable by title, ingredients and directions.")
+                with gr.Row():
+                    library_query = gr.Textbox(label="Search recipes", placeholder="e.g. peach oats", scale=4)
+                    library_variant = gr.Radio(["All", "Standard", "Bariatric"], value="All", label="Variant", scale=2)
+                with gr.Row():
+                    library_prev_btn = gr.Button("◀ Prev", scale=0, min_width=90)
+                    library_next_btn = gr.Button("Next ▶", scale=0, min_width=90)
+                    library_export_btn = gr.Button("Export CSV for recipe_builder", scale=0)
+                library_label = gr.Markdown()
+                library_table = gr.Dataframe(headers=["#", "Title", "Variant", "Updated"],
+                                             datatype=["number", "str", "str", "str"], interactive=False, wrap=True)
+                library_page_state = gr.State(1)
+                library_csv = gr.File(label="Recipe store CSV", interactive=False)
+                library_image = gr.HTML()
+                library_md = gr.Markdown()
+
+        async def _run_generate(subject, num, refresh=False, bariatric=False, prefetch=False,
+                                request: gr.Request = None):
+            trace_id = _ui_trace("generate_titles")
+            session = _session_id(request)
+            _prefetcher.cancel(session)  # the old list's cards are no longer likely picks
+            # Regenerating means fresh cards are wanted, which a prefetch would not give.
+            prefetch_pending = bool(prefetch) and not refresh and RECIPE_PREFETCH_TOP_K > 0
+            client, err = _async_client_or_error()
             if err:
                 msg = f"[ERROR] {err}"
-                return [], [], None, gr.update(value=msg), gr.update(value=f"**Error:** {msg}", visible=True), gr.update(interactive=False)
+                yield ([], [], None, gr.update(value=msg), gr.update(value=f"**Error:** {msg}", visible=True),
+                       gr.update(interactive=False), 1, "", gr.update())
+                return
+            requested = int(num)
+            clean: List[str] = []
             try:
-                titles = chatgpt_generate_titles(subject, int(num))
-                df = [[i + 1, re.sub(r'^\d+\.\s*', '', t)] for i, t in enumerate(titles)]
-                joined = "\n".join(titles)
-                default_sel = re.sub(r"^\d+\.\s*", "", titles[0]) if titles else None
-
+                first = True
+                async for clean in aiter_titles(subject, requested, refresh=bool(refresh), session=session):
+                    if prefetch_pending and len(clean) >= min(RECIPE_PREFETCH_TOP_K, requested):
+                        _prefetcher.submit(session, clean[:RECIPE_PREFETCH_TOP_K], bool(bariatric))
+                        prefetch_pending = False
+                    # Only the first page goes to the browser while titles stream in.
+                    records = _title_records(clean)
+                    rows, _, label = _title_page(records, "", 1)
+                    yield (
+                        rows,
+                        records,
+                        1,
+                        gr.update(),
+                        gr.update(value=f"Generating titles… {len(clean)} / {requested}", visible=True),
+                        gr.update(interactive=False),
+                        1,
+                        label,
+                        gr.update(value="") if first else gr.update(),
+                    )
+                    first = False
+
+                if prefetch_pending and clean:
+                    _prefetcher.submit(session, clean[:RECIPE_PREFETCH_TOP_K], bool(bariatric))
+                records = _title_records(clean)
+                rows, _, label = _title_page(records, "", 1)
                 notice = ""
-                if len(titles) < int(num):
-                    notice = f"Requested {int(num)} titles. Generated {len(titles)} without duplicates."
-
-                return (
-                    df,
-                    titles,
-                    default_sel,
-                    gr.update(value=joined),
+                if len(records) < requested:
+                    notice = f"Requested {requested} titles. Generated {len(records)} without duplicates."
+
+                yield (
+                    rows,
+                    records,
+                    1 if records else None,
+                    gr.update(value="\n".join(_number_titles(clean))),
                     gr.update(value=(f"**Notice:** {notice}" if notice else ""), visible=bool(notice)),
-                    gr.update(interactive=bool(titles)),
+                    gr.update(interactive=bool(records)),
+                    1,
+                    label,
+                    gr.update(value="") if first else gr.update(),
                 )
             except Exception as e:
-                err_text = f"[ERROR] {type(e).__name__}: {e}"
-                return [], [], None, gr.update(value=err_text), gr.update(value=f"**Error:** {err_text}", visible=True), gr.update(interactive=False)
+                err_text = f"[ERROR] {type(e).__name__}: {e} (trace {trace_id})"
+                yield ([], [], None, gr.update(value=err_text), gr.update(value=f"**Error:** {err_text}", visible=True),
+                       gr.update(interactive=False), 1, "", gr.update())
 
         generate_btn.click(
             _run_generate,
-            inputs=[subject, num_slider],
-            outputs=[table, raw_titles_state, selected_title_state, copy_titles_box, status_msg, recipe_btn],
+            inputs=[subject, num_slider, regenerate, bariatric_enable, prefetch_enable],
+            outputs=[table, titles_state, selected_id_state, copy_titles_box, status_msg, recipe_btn,
+                     page_state, page_label, title_search],
         )
 
-        def _on_select(evt: gr.SelectData, raw_titles):
-            if evt is None or raw_titles is None:
+        def _show_page(records, query, page):
+            rows, page, label = _title_page(records or [], query, page)
+            return rows, page, label
+
+        page_outputs = [table, page_state, page_label]
+        title_search.change(lambda r, q: _show_page(r, q, 1), inputs=[titles_state, title_search], outputs=page_outputs)
+        prev_page_btn.click(lambda r, q, p: _show_page(r, q, p - 1),
+                            inputs=[titles_state, title_search, page_state], outputs=page_outputs)
+        next_page_btn.click(lambda r, q, p: _show_page(r, q, p + 1),
+                            inputs=[titles_state, title_search, page_state], outputs=page_outputs)
+
+        def _on_select(evt: gr.SelectData, records, bariatric=False, prefetch=False, refresh=False,
+                       request: gr.Request = None):
+            # The id column identifies the title, whatever page or filter is showing.
+            row = getattr(evt, "row_value", None) if evt is not None else None
+            title = _title_by_id(records or [], row[0]) if row else None
+            if title is None:
                 return gr.update()
-            ri = evt.index
-            idx = ri[0] if isinstance(ri, list) else ri
-            if isinstance(idx, int) and 0 <= idx < len(raw_titles):
-                return re.sub(r"^\d+\.\s*", "", raw_titles[idx])
-            return gr.update()
+            if prefetch and not refresh:
+                _prefetcher.submit(_session_id(request), [title], bool(bariatric), priority=PREFETCH_SELECTED)
+            return int(row[0])
 
-        table.select(_on_select, inputs=[raw_titles_state], outputs=[selected_title_state])
+        table.select(_on_select, inputs=[titles_state, bariatric_enable, prefetch_enable, regenerate],
+                     outputs=[selected_id_state])
 
-        def _generate_recipe(selected_title, raw_titles, bariatric_enabled):
-            if not raw_titles:
+        async def _generate_recipe(selected_id, records, bariatric_enabled, refresh=False, both=False,
+                                   request: gr.Request = None):
+            trace_id = _ui_trace("generate_recipe")
+            if not records:
                 yield (
                     gr.update(value="No titles available. Generate titles first."),
                     gr.update(value=""),
@@ -453,9 +2272,12 @@ def build_ui():
                     gr.update(value=""),
                     gr.update(selected="List Generator"),
                     gr.update(value=""),
+                    gr.update(value=""),
+                    gr.update(value=""),
+                    None,
                 ); return
 
-            title = selected_title or (re.sub(r"^\d+\.\s*", "", raw_titles[0]) if raw_titles else None)
+            title = _title_by_id(records, selected_id) or records[0]["title"]
             if not title:
                 yield (
                     gr.update(value="No title selected."),
@@ -465,33 +2287,107 @@ def build_ui():
                     gr.update(value=""),
                     gr.update(selected="List Generator"),
                     gr.update(value=""),
+                    gr.update(value=""),
+                    gr.update(value=""),
+                    None,
                 ); return
 
             js_scroll = "<script>window.scrollTo({top:0,behavior:'smooth'});</script>"
 
-            if bariatric_enabled:
+            # The image is requested up front and attached by _attach_image (on the
+            # token state change) once its task finishes; the text streams meanwhile.
+            session = _session_id(request)
+            token = uuid.uuid4().hex
+            _pending_images[token] = (title, asyncio.create_task(
+                achatgpt_generate_image(title, refresh=bool(refresh), session=session)))
+
+            if both:
+                # Both cards from one call (aiter_recipe_pair); each tab fills as its card streams.
                 yield (
-                    gr.update(value=""),
+                    gr.update(value="### Generating recipe…"),
                     gr.update(value=""),
                     gr.update(value="### Generating bariatric recipe…", visible=True),
                     gr.update(value=""),
                     gr.update(value=""),
-                    gr.update(selected="Bariatric Recipe Generator"),
+                    gr.update(selected="Bariatric Recipe Generator" if bariatric_enabled else "Recipe Generator"),
                     gr.update(value=js_scroll),
+                    gr.update(value=""),
+                    gr.update(value=""),
+                    token,
                 )
+                def _card_updates(part):
+                    if part is None:
+                        return gr.update(), gr.update()
+                    if isinstance(part, Exception):
+                        md = f"**Error:** {type(part).__name__}: {part} (trace {trace_id})"
+                        return gr.update(value=md), gr.update(value=_strip_markdown(md))
+                    return gr.update(value=part[0]), gr.update(value=part[1])
                 try:
-                    recipe_bari_md = chatgpt_generate_recipe(title, bariatric=True)
+                    async for std_part, bari_part in aiter_recipe_pair(title, refresh=bool(refresh), session=session):
+                        yield (
+                            *_card_updates(std_part),
+                            gr.update(visible=bari_part is None),
+                            *_card_updates(bari_part),
+                            gr.update(),
+                            gr.update(),
+                            gr.update(),
+                            gr.update(),
+                            token,
+                        )
                 except Exception as e:
-                    recipe_bari_md = f"**Error:** {type(e).__name__}: {e}"
+                    error = _card_updates(e)
+                    yield (
+                        *error,
+                        gr.update(visible=False),
+                        *error,
+                        gr.update(),
+                        gr.update(),
+                        gr.update(),
+                        gr.update(),
+                        token,
+                    )
+            elif bariatric_enabled:
                 yield (
                     gr.update(value=""),
                     gr.update(value=""),
-                    gr.update(visible=False),
-                    gr.update(value=recipe_bari_md),
-                    gr.update(value=_strip_markdown(recipe_bari_md)),
+                    gr.update(value="### Generating bariatric recipe…", visible=True),
+                    gr.update(value=""),
+                    gr.update(value=""),
                     gr.update(selected="Bariatric Recipe Generator"),
                     gr.update(value=js_scroll),
+                    gr.update(value=""),
+                    gr.update(value=""),
+                    token,
                 )
+                try:
+                    async for recipe_bari_md, recipe_bari_txt in aiter_recipe_text(
+                            title, bariatric=True, refresh=bool(refresh), session=session):
+                        yield (
+                            gr.update(),
+                            gr.update(),
+                            gr.update(visible=False),
+                            gr.update(value=recipe_bari_md),
+                            gr.update(value=recipe_bari_txt),
+                            gr.update(),
+                            gr.update(),
+                            gr.update(),
+                            gr.update(),
+                            token,
+                        )
+                except Exception as e:
+                    recipe_bari_md = f"**Error:** {type(e).__name__}: {e} (trace {trace_id})"
+                    yield (
+                        gr.update(),
+                        gr.update(),
+                        gr.update(visible=False),
+                        gr.update(value=recipe_bari_md),
+                        gr.update(value=_strip_markdown(recipe_bari_md)),
+                        gr.update(),
+                        gr.update(),
+                        gr.update(),
+                        gr.update(),
+                        token,
+                    )
             else:
                 yield (
                     gr.update(value="### Generating recipe…", visible=True),
@@ -501,33 +2397,158 @@ def build_ui():
                     gr.update(value=""),
                     gr.update(selected="Recipe Generator"),
                     gr.update(value=js_scroll),
-                )
-                try:
-                    recipe_std_md = chatgpt_generate_recipe(title, bariatric=False)
-                except Exception as e:
-                    recipe_std_md = f"**Error:** {type(e).__name__}: {e}"
-                yield (
-                    gr.update(value=recipe_std_md),
-                    gr.update(value=_strip_markdown(recipe_std_md)),
-                    gr.update(value=""),
                     gr.update(value=""),
                     gr.update(value=""),
-                    gr.update(selected="Recipe Generator"),
-                    gr.update(value=js_scroll),
+                    token,
                 )
+                try:
+                    async for recipe_std_md, recipe_std_txt in aiter_recipe_text(
+                            title, bariatric=False, refresh=bool(refresh), session=session):
+                        yield (
+                            gr.update(value=recipe_std_md),
+                            gr.update(value=recipe_std_txt),
+                            gr.update(),
+                            gr.update(),
+                            gr.update(),
+                            gr.update(),
+                            gr.update(),
+                            gr.update(),
+                            gr.update(),
+                            token,
+                        )
+                except Exception as e:
+                    recipe_std_md = f"**Error:** {type(e).__name__}: {e} (trace {trace_id})"
+                    yield (
+                        gr.update(value=recipe_std_md),
+                        gr.update(value=_strip_markdown(recipe_std_md)),
+                        gr.update(),
+                        gr.update(),
+                        gr.update(),
+                        gr.update(),
+                        gr.update(),
+                        gr.update(),
+                        gr.update(),
+                        token,
+                    )
+
+        async def _attach_image(token, bariatric_enabled, both=False):
+            pending = _pending_images.pop(token, None) if token else None
+            if pending is None:
+                return gr.update(), gr.update()
+            title, image_task = pending
+            try:
+                html = _image_html(title, await image_task)
+            except Exception:
+                traceback.print_exc()
+                html = ""
+            if both:
+                return gr.update(value=html), gr.update(value=html)  # one photo for both cards
+            if bariatric_enabled:
+                return gr.update(), gr.update(value=html)
+            return gr.update(value=html), gr.update()
 
         recipe_btn.click(
             _generate_recipe,
-            inputs=[selected_title_state, raw_titles_state, bariatric_enable],
-            outputs=[recipe_md, recipe_copy_box, bari_loading, bari_recipe_md, bari_recipe_copy_box, tabs, gr.HTML("")],
+            inputs=[selected_id_state, titles_state, bariatric_enable, regenerate, both_enable],
+            outputs=[recipe_md, recipe_copy_box, bari_loading, bari_recipe_md, bari_recipe_copy_box, tabs, gr.HTML(""),
+                     recipe_image, bari_recipe_image, image_token_state],
         )
+        # Fires as soon as the first yield publishes the token, so the image lands
+        # while the text is still streaming.
+        image_token_state.change(
+            _attach_image,
+            inputs=[image_token_state, bariatric_enable, both_enable],
+            outputs=[recipe_image, bari_recipe_image],
+        )
+
+        def _cache_stats():
+            st = get_cache().stats()
+            return (
+                f"**Hits:** {st['hits']} (memory {st['memory_hits']}, disk {st['disk_hits']}) | "
+                f"**Misses:** {st['misses']} | **Hit rate:** {st['hit_rate']:.0%} | "
+                f"**Stored:** {st.get('disk_items', st['memory_items'])} entries, "
+                f"{st.get('disk_bytes', 0) / 1024:.0f} KB | **Evictions:** {st['evictions']}\n\n"
+                + _load_stats()
+            )
+
+        def _load_stats():
+            ld = _api_limiter.snapshot()
+            rl = rate_limit.snapshot()
+            return (
+                f"**API calls in flight:** {ld['inflight']} / {ld['global_limit']} | "
+                f"**Queued:** {ld['waiting']} (peak {ld['peak_waiting']}) | "
+                f"**Active sessions:** {ld['active_sessions']} (max {ld['session_limit']} calls each) | "
+                f"**Completed:** {ld['completed']}\n\n"
+                f"**Rate limiter:** chat {rl['chat']['rpm']:.0f} rpm (x{rl['chat']['factor']}, "
+                f"{rl['chat']['throttled']} throttled) | image {rl['image']['rpm']:.0f} rpm | "
+                f"**Circuit:** {rl['breaker']}"
+            )
+
+        cache_stats_btn.click(_cache_stats, inputs=None, outputs=[cache_stats_md])
+
+        def _run_batch(records, upload, variants, workers, photos, refresh=False):
+            trace_id = _ui_trace("run_batch")
+            titles = (batch_pipeline.load_titles_file(upload) if upload
+                      else batch_pipeline.unique_titles([r["title"] for r in records or []]))
+            if not titles:
+                yield gr.update(value="No titles available. Generate titles or upload a title file."), [], None
+                return
+            try:
+                for progress in metrics.bind_iter(batch_pipeline.run_batch(
+                    titles, [v.lower() for v in (variants or [])], workers=int(workers),
+                    refresh=bool(refresh), photos=bool(photos),
+                )):
+                    status = f"**Batch:** {progress.summary()}"
+                    if progress.errors:
+                        status += "\n\n" + "\n".join(f"- {e}" for e in progress.errors[-5:])
+                    rows = [[r["Title"], r["Variant"], r["Servings"], r["Ingredients"]] for r in progress.rows]
+                    yield gr.update(value=status), rows, progress.output_csv
+            except Exception as e:
+                yield gr.update(value=f"**Error:** {type(e).__name__}: {e} (trace {trace_id})"), [], None
+
+        batch_btn.click(
+            _run_batch,
+            inputs=[titles_state, batch_file, batch_variants, batch_workers, batch_photos, regenerate],
+            outputs=[batch_status, batch_table, batch_csv],
+        )
+
+        library_inputs = [library_query, library_variant]
+        library_outputs = [library_table, library_page_state, library_label]
+        library_query.change(lambda q, v: _library_page(q, v, 1), inputs=library_inputs, outputs=library_outputs)
+        library_variant.change(lambda q, v: _library_page(q, v, 1), inputs=library_inputs, outputs=library_outputs)
+        library_prev_btn.click(lambda q, v, p: _library_page(q, v, p - 1),
+                               inputs=library_inputs + [library_page_state], outputs=library_outputs)
+        library_next_btn.click(lambda q, v, p: _library_page(q, v, p + 1),
+                               inputs=library_inputs + [library_page_state], outputs=library_outputs)
+        demo.load(lambda q, v: _library_page(q, v, 1), inputs=library_inputs, outputs=library_outputs)
+
+        def _on_library_select(evt: gr.SelectData):
+            row = getattr(evt, "row_value", None) if evt is not None else None
+            rec = recipe_store.get_store().get_by_id(row[0]) if row else None
+            if rec is None:
+                return gr.update(), gr.update()
+            return _image_html(rec["title"], image_store.get_store().lookup(rec["title"])), rec["markdown"]
+
+        library_table.select(_on_library_select, inputs=None, outputs=[library_image, library_md])
+
+        def _export_library(query, variant):
+            variant = (variant or "").lower()
+            name = f"recipe_store_{time.strftime('%Y%m%d-%H%M%S')}.csv"
+            path, _ = recipe_store.get_store().export_csv(
+                os.path.join(batch_pipeline.BATCH_OUTPUT_DIR, name), query or "",
+                variant if variant in recipe_store.VARIANTS else None)
+            return path
+
+        library_export_btn.click(_export_library, inputs=library_inputs, outputs=[library_csv])
 
     return demo
 
 # ================= launch =================
 if __name__ == "__main__":
+    warm()  # before the server takes requests, not racing the first one
     demo = build_ui()
-    demo.queue().launch(
+    metrics.serve()
+    demo.queue(max_size=UI_QUEUE_MAX, default_concurrency_limit=UI_CONCURRENCY_LIMIT).launch(
         server_name="0.0.0.0",
         server_port=int(os.environ.get("PORT", 7860)),
         inbrowser=True,
@@ -0,0 +1,348 @@
+# batch_pipeline.py
+import os, re, csv, json, time, traceback
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+import image_store
+import metrics
+import recipe_schema
+from response_cache import make_key
+
+# ================= config =================
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", 8))
+BATCH_ITEM_RETRIES = int(os.environ.get("BATCH_ITEM_RETRIES", 2))
+BATCH_DIR = os.environ.get("BATCH_DIR", os.path.join(".cache", "batches"))
+BATCH_OUTPUT_DIR = os.environ.get("BATCH_OUTPUT_DIR", "batch_outputs")
+BATCH_PHOTOS = os.environ.get("BATCH_PHOTOS", "1").lower() in ("1", "true", "yes")  # generate missing photos
+BATCH_PACK = os.environ.get("BATCH_PACK", "1").lower() in ("1", "true", "yes")  # several titles per API call
+
+VARIANTS = ("standard", "bariatric")
+
+# Columns recipe_builder.build_outputs reads, followed by extras it ignores.
+BUILDER_COLUMNS = ["Title", "Servings", "PrepTime", "CookTime", "ServingSize", "Ingredients", "Directions", "Photo"]
+EXTRA_COLUMNS = ["Variant", "Summary", "Storage", "Substitutions", "BariatricStages", "Nutrition"]
+
+
+# ================= title input =================
+def _clean_title(raw: str) -> str:
+    return re.sub(r"^\s*(?:\d+\s*[.)]|[-*•]+)\s*", "", str(raw), count=1).strip()
+
+
+def load_titles_file(path: str) -> List[str]:
+    """Read titles from a .txt (one per line), .csv (Title column or first column) or .jsonl file."""
+    ext = os.path.splitext(path)[1].lower()
+    titles: List[str] = []
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if ext == ".csv":
+            reader = csv.reader(f)
+            header = next(reader, [])
+            col = next((i for i, h in enumerate(header) if h.strip().lower() == "title"), None)
+            if col is None:
+                col = 0
+                titles.append(header[0] if header else "")
+            titles.extend(row[col] for row in reader if len(row) > col)
+        elif ext == ".jsonl":
+            for line in f:
+                if line.strip():
+                    obj = json.loads(line)
+                    titles.append(obj.get("title") or obj.get("Title", "") if isinstance(obj, dict) else str(obj))
+        else:
+            titles.extend(f.read().splitlines())
+    return unique_titles(titles)
+
+
+def unique_titles(raw_titles: Sequence[str]) -> List[str]:
+    seen, out = set(), []
+    for raw in raw_titles:
+        t = _clean_title(raw)
+        if t and t.lower() not in seen:
+            seen.add(t.lower())
+            out.append(t)
+    return out
+
+
+# ================= card parsing =================
+_LABEL_RE = re.compile(r"^\*\*(?P<label>[^*]+?):\*\*\s*(?P<rest>.*)$")
+
+
+def _bullets(lines: List[str]) -> List[str]:
+    return [re.sub(r"^[•\-*]\s*", "", ln).strip() for ln in lines if ln.strip()]
+
+
+def parse_recipe_card(md: str) -> Dict[str, str]:
+    """Split a generated markdown card into the databank's column layout."""
+    lines = [ln.strip() for ln in re.sub(r"<[^>]+>", "", md or "").strip().splitlines()]
+    title = re.sub(r"^[#*\s]+|[*\s]+$", "", lines[0]) if lines else ""
+    sections: Dict[str, List[str]] = {"summary": []}
+    current = "summary"
+    for line in lines[1:]:
+        m = _LABEL_RE.match(line)
+        if m:
+            current = m.group("label").strip().lower()
+            sections[current] = [m.group("rest")] if m.group("rest").strip() else []
+        else:
+            sections.setdefault(current, []).append(line)
+
+    def _one(*labels: str) -> str:
+        for label in labels:
+            if label in sections:
+                return " ".join(ln for ln in sections[label] if ln).strip()
+        return ""
+
+    yields = _one("yields")
+    servings = re.match(r"\d+", yields)
+    return {
+        "Title": title,
+        "Servings": servings.group(0) if servings else yields,
+        "PrepTime": _one("prep time"),
+        "CookTime": _one("cook time"),
+        "ServingSize": _one("serving size"),
+        "Ingredients": "; ".join(_bullets(sections.get("ingredients", []))),
+        "Directions": _one("directions"),
+        "Summary": _one("summary"),
+        "Storage": "; ".join(_bullets(sections.get("storage", []))),
+        "Substitutions": "; ".join(_bullets(sections.get("substitutions bariatric", []))),
+        "BariatricStages": _one("bariatric stage(s)"),
+        "Nutrition": _one("nutritional facts per serving"),
+    }
+
+
+# ================= progress =================
+class BatchProgress:
+    """Snapshot of a batch run, yielded after every finished item."""
+
+    def __init__(self, total: int, resumed: int):
+        self.total = total
+        self.resumed = resumed
+        self.done = resumed
+        self.failed = 0
+        self.started = time.monotonic()
+        self.rows: List[Dict[str, str]] = []
+        self.errors: List[str] = []
+        self.output_csv: Optional[str] = None
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def eta(self) -> Optional[float]:
+        finished = self.done + self.failed - self.resumed
+        remaining = self.total - self.done - self.failed
+        if finished <= 0:
+            return None
+        return self.elapsed / finished * remaining
+
+    def summary(self) -> str:
+        eta = self.eta
+        eta_txt = f"{eta:.0f}s" if eta is not None else "…"
+        resumed = f" ({self.resumed} from checkpoint)" if self.resumed else ""
+        return (f"{self.done}/{self.total} cards done{resumed}, {self.failed} failed | "
+                f"elapsed {self.elapsed:.0f}s | ETA {eta_txt}")
+
+
+# ================= checkpoints =================
+def _read_checkpoint(path: str) -> Dict[str, Dict[str, str]]:
+    done: Dict[str, Dict[str, str]] = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+                done[rec["key"]] = rec["row"]
+            except Exception:
+                continue  # a torn final line from an interrupted run
+    return done
+
+
+def write_rows_csv(rows: List[Dict[str, str]], path: str) -> str:
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=BUILDER_COLUMNS + EXTRA_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
+
+
+def rows_to_dataframe(rows: List[Dict[str, str]]):
+    """Rows as a DataFrame that recipe_builder.build_outputs accepts directly."""
+    import pandas as pd
+    return pd.DataFrame(rows, columns=BUILDER_COLUMNS + EXTRA_COLUMNS)
+
+
+# ================= pipeline =================
+def run_batch(titles: Sequence[str], variants: Sequence[str] = ("standard",), workers: int = BATCH_WORKERS,
+              retries: int = BATCH_ITEM_RETRIES, refresh: bool = False, job_id: Optional[str] = None,
+              generate: Optional[Callable[..., Any]] = None, photos: bool = BATCH_PHOTOS,
+              photo: Optional[Callable[[str], str]] = None, pack: Optional[bool] = None) -> Iterator[BatchProgress]:
+    """Generate cards for every title/variant pair on a bounded worker pool.
+
+    Finished items are appended to a JSONL checkpoint named after the job, so
+    re-running the same job skips them. ``generate`` returns a structured card
+    (dict) or card markdown; it defaults to app.chatgpt_generate_recipe_card, or
+    app.chatgpt_generate_recipe_text when RECIPE_OUTPUT=markdown. ``photo`` maps a
+    title to the Photo path: app.recipe_photo (stored or newly generated) when
+    ``photos`` is set, otherwise only already stored photos are used. With ``pack``
+    (default BATCH_PACK, only when ``generate`` is not given) the titles of each
+    variant go out app.recipe_pack_size() per call through
+    app.chatgpt_generate_recipe_pack, and each card then gets its photo on its own
+    job; titles a pack could not produce fall back to one call each. Without packing,
+    a title that needs both variants gets them from one app.chatgpt_generate_recipe_pair
+    call. The last snapshot has ``output_csv`` set.
+    """
+    generate_pack = generate_pair = None
+    if generate is None:
+        import app
+        generate = app.chatgpt_generate_recipe_card if app._structured() else app.chatgpt_generate_recipe_text
+        if BATCH_PACK if pack is None else pack:
+            generate_pack, pack_size = app.chatgpt_generate_recipe_pack, app.recipe_pack_size
+        else:
+            generate_pair = app.chatgpt_generate_recipe_pair
+    if photo is None:
+        if photos:
+            from app import recipe_photo as photo
+        else:
+            photo = image_store.photo_path
+    titles = unique_titles(titles)
+    variants = [v for v in VARIANTS if v in {str(x).lower() for x in variants}] or ["standard"]
+    items = [(t, v) for t in titles for v in variants]
+    job_id = job_id or make_key("batch", titles, variants)[:16]
+    checkpoint = os.path.join(BATCH_DIR, f"{job_id}.jsonl")
+    os.makedirs(BATCH_DIR, exist_ok=True)
+
+    done_rows = {} if refresh else _read_checkpoint(checkpoint)
+    item_key = lambda t, v: f"{v}:{t.lower()}"
+    todo = [(t, v) for t, v in items if item_key(t, v) not in done_rows]
+    progress = BatchProgress(total=len(items), resumed=len(items) - len(todo))
+    progress.rows = [done_rows[item_key(t, v)] for t, v in items if item_key(t, v) in done_rows]
+
+    def _card_row(title: str, variant: str, card: Any) -> Dict[str, str]:
+        if isinstance(card, dict):
+            row = recipe_schema.to_row(card, bariatric=(variant == "bariatric"))
+        else:
+            row = parse_recipe_card(card)
+        if not row["Ingredients"] or not row["Directions"]:
+            raise ValueError("card is missing ingredients or directions")
+        row.update(Title=title, Variant=variant)
+        return row
+
+    def _work(title: str, variant: str) -> Dict[str, str]:
+        last_err: Optional[Exception] = None
+        for attempt in range(retries + 1):
+            try:
+                card = generate(title, bariatric=(variant == "bariatric"), refresh=refresh or attempt > 0)
+                row = _card_row(title, variant, card)
+                row["Photo"] = photo(title)
+                return row
+            except Exception as e:
+                last_err = e
+        raise RuntimeError(f"{type(last_err).__name__}: {last_err}")
+
+    def _work_pack(group: List[str], variant: str) -> Dict[str, Dict[str, str]]:
+        rows = {}
+        for title, card in generate_pack(group, bariatric=(variant == "bariatric"), refresh=refresh).items():
+            try:
+                rows[title] = _card_row(title, variant, card)
+            except Exception:
+                continue  # an error or malformed card: retried on the per-title path
+        return rows
+
+    def _work_pair(title: str) -> Dict[str, Dict[str, str]]:
+        rows = {}
+        for variant, card in zip(VARIANTS, generate_pair(title, refresh=refresh)):
+            if isinstance(card, Exception):
+                continue  # retried on the per-title path
+            try:
+                rows[variant] = _card_row(title, variant, card)
+            except Exception:
+                continue
+        if rows:
+            path = photo(title)  # one photo for both cards
+            for row in rows.values():
+                row["Photo"] = path
+        return rows
+
+    def _add_photo(row: Dict[str, str]) -> Dict[str, str]:
+        last_err: Optional[Exception] = None
+        for _ in range(retries + 1):
+            try:
+                row["Photo"] = photo(row["Title"])
+                return row
+            except Exception as e:
+                last_err = e
+        raise RuntimeError(f"{type(last_err).__name__}: {last_err}")
+
+    yield progress
+    pool = ThreadPoolExecutor(max_workers=max(int(workers), 1))
+    try:
+        with open(checkpoint, "w" if refresh else "a", encoding="utf-8") as ckpt:
+            futures: Dict[Future, Any] = {}
+            packs: Dict[Future, Any] = {}
+            pairs: Dict[Future, str] = {}
+            if generate_pack is None:
+                paired = set()
+                if generate_pair is not None:
+                    paired = {t for t, v in todo if v == "standard"} & {t for t, v in todo if v == "bariatric"}
+                    pairs = {pool.submit(metrics.bind(_work_pair), t): t for t in dict.fromkeys(t for t, _ in todo)
+                             if t in paired}
+                futures = {pool.submit(metrics.bind(_work), t, v): (t, v) for t, v in todo if t not in paired}
+            else:
+                for variant in variants:
+                    group = [t for t, v in todo if v == variant]
+                    size = max(pack_size(variant == "bariatric"), 1)
+                    for lo in range(0, len(group), size):
+                        chunk = group[lo:lo + size]
+                        packs[pool.submit(metrics.bind(_work_pack), chunk, variant)] = (chunk, variant)
+            while futures or packs or pairs:
+                finished, _ = wait(list(futures) + list(packs) + list(pairs), return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    if fut in pairs:
+                        title = pairs.pop(fut)
+                        try:
+                            rows = fut.result()
+                        except Exception:
+                            traceback.print_exc()
+                            rows = {}
+                        for variant in ("standard", "bariatric"):
+                            if variant in rows:
+                                job = Future()
+                                job.set_result(rows[variant])  # recorded below like any finished item
+                            else:
+                                job = pool.submit(metrics.bind(_work), title, variant)
+                            futures[job] = (title, variant)
+                        continue
+                    if fut in packs:
+                        group, variant = packs.pop(fut)
+                        try:
+                            rows = fut.result()
+                        except Exception:
+                            traceback.print_exc()
+                            rows = {}
+                        for title in group:
+                            job = (_add_photo, rows[title]) if title in rows else (_work, title, variant)
+                            futures[pool.submit(metrics.bind(job[0]), *job[1:])] = (title, variant)
+                        continue
+                    title, variant = futures.pop(fut)
+                    try:
+                        row = fut.result()
+                    except Exception as e:
+                        traceback.print_exc()
+                        progress.failed += 1
+                        progress.errors.append(f"{title} ({variant}): {e}")
+                    else:
+                        done_rows[item_key(title, variant)] = row
+                        ckpt.write(json.dumps({"key": item_key(title, variant), "row": row}, ensure_ascii=False) + "\n")
+                        ckpt.flush()
+                        progress.rows.append(row)
+                        progress.done += 1
+                    yield progress
+    finally:
+        # A cancelled run (closed generator) drops queued items; the checkpoint keeps the rest.
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    # Keep input order in the output regardless of completion order.
+    progress.rows = [done_rows[item_key(t, v)] for t, v in items if item_key(t, v) in done_rows]
+    progress.output_csv = write_rows_csv(progress.rows, os.path.join(BATCH_OUTPUT_DIR, f"recipes_{job_id}.csv"))
+    yield progress
@@ -0,0 +1,262 @@
+# benchmark.py
+"""Offline latency benchmarks for the generation paths, run against mock_openai.
+
+    python benchmark.py                          # full suite, prints p50/p95/p99 and throughput
+    python benchmark.py --quick --json out.json  # CI-sized run, results saved for later comparison
+    python benchmark.py --baseline out.json      # exit 1 when a scenario's p95 regressed
+
+Every run uses a fresh temporary response cache, recipe store, image store, title corpus and batch
+directory, so results do not depend on (or touch) the local caches.
+"""
+import os, sys, json, time, asyncio, argparse, tempfile
+from typing import Callable, Dict, List, Optional
+
+_TMP = tempfile.mkdtemp(prefix="recipe-bench-")
+os.environ["OPENAI_BACKEND"] = "mock"
+os.environ["RECIPE_CACHE_PATH"] = os.path.join(_TMP, "responses.sqlite3")
+os.environ["BATCH_DIR"] = os.path.join(_TMP, "batches")
+os.environ["BATCH_OUTPUT_DIR"] = os.path.join(_TMP, "batch_outputs")
+os.environ["RECIPE_IMAGE_DIR"] = os.path.join(_TMP, "images")
+os.environ["TITLE_CORPUS_PATH"] = os.path.join(_TMP, "titles.sqlite3")
+os.environ["RECIPE_STORE_PATH"] = os.path.join(_TMP, "recipes.sqlite3")
+# Quota pacing would measure the limiter, not the code; opt back in by exporting these.
+for _name in ("OPENAI_RPM", "OPENAI_TPM", "OPENAI_IMAGE_RPM"):
+    os.environ.setdefault(_name, "1000000000")
+
+import app  # noqa: E402
+import batch_pipeline  # noqa: E402
+import mock_openai  # noqa: E402
+
+DEFAULT_TOLERANCE = 0.25   # allowed relative p95 growth against a baseline
+MIN_REGRESSION_S = 0.010   # ignore differences below timer noise
+
+
+# ================= stats =================
+def percentile(samples: List[float], q: float) -> float:
+    """Linear-interpolated percentile, ``q`` in [0, 100]."""
+    if not samples:
+        return 0.0
+    s = sorted(samples)
+    pos = (len(s) - 1) * q / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (pos - lo)
+
+
+def summarize(name: str, samples: List[float], units: int, wall: float, unit: str,
+              calls: int, errors: int) -> Dict:
+    return {
+        "scenario": name, "runs": len(samples),
+        "p50": percentile(samples, 50), "p95": percentile(samples, 95), "p99": percentile(samples, 99),
+        "mean": sum(samples) / len(samples) if samples else 0.0,
+        "throughput": units / wall if wall > 0 else 0.0, "unit": unit,
+        "api_calls": calls, "errors": errors,
+    }
+
+
+# ================= harness =================
+class Bench:
+    def __init__(self, server: mock_openai.MockServer):
+        self.server = server
+        self.results: List[Dict] = []
+        self._uid = 0
+
+    def uid(self) -> int:
+        self._uid += 1
+        return self._uid
+
+    def _calls(self) -> int:
+        return sum(self.server.counts.get(k, 0) for k in ("chat", "images"))
+
+    def run(self, name: str, fn: Callable[[int], int], repeat: int, unit: str) -> Dict:
+        """Time ``fn(i)`` ``repeat`` times; ``fn`` returns how many ``unit``s it produced."""
+        samples, units, errors = [], 0, 0
+        calls0 = self._calls()
+        start = time.perf_counter()
+        for i in range(repeat):
+            t0 = time.perf_counter()
+            try:
+                units += fn(i)
+            except Exception as e:
+                errors += 1
+                print(f"   ✗ {name}: {type(e).__name__}: {e}", file=sys.stderr)
+            samples.append(time.perf_counter() - t0)
+        result = summarize(name, samples, units, time.perf_counter() - start, unit, self._calls() - calls0, errors)
+        self.results.append(result)
+        print(_format_row(result), flush=True)
+        return result
+
+    def run_async(self, name: str, make_jobs: Callable[[], List], unit: str) -> Dict:
+        """Run coroutines concurrently; each one returns (latency seconds, units)."""
+        calls0 = self._calls()
+
+        async def _main():
+            return await asyncio.gather(*make_jobs(), return_exceptions=True)
+
+        start = time.perf_counter()
+        outcomes = asyncio.run(_main())
+        wall = time.perf_counter() - start
+        ok = [o for o in outcomes if not isinstance(o, BaseException)]
+        result = summarize(name, [lat for lat, _ in ok], sum(n for _, n in ok), wall, unit,
+                           self._calls() - calls0, len(outcomes) - len(ok))
+        self.results.append(result)
+        print(_format_row(result), flush=True)
+        return result
+
+
+def _format_row(r: Dict) -> str:
+    return (f"{r['scenario']:<28} {r['runs']:>5} {r['p50'] * 1000:>9.1f} {r['p95'] * 1000:>9.1f} "
+            f"{r['p99'] * 1000:>9.1f} {r['throughput']:>10.1f} {r['unit']:<8} {r['api_calls']:>6} {r['errors']:>4}")
+
+
+HEADER = (f"{'scenario':<28} {'runs':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'rate':>10} {'unit/s':<8} {'calls':>6} {'err':>4}")
+
+
+# ================= scenarios =================
+def bench_titles(b: Bench, counts, repeat: int) -> None:
+    for n in counts:
+        reps = max(2, repeat // max(1, n // 100)) if n > 100 else repeat
+        subjects = [f"Bench Subject {b.uid()}" for _ in range(reps)]
+        b.run(f"titles_{n}", lambda i: len(app.chatgpt_generate_titles(subjects[i], n, refresh=True)), reps, "titles")
+        b.run(f"titles_{n}_cached", lambda i: len(app.chatgpt_generate_titles(subjects[i], n)), reps, "titles")
+
+
+def bench_cards(b: Bench, repeat: int) -> None:
+    titles = [f"Bench Peach Cobbler {b.uid()}" for _ in range(repeat)]
+    b.run("card", lambda i: int(bool(app.chatgpt_generate_recipe(titles[i], refresh=True))), repeat, "cards")
+    b.run("card_cached", lambda i: int(bool(app.chatgpt_generate_recipe(titles[i]))), repeat, "cards")
+    b.run("card_bariatric", lambda i: int(bool(app.chatgpt_generate_recipe(titles[i], bariatric=True, refresh=True))),
+          repeat, "cards")
+    b.run("card_pair", lambda i: sum(not isinstance(c, Exception) for c in app.chatgpt_generate_recipe_pair(
+        f"Bench Pair {titles[i]}", refresh=True)), repeat, "cards")
+
+    def _first_update(i: int) -> int:
+        stream = app.iter_recipe_text(f"Bench Stream {titles[i]}", refresh=True)
+        try:
+            next(stream)
+        finally:
+            stream.close()
+        return 1
+    b.run("card_stream_first_update", _first_update, repeat, "cards")
+
+
+def bench_ui(b: Bench, cards: int, sessions: int, titles: int) -> None:
+    """The async paths the Gradio handlers drive, with several sessions at once."""
+    async def _card(i: int):
+        t0 = time.perf_counter()
+        md = ""
+        async for md, _ in app.aiter_recipe_text(f"Bench UI Card {b.uid()}", refresh=True,
+                                                  session=f"bench-{i % sessions}"):
+            pass
+        return time.perf_counter() - t0, int(bool(md))
+
+    async def _titles(i: int):
+        t0 = time.perf_counter()
+        got: List[str] = []
+        async for got in app.aiter_titles(f"Bench UI Subject {b.uid()}", titles, refresh=True,
+                                          session=f"bench-big-{i}"):
+            pass
+        return time.perf_counter() - t0, len(got)
+
+    b.run_async(f"ui_cards_x{cards}", lambda: [_card(i) for i in range(cards)], "cards")
+    b.run_async(f"ui_cards_x{cards}_during_titles_{titles}",
+                lambda: [_titles(0)] + [_card(i) for i in range(cards)], "jobs")
+
+
+def bench_batch(b: Bench, size: int, workers: int, repeat: int) -> None:
+    def _one(packed: bool) -> Callable[[int], int]:
+        def _run(i: int) -> int:
+            titles = [f"Bench Batch {b.uid()} Item {k}" for k in range(size)]
+            last = None
+            for last in batch_pipeline.run_batch(titles, variants=("standard",), workers=workers, refresh=True,
+                                                 pack=packed):
+                pass
+            if last is None or last.failed:
+                raise RuntimeError(f"{last.failed if last else size} batch items failed")
+            return last.done
+        return _run
+    b.run(f"batch_{size}_w{workers}", _one(False), repeat, "cards")
+    b.run(f"batch_{size}_w{workers}_packed", _one(True), repeat, "cards")
+
+
+# ================= regression check =================
+def compare(results: List[Dict], baseline: List[Dict], tolerance: float) -> List[str]:
+    """Scenarios whose p95 grew more than ``tolerance`` (and MIN_REGRESSION_S) over the baseline."""
+    base = {r["scenario"]: r for r in baseline}
+    regressions = []
+    for r in results:
+        old = base.get(r["scenario"])
+        if old is None:
+            continue
+        if r["p95"] > old["p95"] * (1 + tolerance) and r["p95"] - old["p95"] > MIN_REGRESSION_S:
+            regressions.append(f"{r['scenario']}: p95 {old['p95'] * 1000:.1f} ms -> {r['p95'] * 1000:.1f} ms")
+        if r["errors"] > old.get("errors", 0):
+            regressions.append(f"{r['scenario']}: errors {old.get('errors', 0)} -> {r['errors']}")
+    return regressions
+
+
+# ================= run =================
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline latency benchmarks against the mock OpenAI backend.")
+    parser.add_argument("--quick", action="store_true", help="fewer repeats, for CI")
+    parser.add_argument("--only", nargs="*", choices=["titles", "cards", "ui", "batch"], help="scenario groups to run")
+    parser.add_argument("--repeat", type=int, default=None, help="runs per scenario (default 20, 5 with --quick)")
+    parser.add_argument("--latency", type=float, default=mock_openai.MOCK_LATENCY, help="mock seconds to first byte")
+    parser.add_argument("--jitter", type=float, default=mock_openai.MOCK_JITTER)
+    parser.add_argument("--token-delay", type=float, default=mock_openai.MOCK_TOKEN_DELAY)
+    parser.add_argument("--error-rate", type=float, default=mock_openai.MOCK_ERROR_RATE)
+    parser.add_argument("--rate-limit-rate", type=float, default=mock_openai.MOCK_RATE_LIMIT_RATE)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="earlier --json output to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    server = mock_openai.ensure_server()
+    server.config = mock_openai.MockConfig(latency=args.latency, jitter=args.jitter, token_delay=args.token_delay,
+                                           error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                                           seed=args.seed)
+    repeat = args.repeat or (5 if args.quick else 20)
+    groups = set(args.only or ["titles", "cards", "ui", "batch"])
+    b = Bench(server)
+    app.warm()  # measure requests, not one-off imports
+
+    print(f"⏱️ mock latency {args.latency * 1000:.0f} ms ± {args.jitter * 1000:.0f} ms, "
+          f"errors {args.error_rate:.0%}, 429s {args.rate_limit_rate:.0%} | cache {_TMP}")
+    print(HEADER)
+    if "titles" in groups:
+        bench_titles(b, (5, 100, 1000), repeat)
+    if "cards" in groups:
+        bench_cards(b, repeat)
+    if "ui" in groups:
+        bench_ui(b, cards=16 if args.quick else 64, sessions=4, titles=1000)
+    if "batch" in groups:
+        bench_batch(b, size=20 if args.quick else 100, workers=batch_pipeline.BATCH_WORKERS,
+                    repeat=2 if args.quick else 3)
+
+    tokens = app.token_usage()
+    if tokens:
+        print("🔢 Tokens by kind: " + ", ".join(
+            f"{kind} {t['in']} in ({t['cached']} cached) / {t['out']} out" for kind, t in sorted(tokens.items())))
+    report = {"config": {k: v for k, v in vars(args).items() if k not in ("json", "baseline")},
+              "results": b.results, "tokens": tokens}
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Results written to {args.json}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(b.results, json.load(f)["results"], args.tolerance)
+        if regressions:
+            print("❌ Regressions against baseline:")
+            for line in regressions:
+                print(f"   {line}")
+            return 1
+        print("✅ No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,384 @@
+# headless.py
+"""Command line and JSON HTTP API for title and recipe generation, without the Gradio UI.
+
+Only the standard library loads at startup; app.py (and the OpenAI SDK, pandas)
+are imported by the first command or request that needs them, so ``--help``,
+cron jobs and ``serve`` start in well under a second. Every command runs the
+same functions the UI does, so cards land in the same cache, recipe store and
+image store.
+
+    python headless.py titles "peach desserts" -n 50
+    python headless.py recipe "Peach Cobbler" --bariatric --json
+    python headless.py recipe "Peach Cobbler" --both
+    python headless.py batch titles.csv --variants standard bariatric
+    python headless.py serve --port 8765
+
+HTTP endpoints (JSON bodies; ``stream`` / batch endpoints answer NDJSON, one
+object per line as results arrive):
+
+    GET  /healthz
+    POST /v1/titles   {"subject", "count", "refresh", "stream"}
+    POST /v1/recipe   {"title", "bariatric", "both", "refresh", "photo", "stream"}
+    POST /v1/recipes  {"titles", "variants", "refresh", "photos"}            -> NDJSON
+    POST /v1/batch    {"titles", "variants", "workers", "photos", "job_id"}  -> NDJSON
+"""
+import os, sys, json, time, argparse, threading, traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import metrics
+
+# ================= config =================
+HEADLESS_HOST = os.environ.get("HEADLESS_HOST", "127.0.0.1")
+HEADLESS_PORT = int(os.environ.get("HEADLESS_PORT", 8765))
+HEADLESS_TOKEN = os.environ.get("HEADLESS_TOKEN", "")  # when set, requests need "Authorization: Bearer <token>"
+HEADLESS_WORKERS = int(os.environ.get("HEADLESS_WORKERS", 8))  # concurrent packs/photos per /v1/recipes call
+HEADLESS_MAX_BODY = int(os.environ.get("HEADLESS_MAX_BODY", 8 * 1024 * 1024))
+
+VARIANTS = ("standard", "bariatric")
+
+
+def _variants(raw: Any) -> List[str]:
+    wanted = {str(v).lower() for v in ([raw] if isinstance(raw, str) else raw or [])}
+    return [v for v in VARIANTS if v in wanted] or ["standard"]
+
+
+# ================= generation =================
+def titles(subject: str, count: int, refresh: bool = False) -> Iterator[List[str]]:
+    """The titles that arrived with each finished batch (app.iter_titles yields the whole list so far)."""
+    import app
+    sent = 0
+    for so_far in app.iter_titles(subject, count, refresh=refresh):
+        if len(so_far) > sent:
+            yield so_far[sent:]
+            sent = len(so_far)
+
+
+def _card_result(title: str, variant: str, card: Any) -> Dict[str, Any]:
+    import recipe_schema
+    if isinstance(card, Exception) or not card:
+        return {"title": title, "variant": variant, "error": f"{type(card).__name__}: {card}" if card else "no card"}
+    if isinstance(card, dict):
+        return {"title": title, "variant": variant, "card": card,
+                "markdown": recipe_schema.render_markdown(card, variant == "bariatric")}
+    return {"title": title, "variant": variant, "markdown": card}
+
+
+def recipe(title: str, bariatric: bool = False, refresh: bool = False, photo: bool = False) -> Dict[str, Any]:
+    """One card (``card`` when structured, always ``markdown``), its photo generated alongside when asked."""
+    import app
+    photo_future = app._generation_pool.submit(metrics.bind(app.recipe_photo), title, refresh) if photo else None
+    generate = app.chatgpt_generate_recipe_card if app._structured() else app.chatgpt_generate_recipe_text
+    result = _card_result(title, "bariatric" if bariatric else "standard", generate(title, bariatric, refresh))
+    if photo_future is not None:
+        result["photo"] = photo_future.result() or None
+    return result
+
+
+def recipe_pair(title: str, refresh: bool = False, photo: bool = False) -> List[Dict[str, Any]]:
+    """The standard and the bariatric card from one call (app.chatgpt_generate_recipe_pair), sharing one photo."""
+    import app
+    photo_future = app._generation_pool.submit(metrics.bind(app.recipe_photo), title, refresh) if photo else None
+    results = [_card_result(title, variant, card)
+               for variant, card in zip(VARIANTS, app.chatgpt_generate_recipe_pair(title, refresh))]
+    if photo_future is not None:
+        path = photo_future.result() or None
+        for result in results:
+            result["photo"] = path
+    return results
+
+
+def iter_recipe(title: str, bariatric: bool = False, refresh: bool = False) -> Iterator[Dict[str, Any]]:
+    """Streamed card: ``{"markdown"}`` snapshots, then the finished result with ``done`` set.
+
+    The result is the last snapshot, which is the finished card. A structured card is read
+    back from the store the stream just filled, never generated a second time.
+    """
+    import app
+    import recipe_store
+    md = None
+    for md, _ in app.iter_recipe_text(title, bariatric, refresh):
+        yield {"markdown": md}
+    card = recipe_store.lookup(title, bariatric, True) if md and app._structured() else None
+    yield dict(_card_result(title, "bariatric" if bariatric else "standard", card or md), done=True)
+
+
+def iter_recipes(titles: Sequence[str], variants: Sequence[str] = ("standard",), refresh: bool = False,
+                 photos: bool = False, workers: int = HEADLESS_WORKERS) -> Iterator[Dict[str, Any]]:
+    """One result per title and variant as soon as its pack finishes (app.chatgpt_generate_recipe_pack)."""
+    import app
+    import batch_pipeline
+    titles = batch_pipeline.unique_titles(titles)
+    pool = ThreadPoolExecutor(max_workers=max(int(workers), 1), thread_name_prefix="headless")
+    try:
+        packs = {}
+        for variant in _variants(variants):
+            bariatric = variant == "bariatric"
+            size = app.recipe_pack_size(bariatric)
+            for lo in range(0, len(titles), size):
+                group = titles[lo:lo + size]
+                fut = pool.submit(metrics.bind(app.chatgpt_generate_recipe_pack), group, bariatric, refresh)
+                packs[fut] = (group, variant)
+        # Photos don't depend on the text, so they queue behind the packs and run alongside.
+        photo_futures = {t: pool.submit(metrics.bind(app.recipe_photo), t, refresh) for t in titles} if photos else {}
+        for fut in as_completed(packs):
+            group, variant = packs[fut]
+            try:
+                cards = fut.result()
+            except Exception as e:
+                cards = {t: e for t in group}
+            for title in group:
+                result = _card_result(title, variant, cards.get(title))
+                if title in photo_futures:
+                    try:
+                        result["photo"] = photo_futures[title].result() or None
+                    except Exception:
+                        result["photo"] = None
+                yield result
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_batch(titles: Sequence[str], variants: Sequence[str] = ("standard",), **kwargs) -> Iterator[Dict[str, Any]]:
+    """batch_pipeline.run_batch progress as plain dicts; rows come with the last one."""
+    import batch_pipeline
+    reported = 0
+    for progress in batch_pipeline.run_batch(titles, variants=_variants(variants), **kwargs):
+        snap = {"total": progress.total, "done": progress.done, "failed": progress.failed,
+                "resumed": progress.resumed, "elapsed": round(progress.elapsed, 3),
+                "eta": round(progress.eta, 1) if progress.eta is not None else None,
+                "errors": progress.errors[reported:]}
+        reported = len(progress.errors)
+        if progress.output_csv:
+            snap.update(output_csv=progress.output_csv, rows=progress.rows)
+        yield snap
+
+
+# ================= HTTP API =================
+class _BadRequest(ValueError):
+    pass
+
+
+def _need(body: Dict[str, Any], name: str) -> Any:
+    value = body.get(name)
+    if value in (None, "", []):
+        raise _BadRequest(f"'{name}' is required")
+    return value
+
+
+def _route(path: str, body: Dict[str, Any]) -> Any:
+    """A dict to send as JSON, or an iterator of dicts to send as NDJSON."""
+    refresh = bool(body.get("refresh"))
+    if path == "/v1/titles":
+        subject, count = str(_need(body, "subject")), int(body.get("count") or 10)
+        if body.get("stream"):
+            return ({"titles": batch} for batch in titles(subject, count, refresh))
+        return {"titles": [t for batch in titles(subject, count, refresh) for t in batch]}
+    if path == "/v1/recipe":
+        title, bariatric = str(_need(body, "title")), bool(body.get("bariatric"))
+        if body.get("both"):
+            return {"results": recipe_pair(title, refresh, photo=bool(body.get("photo")))}
+        if body.get("stream"):
+            return iter_recipe(title, bariatric, refresh)
+        return recipe(title, bariatric, refresh, photo=bool(body.get("photo")))
+    if path == "/v1/recipes":
+        return iter_recipes(_need(body, "titles"), body.get("variants") or ["standard"], refresh,
+                            photos=bool(body.get("photos")))
+    if path == "/v1/batch":
+        kwargs = {k: body[k] for k in ("workers", "job_id", "photos") if k in body}
+        return iter_batch(_need(body, "titles"), body.get("variants") or ["standard"], refresh=refresh, **kwargs)
+    raise LookupError(path)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "HeadlessServer"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _send_json(self, status: int, body: Dict[str, Any]) -> None:
+        blob = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(blob)))
+        self.end_headers()
+        self.wfile.write(blob)
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _send_ndjson(self, items: Iterator[Dict[str, Any]], trace_id: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for item in metrics.bind_iter(items):
+                self._write_chunk(json.dumps(item, ensure_ascii=False).encode("utf-8") + b"\n")
+        except (BrokenPipeError, ConnectionResetError):
+            return  # the client went away; closing the generator cancels its queued work
+        except Exception as e:
+            traceback.print_exc()
+            self._write_chunk(json.dumps({"error": f"{type(e).__name__}: {e}", "trace": trace_id}).encode() + b"\n")
+        finally:
+            close = getattr(items, "close", None)
+            if close:
+                close()
+        self._write_chunk(b"")
+
+    def _authorized(self) -> bool:
+        if HEADLESS_TOKEN and self.headers.get("Authorization", "") != f"Bearer {HEADLESS_TOKEN}":
+            self._send_json(401, {"error": "missing or wrong bearer token"})
+            return False
+        return True
+
+    def do_GET(self) -> None:
+        if self.path.split("?", 1)[0].rstrip("/") == "/healthz":
+            self._send_json(200, {"ok": True, "loaded": "app" in sys.modules})
+        else:
+            self._send_json(404, {"error": f"unknown endpoint {self.path}"})
+
+    def do_POST(self) -> None:
+        if not self._authorized():
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > HEADLESS_MAX_BODY:
+            return self._send_json(413, {"error": "request body too large"})
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(body, dict):
+                raise ValueError("body must be a JSON object")
+        except ValueError as e:
+            return self._send_json(400, {"error": f"invalid JSON body: {e}"})
+        path = self.path.split("?", 1)[0].rstrip("/")
+        metrics.inc("recipe_headless_requests_total", path=path)
+        trace_id = metrics.new_trace()
+        try:
+            result = _route(path, body)
+        except LookupError:
+            return self._send_json(404, {"error": f"unknown endpoint {self.path}"})
+        except (_BadRequest, TypeError, ValueError) as e:
+            return self._send_json(400, {"error": str(e)})
+        except Exception as e:
+            traceback.print_exc()
+            return self._send_json(500, {"error": f"{type(e).__name__}: {e}", "trace": trace_id})
+        if isinstance(result, dict):
+            self._send_json(200, dict(result, trace=trace_id))
+        else:
+            self._send_ndjson(result, trace_id)
+
+
+class HeadlessServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+def serve(host: str = HEADLESS_HOST, port: int = HEADLESS_PORT, warm: bool = True) -> HeadlessServer:
+    """Start the API on a background thread. ``warm`` imports app.py and its SDK right away, off the request path."""
+    server = HeadlessServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="headless", daemon=True).start()
+    if warm:
+        threading.Thread(target=lambda: __import__("app").warm(), name="headless-warm", daemon=True).start()
+    return server
+
+
+metrics.describe("recipe_headless_requests_total", "counter", "Headless API requests, by path.")
+
+
+# ================= CLI =================
+def _emit(obj: Any) -> None:
+    print(json.dumps(obj, ensure_ascii=False), flush=True)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Generate recipe titles and cards without the UI.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_titles = sub.add_parser("titles", help="generate unique titles for a subject")
+    p_titles.add_argument("subject")
+    p_titles.add_argument("-n", "--count", type=int, default=10)
+    p_titles.add_argument("--refresh", action="store_true", help="ignore cached title lists")
+    p_titles.add_argument("--json", action="store_true", help="NDJSON, one object per finished batch")
+    p_recipe = sub.add_parser("recipe", help="generate one or more cards")
+    p_recipe.add_argument("title", nargs="+")
+    p_recipe.add_argument("--bariatric", action="store_true")
+    p_recipe.add_argument("--both", action="store_true", help="standard and bariatric cards from one call per title")
+    p_recipe.add_argument("--photo", action="store_true", help="also generate (or reuse) the photo")
+    p_recipe.add_argument("--refresh", action="store_true", help="ignore stored and cached cards")
+    p_recipe.add_argument("--json", action="store_true", help="NDJSON results instead of markdown")
+    p_batch = sub.add_parser("batch", help="run a checkpointed batch from a .txt, .csv or .jsonl title file")
+    p_batch.add_argument("path")
+    p_batch.add_argument("--variants", nargs="+", choices=VARIANTS, default=["standard"])
+    p_batch.add_argument("--workers", type=int, default=None)
+    p_batch.add_argument("--job-id", default=None, help="checkpoint name; re-running a job resumes it")
+    p_batch.add_argument("--no-photos", action="store_true")
+    p_batch.add_argument("--refresh", action="store_true", help="start over instead of resuming")
+    p_batch.add_argument("--json", action="store_true", help="NDJSON progress instead of a status line")
+    p_serve = sub.add_parser("serve", help="run the JSON HTTP API")
+    p_serve.add_argument("--host", default=HEADLESS_HOST)
+    p_serve.add_argument("--port", type=int, default=HEADLESS_PORT)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "titles":
+        n = 0
+        for batch in titles(args.subject, args.count, args.refresh):
+            n += len(batch)
+            if args.json:
+                _emit({"titles": batch})
+            else:
+                print("\n".join(batch), flush=True)
+        if n < args.count:
+            print(f"⚠️ only {n} of {args.count} titles", file=sys.stderr)
+        return 0
+    if args.cmd == "recipe":
+        variants = list(VARIANTS) if args.both else ["bariatric" if args.bariatric else "standard"]
+        if len(args.title) > 1:
+            results = iter_recipes(args.title, variants, args.refresh, photos=args.photo)
+        elif args.both:
+            results = recipe_pair(args.title[0], args.refresh, args.photo)
+        else:
+            results = [recipe(args.title[0], args.bariatric, args.refresh, args.photo)]
+        failed = 0
+        for result in results:
+            failed += "error" in result
+            if args.json:
+                _emit(result)
+            elif "error" in result:
+                print(f"❌ {result['title']}: {result['error']}", file=sys.stderr)
+            else:
+                print(result["markdown"] + (f"\n\nPhoto: {result['photo']}" if result.get("photo") else "") + "\n")
+        return 1 if failed else 0
+    if args.cmd == "batch":
+        import batch_pipeline
+        kwargs = dict(photos=not args.no_photos, refresh=args.refresh, job_id=args.job_id)
+        if args.workers:
+            kwargs["workers"] = args.workers
+        snap: Dict[str, Any] = {}
+        for snap in iter_batch(batch_pipeline.load_titles_file(args.path), args.variants, **kwargs):
+            if args.json:
+                _emit({k: v for k, v in snap.items() if k != "rows"})
+            else:
+                for err in snap["errors"]:
+                    print(f"❌ {err}", file=sys.stderr)
+                print(f"\r{snap['done']}/{snap['total']} done, {snap['failed']} failed, {snap['elapsed']:.0f}s",
+                      end="", file=sys.stderr, flush=True)
+        if not args.json:
+            print(f"\n💾 {snap.get('output_csv')}", file=sys.stderr)
+        return 1 if snap.get("failed") else 0
+
+    server = serve(args.host, args.port)
+    metrics.serve()
+    print(f"🍳 Recipe API on http://{args.host}:{server.server_address[1]} (POST /v1/titles, /v1/recipe, "
+          f"/v1/recipes, /v1/batch)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,157 @@
+# image_store.py
+"""Content-addressed local store for generated recipe photos.
+
+Each generated image is downloaded once and saved under its sha256, with resized
+variants next to it: a small JPEG thumbnail for the UI and a print-resolution
+JPEG for DOCX cards. A title index lets regenerations of the same title reuse
+the stored image instead of paying for a new one.
+
+    .cache/images/originals/<sha>.<ext>
+    .cache/images/variants/<sha>-thumb.jpg, <sha>-print.jpg
+    .cache/images/index.json            title -> sha
+"""
+import os, io, json, time, base64, hashlib, threading, urllib.request
+from typing import Dict, Optional
+
+try:
+    from PIL import Image
+except Exception:
+    Image = None
+
+# ================= config =================
+IMAGE_DIR = os.environ.get("RECIPE_IMAGE_DIR", os.path.join(".cache", "images"))
+THUMB_SIZE = int(os.environ.get("IMAGE_THUMB_SIZE", 512))     # longest side, px (UI)
+PRINT_SIZE = int(os.environ.get("IMAGE_PRINT_SIZE", 1200))    # longest side, px (~4 in at 300 dpi)
+THUMB_QUALITY = int(os.environ.get("IMAGE_THUMB_QUALITY", 80))
+PRINT_QUALITY = int(os.environ.get("IMAGE_PRINT_QUALITY", 92))
+DOWNLOAD_TIMEOUT = float(os.environ.get("IMAGE_DOWNLOAD_TIMEOUT", 60))
+
+VARIANTS = {"thumb": (THUMB_SIZE, THUMB_QUALITY), "print": (PRINT_SIZE, PRINT_QUALITY)}
+
+_MAGIC = {b"\x89PNG": "png", b"\xff\xd8\xff": "jpg", b"RIFF": "webp", b"GIF8": "gif"}
+
+
+def _kind(data: bytes) -> str:
+    return next((ext for magic, ext in _MAGIC.items() if data.startswith(magic)), "bin")
+
+
+def title_key(title: str) -> str:
+    return " ".join(str(title).lower().split())
+
+
+# ================= store =================
+class ImageStore:
+    def __init__(self, root: str = IMAGE_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+        self._index: Optional[Dict[str, Dict]] = None
+
+    # ---------- paths ----------
+    def _dir(self, name: str) -> str:
+        path = os.path.join(self.root, name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def original_path(self, sha: str) -> Optional[str]:
+        folder = self._dir("originals")
+        paths = (os.path.join(folder, f"{sha}.{ext}") for ext in list(_MAGIC.values()) + ["bin"])
+        return next((p for p in paths if os.path.exists(p)), None)
+
+    def variant_path(self, sha: str, variant: str) -> str:
+        """Path of a resized variant; falls back to the original when Pillow is unavailable."""
+        path = os.path.join(self._dir("variants"), f"{sha}-{variant}.jpg")
+        if not os.path.exists(path) and Image is None:
+            return self.original_path(sha) or path
+        return path
+
+    # ---------- index ----------
+    def _load_index(self) -> Dict[str, Dict]:
+        if self._index is None:
+            try:
+                with open(os.path.join(self.root, "index.json"), encoding="utf-8") as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {}
+        return self._index
+
+    def _save_index(self) -> None:
+        path = os.path.join(self.root, "index.json")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._index, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def lookup(self, title: str) -> Optional[str]:
+        """sha of the stored image for ``title``, if its files are still on disk."""
+        with self._lock:
+            entry = self._load_index().get(title_key(title))
+        if entry and os.path.exists(self.variant_path(entry["sha"], "print")):
+            return entry["sha"]
+        return None
+
+    # ---------- writes ----------
+    def _resize(self, sha: str, data: bytes) -> None:
+        if Image is None:
+            return
+        with Image.open(io.BytesIO(data)) as img:
+            img = img.convert("RGB")
+            for variant, (size, quality) in VARIANTS.items():
+                path = os.path.join(self._dir("variants"), f"{sha}-{variant}.jpg")
+                if os.path.exists(path):
+                    continue
+                out = img.copy()
+                out.thumbnail((size, size), Image.LANCZOS)  # never upscales
+                tmp = f"{path}.{threading.get_ident()}.tmp"
+                out.save(tmp, "JPEG", quality=quality, optimize=True, progressive=True)
+                os.replace(tmp, path)
+
+    def put(self, title: str, data: bytes, source: str = "") -> str:
+        """Store image bytes for ``title``; returns their sha. Identical bytes are stored once."""
+        sha = hashlib.sha256(data).hexdigest()
+        if self.original_path(sha) is None:
+            path = os.path.join(self._dir("originals"), f"{sha}.{_kind(data)}")
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        self._resize(sha, data)
+        with self._lock:
+            self._load_index()[title_key(title)] = {"sha": sha, "source": source[:200], "stored_at": time.time()}
+            self._save_index()
+        return sha
+
+    def data_uri(self, sha: str, variant: str = "thumb") -> Optional[str]:
+        path = self.variant_path(sha, variant)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            data = f.read()
+        mime = "jpeg" if path.endswith(".jpg") else _kind(data)
+        return f"data:image/{mime};base64," + base64.b64encode(data).decode("ascii")
+
+
+def fetch(url: str, timeout: float = DOWNLOAD_TIMEOUT) -> bytes:
+    """Download an image (or decode a data: URL)."""
+    if url.startswith("data:"):
+        return base64.b64decode(url.split(",", 1)[1])
+    with urllib.request.urlopen(url, timeout=timeout) as resp:
+        return resp.read()
+
+
+_default_store: Optional[ImageStore] = None
+_default_lock = threading.Lock()
+
+
+def get_store() -> ImageStore:
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = ImageStore()
+        return _default_store
+
+
+def photo_path(title: str) -> str:
+    """Print-resolution photo for ``title`` if one is stored, else "" (the databank's Photo value)."""
+    store = get_store()
+    sha = store.lookup(title)
+    return store.variant_path(sha, "print") if sha else ""
@@ -0,0 +1,251 @@
+import os, re, math, time, argparse, subprocess, tempfile
+from functools import lru_cache
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+# ==============================
+# TEMPLATE GEOMETRY
+# ==============================
+# Text boxes of recipe_template.docx, in points. Page 1 holds ingredients and
+# directions side by side; the overflow page repeats both boxes full width.
+FONT_SIZE_PT = 10.5
+LINE_SPACING = 1.15              # Word "multiple" line spacing
+ITEM_SPACING_LINES = 0.25        # space after each ingredient paragraph, in lines
+
+INGREDIENTS_BOX = {"width": 180.0, "height": 430.0}
+DIRECTIONS_BOX = {"width": 330.0, "height": 430.0}
+OVERFLOW_INGREDIENTS_BOX = {"width": 540.0, "height": 300.0}
+OVERFLOW_DIRECTIONS_BOX = {"width": 540.0, "height": 340.0}
+
+BASE_PAGES = 2                   # front and back of a card that fits
+
+# Width scale applied to the font metrics; tuned with `python layout_estimator.py calibrate`.
+WIDTH_SCALE = float(os.environ.get("LAYOUT_WIDTH_SCALE", 1.0))
+
+# Advance widths in 1/1000 em, close to Calibri. Unlisted characters use DEFAULT_WIDTH.
+_WIDTH_GROUPS = {
+    " ": 226, "ijl|": 229, ".,;:'!`": 252, "frt()[]/-": 340, "\"*": 400,
+    "abcdeghknopqsuvxyz": 500, "0123456789": 507, "m": 799, "w": 715,
+    "IJ": 290, "EFLT": 470, "BCKPRSXYZ": 545, "ADGHNOQUV": 610, "M": 855, "W": 890,
+}
+_WIDTHS = {ch: w for chars, w in _WIDTH_GROUPS.items() for ch in chars}
+DEFAULT_WIDTH = 520
+
+
+# ==============================
+# METRICS
+# ==============================
+@lru_cache(maxsize=65536)
+def text_width(word: str) -> float:
+    """Width of ``word`` in points at FONT_SIZE_PT (before WIDTH_SCALE)."""
+    return sum(_WIDTHS.get(ch, DEFAULT_WIDTH) for ch in word) * FONT_SIZE_PT / 1000.0
+
+
+_SPACE = _WIDTHS[" "] * FONT_SIZE_PT / 1000.0
+
+
+@lru_cache(maxsize=65536)
+def _wrapped_lines_cached(text: str, box_width: float, scale: float) -> int:
+    if not text:
+        return 0
+    if text_width(text) * scale <= box_width:
+        return 1  # fast path: the whole paragraph fits on one line
+    words = text.split()
+    lines, used = 1, 0.0
+    space = _SPACE * scale
+    for word in words:
+        w = text_width(word) * scale
+        if w > box_width:
+            # A word longer than the box is broken across lines.
+            extra = used + (space if used else 0.0) + w
+            lines += int(extra // box_width)
+            used = extra % box_width
+            continue
+        need = w if used == 0.0 else used + space + w
+        if need <= box_width:
+            used = need
+        else:
+            lines += 1
+            used = w
+    return lines
+
+
+def wrapped_lines(text: str, box_width: float, scale: float = None) -> int:
+    """Number of lines ``text`` wraps to in a box ``box_width`` points wide (greedy word wrap)."""
+    return _wrapped_lines_cached(str(text).strip(), float(box_width), WIDTH_SCALE if scale is None else scale)
+
+
+def _line_height() -> float:
+    return FONT_SIZE_PT * LINE_SPACING
+
+
+def split_ingredients(ingredients: str):
+    return [item.strip() for item in str(ingredients).split(";") if item.strip()]
+
+
+def _capacity(box) -> float:
+    return box["height"] / _line_height()
+
+
+# ==============================
+# ESTIMATION
+# ==============================
+def ingredient_lines(ingredients: str, box=INGREDIENTS_BOX, scale: float = None) -> float:
+    items = split_ingredients(ingredients)
+    return sum(wrapped_lines(item, box["width"], scale) for item in items) + ITEM_SPACING_LINES * len(items)
+
+
+def direction_lines(directions: str, box=DIRECTIONS_BOX, scale: float = None) -> float:
+    paragraphs = [p for p in str(directions).splitlines() if p.strip()]
+    return float(sum(wrapped_lines(p, box["width"], scale) for p in paragraphs))
+
+
+def estimate(ingredients: str, directions: str, scale: float = None) -> dict:
+    """Estimate the layout of one card.
+
+    Returns the wrapped line counts for both page-1 boxes, whether the card
+    overflows page 1, and the expected page count (2, 3, or more when even the
+    overflow page cannot hold the text).
+    """
+    ing = ingredient_lines(ingredients, scale=scale)
+    dirs = direction_lines(directions, scale=scale)
+    overflow = ing > _capacity(INGREDIENTS_BOX) or dirs > _capacity(DIRECTIONS_BOX)
+    pages = BASE_PAGES
+    if overflow:
+        fill = max(
+            ingredient_lines(ingredients, OVERFLOW_INGREDIENTS_BOX, scale) / _capacity(OVERFLOW_INGREDIENTS_BOX),
+            direction_lines(directions, OVERFLOW_DIRECTIONS_BOX, scale) / _capacity(OVERFLOW_DIRECTIONS_BOX),
+        )
+        pages += max(1, math.ceil(fill))
+    return {"ingredient_lines": ing, "direction_lines": dirs, "overflow": overflow, "pages": pages}
+
+
+def _lines_frame(df: pd.DataFrame, ing_box, dir_box, scale: float):
+    """Per-row wrapped line counts, computed over exploded ingredient items."""
+    ing = df["Ingredients"].fillna("").astype(str)
+    items = ing.str.split(";").explode().str.strip()
+    items = items[items.str.len() > 0]
+    item_lines = items.map(lambda t: wrapped_lines(t, ing_box["width"], scale)).astype(float)
+    per_row = (item_lines + ITEM_SPACING_LINES).groupby(level=0).sum()
+    ing_lines = per_row.reindex(df.index, fill_value=0.0).to_numpy()
+
+    dirs = df["Directions"].fillna("").astype(str)
+    dir_lines = dirs.map(lambda t: direction_lines(t, dir_box, scale)).to_numpy(dtype=float)
+    return ing_lines, dir_lines
+
+
+def estimate_frame(df: pd.DataFrame, scale: float = None) -> pd.DataFrame:
+    """Vectorized ``estimate`` over a DataFrame with Ingredients and Directions columns."""
+    scale = WIDTH_SCALE if scale is None else scale
+    df = df.reset_index(drop=True)
+    ing_lines, dir_lines = _lines_frame(df, INGREDIENTS_BOX, DIRECTIONS_BOX, scale)
+    overflow = (ing_lines > _capacity(INGREDIENTS_BOX)) | (dir_lines > _capacity(DIRECTIONS_BOX))
+
+    pages = np.full(len(df), BASE_PAGES, dtype=int)
+    if overflow.any():
+        sub = df[overflow]
+        o_ing, o_dir = _lines_frame(sub, OVERFLOW_INGREDIENTS_BOX, OVERFLOW_DIRECTIONS_BOX, scale)
+        fill = np.maximum(o_ing / _capacity(OVERFLOW_INGREDIENTS_BOX), o_dir / _capacity(OVERFLOW_DIRECTIONS_BOX))
+        pages[overflow] += np.maximum(1, np.ceil(fill)).astype(int)
+
+    return pd.DataFrame({
+        "ingredient_lines": ing_lines, "direction_lines": dir_lines,
+        "overflow": overflow, "pages": pages,
+    })
+
+
+# ==============================
+# CALIBRATION / BENCHMARK
+# ==============================
+def measure_pages(docx_path) -> int:
+    """Page count of a rendered card, via LibreOffice's PDF export (needs `soffice` on PATH)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            subprocess.run(["soffice", "--headless", "--convert-to", "pdf", "--outdir", tmp, str(docx_path)],
+                           check=True, capture_output=True, timeout=120)
+        except FileNotFoundError:
+            raise RuntimeError("LibreOffice (soffice) is required to measure rendered page counts")
+        pdf = Path(tmp) / (Path(docx_path).stem + ".pdf")
+        return len(re.findall(rb"/Type\s*/Page(?!s)", pdf.read_bytes()))
+
+
+def observed_pages(df: pd.DataFrame, docx_dir) -> pd.Series:
+    """Use a Pages column if present, otherwise measure NNN-slug.docx files in ``docx_dir``."""
+    if "Pages" in df.columns:
+        return df["Pages"].astype(int)
+    from recipe_builder import slugify
+    paths = [Path(docx_dir) / f"{i+1:03d}-{slugify(str(t))}.docx" for i, t in enumerate(df["Title"])]
+    return pd.Series([measure_pages(p) for p in paths], index=df.index)
+
+
+def calibrate(df: pd.DataFrame, pages: pd.Series, scales=None) -> dict:
+    """Grid-search WIDTH_SCALE against observed page counts and report accuracy."""
+    scales = np.round(np.arange(0.80, 1.205, 0.01), 2) if scales is None else scales
+    truth = pages.to_numpy()
+    results = []
+    for scale in scales:
+        predicted = estimate_frame(df, scale=float(scale))["pages"].to_numpy()
+        results.append((float((predicted == truth).mean()), -abs(scale - 1.0), float(scale), predicted))
+    accuracy, _, best, predicted = max(results, key=lambda r: (r[0], r[1]))
+    current = estimate_frame(df)["pages"].to_numpy()
+    return {
+        "samples": len(df),
+        "best_scale": best,
+        "best_accuracy": accuracy,
+        "current_scale": WIDTH_SCALE,
+        "current_accuracy": float((current == truth).mean()),
+        "mismatches": [(str(t), int(p), int(o)) for t, p, o in zip(df["Title"], predicted, truth) if p != o],
+    }
+
+
+def benchmark(df: pd.DataFrame, repeat: int = 5) -> dict:
+    """Time the scalar and vectorized paths (cold metric caches each round)."""
+    def _cold(fn):
+        best = float("inf")
+        for _ in range(repeat):
+            text_width.cache_clear()
+            _wrapped_lines_cached.cache_clear()
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    rows = list(zip(df["Ingredients"].fillna("").astype(str), df["Directions"].fillna("").astype(str)))
+    scalar = _cold(lambda: [estimate(i, d) for i, d in rows])
+    vector = _cold(lambda: estimate_frame(df))
+    n = max(len(df), 1)
+    return {"rows": len(df), "scalar_us_per_row": scalar / n * 1e6, "frame_us_per_row": vector / n * 1e6}
+
+
+# ==============================
+# RUN
+# ==============================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate recipe card layout, calibrate and benchmark it.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_est = sub.add_parser("estimate", help="print the estimated layout for every row")
+    p_cal = sub.add_parser("calibrate", help="compare estimates with rendered page counts")
+    p_cal.add_argument("--docx-dir", default="recipes_docx", help="rendered cards (ignored when the CSV has a Pages column)")
+    p_bench = sub.add_parser("bench", help="time the scalar and vectorized estimators")
+    p_bench.add_argument("--repeat", type=int, default=5)
+    for p in (p_est, p_cal, p_bench):
+        p.add_argument("--input", default="master_recipes.csv")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.input)
+    if args.cmd == "estimate":
+        out = estimate_frame(df)
+        out.insert(0, "Title", df["Title"].to_numpy())
+        print(out.to_string(index=False))
+    elif args.cmd == "calibrate":
+        report = calibrate(df, observed_pages(df, args.docx_dir))
+        print(f"📏 {report['samples']} samples | current scale {report['current_scale']:.2f}: "
+              f"{report['current_accuracy']:.1%} | best scale {report['best_scale']:.2f}: {report['best_accuracy']:.1%}")
+        for title, predicted, observed in report["mismatches"]:
+            print(f"   ✗ {title}: estimated {predicted} pages, rendered {observed}")
+        print(f"Set LAYOUT_WIDTH_SCALE={report['best_scale']:.2f} to use the best fit.")
+    else:
+        report = benchmark(df, repeat=args.repeat)
+        print(f"⏱️ {report['rows']} rows | scalar {report['scalar_us_per_row']:.1f} µs/row | "
+              f"vectorized {report['frame_us_per_row']:.1f} µs/row")
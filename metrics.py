@@ -0,0 +1,317 @@
+# metrics.py
+"""In-process counters and latency histograms in the Prometheus text format, with trace IDs.
+
+Hot paths wrap themselves in ``timed(name, **labels)``; the registry renders
+everything for a scrape at /metrics, served by ``serve`` on METRICS_PORT next
+to the Gradio app. Values that already live elsewhere (limiter queues, cache
+hit rates) are registered with ``collect`` and read at scrape time.
+
+A trace ID is a contextvar: a UI handler calls ``new_trace()`` and every span
+timed underneath it (API calls, retries, image generation) is kept with that ID,
+in memory for /traces?id=... and, when METRICS_TRACE_LOG is set, as JSON lines.
+asyncio tasks and ``asyncio.to_thread`` carry the ID automatically; work handed
+to a ThreadPoolExecutor needs ``bind``, and a generator stepped from several
+threads ``bind_iter``.
+"""
+import os, json, time, uuid, bisect, functools, threading, contextvars
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+# ================= config =================
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9464))  # 0 disables the endpoint
+TRACE_LOG = os.environ.get("METRICS_TRACE_LOG", "")         # JSONL of traced spans; empty keeps them in memory only
+TRACE_BUFFER = int(os.environ.get("METRICS_TRACE_BUFFER", 5000))
+
+# Seconds; wide enough for both per-line post-processing and multi-minute batch calls.
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+                   30.0, 60.0, 120.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    body = ",".join('%s="%s"' % (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                    for k, v in pairs)
+    return "{" + body + "}"
+
+
+def _fmt_value(v: float) -> str:
+    return "+Inf" if v == float("inf") else repr(float(v))
+
+
+# ================= registry =================
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count", "max")
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Estimate from the buckets (linear within a bucket, capped at the largest observation)."""
+        if not self.count:
+            return 0.0
+        rank, seen, lower = q * self.count, 0, 0.0
+        for upper, n in zip(self.buckets + (self.max,), self.counts):
+            if n and seen + n >= rank:
+                return min(lower + (upper - lower) * (rank - seen) / n, self.max)
+            seen += n
+            lower = upper
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        mean = self.sum / self.count if self.count else 0.0
+        return {"count": self.count, "total_s": round(self.sum, 4), "mean_ms": round(mean * 1000, 3),
+                "p50_ms": round(self.quantile(0.5) * 1000, 3), "p95_ms": round(self.quantile(0.95) * 1000, 3),
+                "max_ms": round(self.max * 1000, 3)}
+
+
+class Registry:
+    """Counters and histograms keyed by name and label set; thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta: Dict[str, Tuple[str, str]] = {}  # name -> (type, help)
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, Dict[str, Any], float]]]] = []
+
+    def describe(self, name: str, kind: str, help: str) -> None:
+        self._meta[name] = (kind, help)
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        key = _key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = Histogram()
+            hist.observe(value)
+
+    def collect(self, fn: Callable[[], Iterable[Tuple[str, Dict[str, Any], float]]]) -> None:
+        """Register a callback yielding (gauge name, labels, value), called on every scrape."""
+        self._collectors.append(fn)
+
+    def histogram_summary(self, name: str, label: str) -> Dict[str, Dict[str, float]]:
+        """Summary stats of histogram ``name`` per value of ``label``."""
+        with self._lock:
+            return {dict(key).get(label, ""): hist.summary() for key, hist in self._histograms.get(name, {}).items()}
+
+    def counter_values(self, name: str) -> Dict[LabelKey, float]:
+        with self._lock:
+            return dict(self._counters.get(name, {}))
+
+    def render(self) -> str:
+        """All series in the Prometheus text exposition format (version 0.0.4)."""
+        gauges: Dict[str, Dict[LabelKey, float]] = {}
+        for fn in list(self._collectors):
+            try:
+                for name, labels, value in fn():
+                    gauges.setdefault(name, {})[_key(labels)] = float(value)
+            except Exception:
+                continue  # a failing collector must not break the scrape
+        lines: List[str] = []
+
+        def _head(name: str, default_kind: str) -> None:
+            kind, help = self._meta.get(name, (default_kind, ""))
+            if help:
+                lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            for name in sorted(self._counters):
+                _head(name, "counter")
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append(f"{name}{_fmt_labels(key)} {_fmt_value(value)}")
+            for name in sorted(self._histograms):
+                _head(name, "histogram")
+                for key, hist in sorted(self._histograms[name].items()):
+                    cumulative = 0
+                    for upper, n in zip(hist.buckets + (float("inf"),), hist.counts):
+                        cumulative += n
+                        lines.append(f"{name}_bucket{_fmt_labels(key, ('le', _fmt_value(upper)))} {cumulative}")
+                    lines.append(f"{name}_sum{_fmt_labels(key)} {_fmt_value(hist.sum)}")
+                    lines.append(f"{name}_count{_fmt_labels(key)} {hist.count}")
+        for name in sorted(gauges):
+            _head(name, "gauge")
+            for key, value in sorted(gauges[name].items()):
+                lines.append(f"{name}{_fmt_labels(key)} {_fmt_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+describe, inc, observe, collect = REGISTRY.describe, REGISTRY.inc, REGISTRY.observe, REGISTRY.collect
+
+
+# ================= traces =================
+_trace: contextvars.ContextVar = contextvars.ContextVar("recipe_trace", default=None)
+_spans: Deque[Dict[str, Any]] = deque(maxlen=TRACE_BUFFER)
+_log_lock = threading.Lock()
+
+
+def new_trace() -> str:
+    """Start a trace for the current context (one UI event / request) and return its ID."""
+    trace_id = uuid.uuid4().hex[:16]
+    _trace.set(trace_id)
+    return trace_id
+
+
+def current_trace() -> Optional[str]:
+    return _trace.get()
+
+
+def bind(fn: Callable) -> Callable:
+    """``fn`` wrapped to run in a copy of the caller's context, for ThreadPoolExecutor.submit."""
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+def bind_iter(iterator: Iterable) -> Iterator:
+    """Advance ``iterator`` in one copy of the caller's context, whatever thread drives each step."""
+    ctx = contextvars.copy_context()
+    it = iter(iterator)
+    while True:
+        try:
+            item = ctx.run(next, it)
+        except StopIteration:
+            return
+        yield item
+
+
+def _record_span(name: str, seconds: float, labels: Dict[str, Any], outcome: str, trace_id: str) -> None:
+    span = {"trace": trace_id, "name": name, "seconds": round(seconds, 6), "outcome": outcome,
+            "end": time.time(), **{k: str(v) for k, v in labels.items()}}
+    _spans.append(span)
+    if TRACE_LOG:
+        with _log_lock, open(TRACE_LOG, "a", encoding="utf-8") as f:
+            f.write(json.dumps(span) + "\n")
+
+
+def spans(trace_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Recent spans, oldest first; only those of ``trace_id`` when given."""
+    return [s for s in list(_spans) if trace_id is None or s["trace"] == trace_id]
+
+
+@contextmanager
+def timed(name: str, registry: Optional[Registry] = None, **labels):
+    """Observe the block's duration in histogram ``name`` with an ``outcome`` label (ok/error/cancelled)."""
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except GeneratorExit:
+        outcome = "cancelled"  # a stream the caller stopped reading
+        raise
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        (registry or REGISTRY).observe(name, seconds, outcome=outcome, **labels)
+        trace_id = _trace.get()
+        if trace_id is not None:
+            _record_span(name, seconds, labels, outcome, trace_id)
+
+
+def instrument(name: str, **labels) -> Callable[[Callable], Callable]:
+    """Decorator timing every call of a small hot function (histogram only, no trace spans)."""
+    def _wrap(fn: Callable) -> Callable:
+        key = dict(labels, outcome="ok")
+
+        @functools.wraps(fn)
+        def _inner(*args, **kwargs):
+            start = time.perf_counter()
+            result = fn(*args, **kwargs)
+            REGISTRY.observe(name, time.perf_counter() - start, **key)
+            return result
+        return _inner
+    return _wrap
+
+
+# ================= endpoint =================
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        path, _, query = self.path.partition("?")
+        if path == "/metrics":
+            body, ctype = REGISTRY.render().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+        elif path == "/traces":
+            trace_id = parse_qs(query).get("id", [None])[0]
+            body, ctype = json.dumps(spans(trace_id)).encode("utf-8"), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+_server: Optional[MetricsServer] = None
+_server_lock = threading.Lock()
+
+
+def serve(port: int = METRICS_PORT, host: str = "0.0.0.0") -> Optional[MetricsServer]:
+    """Start the /metrics and /traces endpoint once per process (no-op when ``port`` is 0)."""
+    global _server
+    with _server_lock:
+        if _server is None and port:
+            try:
+                _server = MetricsServer((host, port), _Handler)
+            except OSError as e:
+                print(f"⚠️ Metrics endpoint not started on port {port}: {e}")
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+            print(f"📈 Metrics at http://{host}:{_server.server_address[1]}/metrics")
+        return _server
+
+
+# ================= catalog =================
+describe("recipe_api_seconds", "histogram", "OpenAI call latency including retries and quota waits, by op and mode.")
+describe("recipe_api_first_token_seconds", "histogram", "Time to the first streamed delta.")
+describe("recipe_api_tokens_total", "counter", "Chat tokens by kind: prompt (in), prompt served from the provider cache (cached), completion (out); estimated when usage is absent.")
+describe("recipe_api_retries_total", "counter", "Retried API attempts by error class.")
+describe("recipe_api_backoff_seconds_total", "counter", "Seconds slept between retries.")
+describe("recipe_api_quota_wait_seconds_total", "counter", "Seconds waited on the client-side rate limiter.")
+describe("recipe_api_errors_total", "counter", "API calls that failed after retries, by error class.")
+describe("recipe_image_seconds", "histogram", "Image generation latency including download and storage.")
+describe("recipe_image_failures_total", "counter", "Image generations that produced no stored photo.")
+describe("recipe_pack_calls_total", "counter", "Packed multi-recipe calls, by whether the reply was truncated.")
+describe("recipe_pack_cards_total", "counter", "Cards requested in packed calls, by outcome (ok, malformed, missing).")
+describe("recipe_truncated_total", "counter", "Card replies cut off at their output-token budget, by kind and outcome (retried, failed).")
+describe("recipe_pair_cards_total", "counter", "Cards requested in standard + bariatric pair calls, by outcome (ok, fallback).")
+describe("recipe_prefetch_total", "counter", "Speculatively generated cards, by outcome (queued, done, failed, cancelled).")
+describe("recipe_postprocess_seconds", "histogram", "Markdown post-processing time per call, by step.")
+describe("recipe_ui_events_total", "counter", "UI events handled, by handler.")
@@ -0,0 +1,381 @@
+# mock_openai.py
+"""Local stand-in for the OpenAI API, for offline runs and benchmarks.
+
+Serves /v1/chat/completions (plain and streamed), /v1/images/generations and the
+placeholder images they point at, with configurable latency, jitter, error rates
+and canned recipe markdown. Title prompts get the requested number of titles back;
+every other chat prompt gets a recipe card, one per numbered title for packed
+prompts, or a standard and a bariatric card for pair prompts. Replies longer than the output-token cap (or the request's max_completion_tokens)
+are cut with finish_reason "length". Usage reports cached prompt tokens the way the API's
+prefix cache does: whole 128-token blocks of a prompt prefix seen before, for prompts of
+at least MOCK_OPENAI_PROMPT_CACHE_MIN tokens; streams add it when include_usage is set.
+
+    OPENAI_BACKEND=mock python app.py          # UI against an in-process mock
+    python mock_openai.py --port 8010          # standalone; point OPENAI_BASE_URL at it
+"""
+import os, re, sys, json, time, zlib, random, struct, argparse, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+# ================= config =================
+MOCK_LATENCY = float(os.environ.get("MOCK_OPENAI_LATENCY", 0.05))         # seconds before the first byte
+MOCK_JITTER = float(os.environ.get("MOCK_OPENAI_JITTER", 0.02))           # uniform extra latency, seconds
+MOCK_TOKEN_DELAY = float(os.environ.get("MOCK_OPENAI_TOKEN_DELAY", 0.0))  # seconds per streamed chunk
+MOCK_ERROR_RATE = float(os.environ.get("MOCK_OPENAI_ERROR_RATE", 0.0))    # share of 500 responses
+MOCK_RATE_LIMIT_RATE = float(os.environ.get("MOCK_OPENAI_429_RATE", 0.0)) # share of 429 responses
+MOCK_RETRY_AFTER_MS = int(os.environ.get("MOCK_OPENAI_RETRY_AFTER_MS", 100))
+MOCK_DUPLICATE_RATE = float(os.environ.get("MOCK_OPENAI_DUPLICATE_RATE", 0.02))  # repeated titles per batch
+MOCK_INVALID_RATE = float(os.environ.get("MOCK_OPENAI_INVALID_RATE", 0.0))  # JSON cards with a broken field
+MOCK_MAX_OUTPUT_TOKENS = int(os.environ.get("MOCK_OPENAI_MAX_OUTPUT_TOKENS", 16384))  # longer replies are cut
+MOCK_PROMPT_CACHE_MIN = int(os.environ.get("MOCK_OPENAI_PROMPT_CACHE_MIN", 1024))  # shortest cacheable prompt, tokens
+MOCK_SEED = os.environ.get("MOCK_OPENAI_SEED")
+
+_TITLE_RE = re.compile(r"Generate exactly (\d+) recipe titles for the subject: (.+?)\.?\n", re.IGNORECASE)
+_RECIPE_TITLE_RE = re.compile(r"titled '(.+?)'")
+_PACK_TITLE_RE = re.compile(r"^\s*(\d+)\.\s+'(.+)'\s*$", re.MULTILINE)
+_PACK_MARKER = "=== RECIPE {n} ==="
+_PAIR_MARKERS = ("=== STANDARD ===", "=== BARIATRIC ===")
+_CACHE_BLOCK = 128  # tokens per cached prefix block
+
+_STYLES = ["Classic", "Rustic", "Spiced", "Skillet", "Sheet-Pan", "Slow Cooker", "Grilled", "Roasted",
+           "Brown Butter", "Honey", "Maple", "Lemon", "Ginger", "Smoky", "Herbed", "Creamy", "Crispy",
+           "Vanilla", "Cinnamon", "Cardamom"]
+_ADDITIONS = ["Almonds", "Pecans", "Oat Crumble", "Berries", "Ricotta", "Basil", "Thyme", "Bourbon",
+              "Greek Yogurt", "Coconut", "Pistachios", "Mint", "Caramel", "Cornmeal Biscuits", "Plums",
+              "Rhubarb", "Blackberries", "Sage", "Walnuts", "Cream Cheese", "Apples", "Pears", "Cherries",
+              "Orange Zest", "Brown Sugar", "Rosemary", "Chia", "Quinoa", "Cottage Cheese", "Whipped Cream"]
+_FORMS = ["Bake", "Bars", "Cups", "Parfait", "Skillet", "Muffins", "Crisp", "Bowls", "Galette", "Pudding"]
+
+
+class MockConfig:
+    """Behaviour of a mock server; attributes may be changed while it runs."""
+
+    def __init__(self, latency: float = MOCK_LATENCY, jitter: float = MOCK_JITTER,
+                 token_delay: float = MOCK_TOKEN_DELAY, error_rate: float = MOCK_ERROR_RATE,
+                 rate_limit_rate: float = MOCK_RATE_LIMIT_RATE, retry_after_ms: int = MOCK_RETRY_AFTER_MS,
+                 duplicate_rate: float = MOCK_DUPLICATE_RATE, invalid_rate: float = MOCK_INVALID_RATE,
+                 max_output_tokens: int = MOCK_MAX_OUTPUT_TOKENS, prompt_cache_min: int = MOCK_PROMPT_CACHE_MIN,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_delay = token_delay
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after_ms = retry_after_ms
+        self.duplicate_rate = duplicate_rate
+        self.invalid_rate = invalid_rate
+        self.max_output_tokens = max_output_tokens
+        self.prompt_cache_min = prompt_cache_min
+        self.rng = random.Random(seed if seed is not None else (int(MOCK_SEED) if MOCK_SEED else None))
+
+
+# ================= canned content =================
+def canned_titles(subject: str, count: int, rng: random.Random, duplicate_rate: float = 0.0) -> List[str]:
+    """``count`` plausible titles for ``subject``; ``duplicate_rate`` of them repeat an earlier one."""
+    out: List[str] = []
+    for _ in range(count):
+        if out and rng.random() < duplicate_rate:
+            out.append(rng.choice(out))
+            continue
+        out.append(f"{rng.choice(_STYLES)} {subject} {rng.choice(_FORMS)} with {rng.choice(_ADDITIONS)}")
+    return out
+
+
+def canned_recipe(title: str, bariatric: bool = False) -> str:
+    """A card in the exact markdown layout the recipe prompts ask for."""
+    stages = "**Bariatric Stage(s):** Stage 3, Stage 4\n" if bariatric else ""
+    subs = ("**Substitutions Bariatric:**\n• Use sugar-free sweetener\n• Swap cream for Greek yogurt\n"
+            "• Add unflavored protein powder\n\n") if bariatric else ""
+    return (
+        f"**{title}**\n{stages}\n"
+        f"A simple, reliable take on {title.lower()}. Ready in well under an hour with pantry staples.\n\n"
+        "**Yields:** 4 servings\n**Prep time:** 15 minutes\n**Cook time:** 30 minutes\n\n"
+        "**Ingredients:**\n• 2 cups sliced peaches\n• 1 tablespoon lemon juice\n• 1/2 cup rolled oats\n"
+        "• 1/4 cup almond flour\n• 2 tablespoons melted butter\n• 1 teaspoon ground cinnamon\n"
+        "• 1 pinch kosher salt\n\n"
+        "**Directions:**\nHeat the oven to 375°F. Toss the fruit with lemon juice and spread it in a baking dish. "
+        "Mix oats, flour, butter, cinnamon and salt, scatter over the fruit and bake until golden, about 30 minutes. "
+        "Cool for 10 minutes before serving.\n\n"
+        f"{subs}"
+        "**Storage:**\n• Refrigerate up to 3 days.\n• Freeze up to 3 months.\n\n"
+        "**Serving size:** 1 serving ~6 oz | 1 cup\n\n"
+        "**Nutritional Facts per Serving:**\n"
+        "Calories 240 | Protein 5 g | Total Fat 11 g (4 g sat | 0 g trans) | Carbohydrates 32 g | "
+        "Fiber 4 g | Sugar 18 g | Sodium 90 mg\n"
+    )
+
+
+def canned_recipe_json(title: str, bariatric: bool = False) -> Dict:
+    """The canned card as a structured object (recipe_schema field names)."""
+    card = {
+        "title": title,
+        "summary": f"A simple, reliable take on {title.lower()}. Ready in well under an hour with pantry staples.",
+        "yields": "4 servings", "prep_time": "15 minutes", "cook_time": "30 minutes",
+        "ingredients": ["2 cups sliced peaches", "1 tablespoon lemon juice", "1/2 cup rolled oats",
+                        "1/4 cup almond flour", "2 tablespoons melted butter", "1 teaspoon ground cinnamon",
+                        "1 pinch kosher salt"],
+        "directions": ["Heat the oven to 375°F.", "Toss the fruit with lemon juice and spread it in a baking dish.",
+                       "Mix oats, flour, butter, cinnamon and salt, scatter over the fruit and bake until golden, "
+                       "about 30 minutes.", "Cool for 10 minutes before serving."],
+        "storage": ["Refrigerate up to 3 days.", "Freeze up to 3 months."],
+        "serving_size": "1 serving ~6 oz | 1 cup",
+        "nutrition": {"calories": 240, "protein_g": 5, "total_fat_g": 11, "saturated_fat_g": 4, "trans_fat_g": 0,
+                      "carbohydrates_g": 32, "fiber_g": 4, "sugar_g": 18, "sodium_mg": 90},
+    }
+    if bariatric:
+        card["bariatric_stages"] = ["Stage 3", "Stage 4"]
+        card["substitutions"] = ["Use sugar-free sweetener", "Swap cream for Greek yogurt",
+                                 "Add unflavored protein powder"]
+    return card
+
+
+def _placeholder_png(width: int = 64, height: int = 64, rgb=(236, 178, 120)) -> bytes:
+    """A solid-colour PNG built with zlib, so the mock needs no imaging library."""
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+    raw = b"".join(b"\x00" + bytes(rgb) * width for _ in range(height))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b""))
+
+
+_PNG = _placeholder_png()
+
+
+def reply_for(messages: List[Dict[str, str]], cfg: MockConfig, response_format: Optional[Dict] = None) -> str:
+    system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+    user = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+    m = _TITLE_RE.search(user + "\n")
+    if m:
+        return "\n".join(canned_titles(m.group(2).strip(), int(m.group(1)), cfg.rng, cfg.duplicate_rate))
+    bariatric = "bariatric" in system.lower()
+    schema = (response_format or {}).get("json_schema") or {}
+    packed = [t for _, t in _PACK_TITLE_RE.findall(user)]
+    if packed and str(schema.get("name", "")).endswith("recipe_pack"):
+        return json.dumps({"recipes": [_json_card(t, bariatric, cfg) for t in packed]}, ensure_ascii=False)
+    if packed and "=== RECIPE" in user:
+        return "\n\n".join(_PACK_MARKER.format(n=i) + "\n" + canned_recipe(t, bariatric)
+                           for i, t in enumerate(packed, 1))
+    t = _RECIPE_TITLE_RE.search(user)
+    title = t.group(1) if t else "Recipe"
+    if schema.get("name") == "recipe_pair":
+        return json.dumps({"standard": _json_card(title, False, cfg), "bariatric": _json_card(title, True, cfg)},
+                          ensure_ascii=False)
+    if not response_format and _PAIR_MARKERS[1] in user:
+        return "\n\n".join(m + "\n" + canned_recipe(title, b) for m, b in zip(_PAIR_MARKERS, (False, True)))
+    if not response_format:
+        return canned_recipe(title, bariatric)
+    return json.dumps(_json_card(title, bariatric, cfg, (schema.get("schema") or {}).get("properties")),
+                      ensure_ascii=False)
+
+
+def _json_card(title: str, bariatric: bool, cfg: MockConfig, wanted: Optional[Dict] = None) -> Dict:
+    card = canned_recipe_json(title, bariatric)
+    if wanted:
+        card = {k: v for k, v in card.items() if k in wanted}  # repair requests ask for a subset
+    if card.get("ingredients") and cfg.rng.random() < cfg.invalid_rate:
+        card["ingredients"] = []
+    return card
+
+
+def _chunks(text: str, size: int = 16) -> List[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+# ================= server =================
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+    server: "MockServer"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _send_json(self, status: int, body: dict, headers: Optional[Dict[str, str]] = None) -> None:
+        blob = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(blob)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(blob)
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _injected_error(self) -> bool:
+        cfg = self.server.config
+        roll = cfg.rng.random()
+        if roll < cfg.rate_limit_rate:
+            self.server.count("rate_limited")
+            self._send_json(429, {"error": {"message": "Rate limit reached (mock)", "type": "requests"}},
+                            {"retry-after-ms": str(cfg.retry_after_ms)})
+            return True
+        if roll < cfg.rate_limit_rate + cfg.error_rate:
+            self.server.count("errors")
+            self._send_json(500, {"error": {"message": "The server had an error (mock)", "type": "server_error"}})
+            return True
+        return False
+
+    def do_GET(self) -> None:
+        if self.path.startswith("/images/"):
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(_PNG)))
+            self.end_headers()
+            self.wfile.write(_PNG)
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._send_json(400, {"error": {"message": "invalid JSON body"}})
+        cfg = self.server.config
+        time.sleep(cfg.latency + cfg.rng.random() * cfg.jitter)
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path.endswith("/chat/completions"):
+            self.server.count("chat")
+            if not self._injected_error():
+                self._chat(body)
+        elif path.endswith("/images/generations"):
+            self.server.count("images")
+            if not self._injected_error():
+                slug = re.sub(r"[^a-z0-9]+", "-", str(body.get("prompt", "")).lower()).strip("-")[:60]
+                self._send_json(200, {"created": int(time.time()),
+                                      "data": [{"url": f"{self.server.root_url}/images/{slug or 'image'}.png"}]})
+        else:
+            self._send_json(404, {"error": {"message": f"unknown endpoint {self.path}"}})
+
+    def _chat(self, body: dict) -> None:
+        cfg = self.server.config
+        text = reply_for(body.get("messages") or [], cfg, body.get("response_format"))
+        limit = min(cfg.max_output_tokens, int(body.get("max_completion_tokens") or body.get("max_tokens") or 1 << 30))
+        finish = "stop"
+        if len(text) // 4 > limit:
+            text, finish = text[:limit * 4], "length"
+        model = body.get("model", "mock")
+        rid, created = f"chatcmpl-mock-{self.server.count('ids')}", int(time.time())
+        # The schema is part of the prompt, ahead of the messages.
+        prompt = json.dumps(body.get("response_format") or "") + "".join(
+            str(m.get("content", "")) for m in body.get("messages") or [])
+        prompt_tokens = len(prompt) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(text) // 4,
+                 "total_tokens": prompt_tokens + len(text) // 4,
+                 "prompt_tokens_details": {"cached_tokens": self.server.cached_tokens(prompt)}}
+        if not body.get("stream"):
+            time.sleep(cfg.token_delay * len(_chunks(text)))
+            return self._send_json(200, {
+                "id": rid, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": finish}],
+                "usage": usage,
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        base = {"id": rid, "object": "chat.completion.chunk", "created": created, "model": model}
+        for piece in [None] + _chunks(text) + [""]:
+            delta = {"role": "assistant", "content": ""} if piece is None else ({"content": piece} if piece else {})
+            choice = {"index": 0, "delta": delta, "finish_reason": finish if piece == "" else None}
+            self._write_chunk(b"data: " + json.dumps(dict(base, choices=[choice])).encode("utf-8") + b"\n\n")
+            if piece:
+                time.sleep(cfg.token_delay)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self._write_chunk(b"data: " + json.dumps(dict(base, choices=[], usage=usage)).encode("utf-8") + b"\n\n")
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, config: Optional[MockConfig] = None):
+        super().__init__((host, port), _Handler)
+        self.config = config or MockConfig()
+        self.counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._prefixes: set = set()  # hashes of prompt prefixes, one per _CACHE_BLOCK boundary
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def root_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def base_url(self) -> str:
+        return self.root_url + "/v1"
+
+    def handle_error(self, request, client_address) -> None:
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)  # clients closing a stream early is normal
+
+    def count(self, name: str) -> int:
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+            return self.counts[name]
+
+    def cached_tokens(self, prompt: str) -> int:
+        """Leading tokens of ``prompt`` a prefix cache would serve, and remember its prefixes."""
+        if len(prompt) // 4 < self.config.prompt_cache_min:
+            return 0
+        step = _CACHE_BLOCK * 4
+        hashes = [hash(prompt[:end]) for end in range(step, len(prompt) + 1, step)]
+        with self._lock:
+            hits = 0
+            while hits < len(hashes) and hashes[hits] in self._prefixes:
+                hits += 1
+            if len(self._prefixes) > 100_000:
+                self._prefixes.clear()
+            self._prefixes.update(hashes)
+        cached = hits * _CACHE_BLOCK
+        return cached if cached >= self.config.prompt_cache_min else 0
+
+    def start(self) -> "MockServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+_server: Optional[MockServer] = None
+_server_lock = threading.Lock()
+
+
+def ensure_server() -> MockServer:
+    """The process-wide in-process mock server, started on first use."""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = MockServer().start()
+        return _server
+
+
+# ================= run =================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local OpenAI-compatible mock server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--latency", type=float, default=MOCK_LATENCY)
+    parser.add_argument("--jitter", type=float, default=MOCK_JITTER)
+    parser.add_argument("--token-delay", type=float, default=MOCK_TOKEN_DELAY)
+    parser.add_argument("--error-rate", type=float, default=MOCK_ERROR_RATE)
+    parser.add_argument("--rate-limit-rate", type=float, default=MOCK_RATE_LIMIT_RATE)
+    args = parser.parse_args()
+
+    cfg = MockConfig(latency=args.latency, jitter=args.jitter, token_delay=args.token_delay,
+                     error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate)
+    server = MockServer(args.host, args.port, cfg)
+    print(f"🧪 Mock OpenAI API on {server.base_url} (set OPENAI_BASE_URL to use it)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
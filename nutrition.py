@@ -0,0 +1,369 @@
+# nutrition.py
+"""Local nutrition facts from ingredient lists, with no API calls.
+
+Each ingredient ("1 1/2 cups sliced peaches", "1 (14 oz) can black beans",
+"salt to taste") is parsed into a quantity and unit, converted to grams and
+matched to a food in the bundled nutrients.csv (values per 100 g) through an
+alias index. Whole databanks are estimated at once: unique ingredient strings
+are parsed once, and the per-recipe totals are numpy sums over the exploded
+items, divided by the recipe's servings.
+"""
+import os, re, time, argparse, threading
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+
+import recipe_schema
+
+# ==============================
+# CONFIG
+# ==============================
+NUTRIENT_TABLE = os.environ.get("NUTRIENT_TABLE", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                               "nutrients.csv"))
+# Estimates replace the model's numbers only when at least this share of ingredients matched a food.
+MIN_COVERAGE = float(os.environ.get("NUTRITION_MIN_COVERAGE", 0.6))
+
+MACRO_KEYS = [key for key, _, _ in recipe_schema.NUTRITION_FIELDS]
+# (key, label, unit) of the micros line.
+MICRO_FIELDS = [
+    ("cholesterol_mg", "Cholesterol", " mg"), ("potassium_mg", "Potassium", " mg"), ("calcium_mg", "Calcium", " mg"),
+    ("iron_mg", "Iron", " mg"), ("vitamin_c_mg", "Vitamin C", " mg"),
+]
+NUTRIENT_KEYS = MACRO_KEYS + [key for key, _, _ in MICRO_FIELDS]
+
+# ==============================
+# UNITS
+# ==============================
+_MASS_G = {"g": 1.0, "gram": 1.0, "kg": 1000.0, "kilogram": 1000.0, "oz": 28.35, "ounce": 28.35,
+           "lb": 453.6, "pound": 453.6, "pinch": 0.35, "dash": 0.6, "smidgen": 0.2}
+_VOLUME_ML = {"tsp": 4.93, "teaspoon": 4.93, "tbsp": 14.79, "tablespoon": 14.79, "tbs": 14.79,
+              "cup": 236.6, "c": 236.6, "fl oz": 29.57, "fluid ounce": 29.57, "pint": 473.2, "pt": 473.2,
+              "quart": 946.4, "qt": 946.4, "ml": 1.0, "milliliter": 1.0, "l": 1000.0, "liter": 1000.0,
+              "gallon": 3785.4}
+# Package units with a typical weight; the food's own unit weight is used for the None entries.
+_PACKAGE_G = {"can": 425.0, "stick": 113.0, "scoop": 30.0, "bunch": 100.0, "sprig": 1.0, "handful": 30.0,
+              "package": 227.0, "pkg": 227.0, "jar": 340.0, "bag": 340.0, "container": 170.0, "bottle": 355.0,
+              "clove": None, "slice": None, "piece": None, "fillet": None, "head": None, "ear": None,
+              "stalk": None, "whole": None}
+_SIZE = {"small": 0.75, "medium": 1.0, "large": 1.25, "jumbo": 1.5}
+_CUP_ML = _VOLUME_ML["cup"]
+
+_UNICODE_FRACTIONS = {"½": " 1/2", "⅓": " 1/3", "⅔": " 2/3", "¼": " 1/4", "¾": " 3/4", "⅕": " 1/5",
+                      "⅛": " 1/8", "⅜": " 3/8", "⅝": " 5/8", "⅞": " 7/8", "⁄": "/"}
+_NUM = r"\d+\s+\d+/\d+|\d+/\d+|\d*\.\d+|\d+"
+_QTY_RE = re.compile(rf"^(?:about|approx\.?|approximately|roughly)?\s*({_NUM})(?:\s*(?:-|–|to)\s*({_NUM}))?\s*")
+_UNIT_RE = re.compile(r"^(fl\.?\s*oz|fluid ounces?|[a-z]+)\.?\s+(?:of\s+)?")
+_PAREN_RE = re.compile(rf"\(\s*({_NUM})\s*(-?\s*[a-z. ]+?)\s*\)")
+_WORD_RE = re.compile(r"[a-z]+")
+_MAX_NGRAM = 4
+
+
+# ==============================
+# TABLE
+# ==============================
+def _singular(word: str) -> str:
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and re.search(r"(?:ch|sh|x|ss|o)es$", word):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us")):
+        return word[:-1]
+    return word
+
+
+def _words(text: str) -> List[str]:
+    return [_singular(w) for w in _WORD_RE.findall(text.lower())]
+
+
+class NutrientTable:
+    """Foods from nutrients.csv: a (foods x nutrients) matrix per 100 g plus an alias index."""
+
+    def __init__(self, path: str = NUTRIENT_TABLE):
+        df = pd.read_csv(path, keep_default_na=False, na_values={c: [""] for c in NUTRIENT_KEYS +
+                                                                   ["g_per_cup", "g_per_unit", "default_g"]})
+        self.path = path
+        self.names: List[str] = df["name"].tolist()
+        self.matrix = df[NUTRIENT_KEYS].fillna(0.0).to_numpy(dtype=float)
+        self.g_per_cup = df["g_per_cup"].to_numpy(dtype=float)
+        self.g_per_unit = df["g_per_unit"].to_numpy(dtype=float)
+        self.default_g = df["default_g"].fillna(0.0).to_numpy(dtype=float)
+        self.additive: List[str] = df["additive"].tolist()
+        self.index: Dict[Tuple[str, ...], int] = {}
+        for i, (name, aliases) in enumerate(zip(df["name"], df["aliases"])):
+            for alias in [name] + [a for a in aliases.split("|") if a]:
+                self.index.setdefault(tuple(_words(alias)), i)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def lookup(self, words: Sequence[str]) -> int:
+        """Index of the food named by the longest alias in ``words`` (rightmost on ties), or -1."""
+        for n in range(min(_MAX_NGRAM, len(words)), 0, -1):
+            for start in range(len(words) - n, -1, -1):
+                hit = self.index.get(tuple(words[start:start + n]))
+                if hit is not None:
+                    return hit
+        return -1
+
+
+_default_table: Optional[NutrientTable] = None
+_default_lock = threading.Lock()
+
+
+def get_table() -> NutrientTable:
+    global _default_table
+    with _default_lock:
+        if _default_table is None:
+            _default_table = NutrientTable()
+        return _default_table
+
+
+# ==============================
+# PARSING
+# ==============================
+def _number(text: str) -> float:
+    total = 0.0
+    for part in text.split():
+        if "/" in part:
+            num, den = part.split("/", 1)
+            total += float(num) / float(den) if float(den) else 0.0
+        else:
+            total += float(part)
+    return total
+
+
+def _unit(word: str) -> Optional[str]:
+    word = re.sub(r"\s+", " ", word.replace(".", "")).strip()
+    if word in _MASS_G or word in _VOLUME_ML or word in _PACKAGE_G:
+        return word
+    single = _singular(word)
+    if single in _MASS_G or single in _VOLUME_ML or single in _PACKAGE_G:
+        return single
+    return "fl oz" if word in ("floz", "fl oz", "fluid ounce", "fluid ounces") else None
+
+
+def _grams(qty: float, unit: Optional[str], food: int, size: float, table: NutrientTable) -> float:
+    if unit in _MASS_G:
+        return qty * _MASS_G[unit]
+    if unit in _VOLUME_ML:
+        per_cup = table.g_per_cup[food]
+        return qty * _VOLUME_ML[unit] * (per_cup / _CUP_ML if per_cup == per_cup else 1.0)
+    if unit is not None and _PACKAGE_G[unit] is not None:
+        return qty * _PACKAGE_G[unit]
+    per_unit = table.g_per_unit[food]
+    return qty * size * (per_unit if per_unit == per_unit else table.default_g[food])
+
+
+@lru_cache(maxsize=65536)
+def parse_ingredient(item: str) -> Tuple[int, float]:
+    """(food index or -1, grams) for one ingredient line of a recipe."""
+    table = get_table()
+    text = str(item).lower().strip().lstrip("•-*· ").strip()
+    for ch, repl in _UNICODE_FRACTIONS.items():
+        text = text.replace(ch, repl)
+    text = text.strip()
+
+    qty, unit, pack = None, None, None
+    m = _QTY_RE.match(text)
+    if m:
+        qty = _number(m.group(1))
+        if m.group(2):
+            qty = (qty + _number(m.group(2))) / 2.0
+        text = text[m.end():]
+    # "1 (14 oz) can beans": the parenthetical is the weight of each unit
+    p = _PAREN_RE.search(text)
+    if p and _unit(p.group(2).lstrip("- ")) in (*_MASS_G, *_VOLUME_ML):
+        pack = (_number(p.group(1)), _unit(p.group(2).lstrip("- ")))
+    text = re.sub(r"\([^)]*\)", " ", text).strip()
+    if qty is not None:
+        u = _UNIT_RE.match(text)
+        if u and _unit(u.group(1)):
+            unit = _unit(u.group(1))
+            text = text[u.end():]
+
+    words = _words(text.split(",")[0]) or _words(text)
+    food = table.lookup(words)
+    if food < 0 and "," in text:
+        food = table.lookup(_words(text))
+    if food < 0:
+        return -1, 0.0
+    if qty is None:
+        return food, float(table.default_g[food])
+    if pack is not None:
+        qty *= pack[0]
+        unit = pack[1]
+    size = next((_SIZE[w] for w in words if w in _SIZE), 1.0)
+    return food, float(_grams(qty, unit, food, size, table))
+
+
+def split_ingredients(ingredients: Any) -> List[str]:
+    """Items of a ``;``-separated Ingredients cell, or of a list of ingredient bullets."""
+    if isinstance(ingredients, (list, tuple)):
+        return [str(i).strip() for i in ingredients if str(i).strip()]
+    return [i.strip() for i in str(ingredients).split(";") if i.strip()]
+
+
+def parse_servings(value: Any) -> float:
+    m = re.search(r"\d+(?:\.\d+)?", str(value))
+    return max(1.0, float(m.group(0))) if m else 1.0
+
+
+# ==============================
+# ROUNDING / FORMATTING
+# ==============================
+def _round(values: np.ndarray, keys: Sequence[str]) -> np.ndarray:
+    """Label rounding in the style of US nutrition facts panels, column by column."""
+    out = np.empty_like(values)
+    for j, key in enumerate(keys):
+        v = values[:, j]
+        if key == "calories":
+            out[:, j] = np.where(v < 5, 0, np.where(v <= 50, np.round(v / 5) * 5, np.round(v / 10) * 10))
+        elif key == "sodium_mg":
+            out[:, j] = np.where(v < 5, 0, np.where(v <= 140, np.round(v / 5) * 5, np.round(v / 10) * 10))
+        elif key == "iron_mg":
+            out[:, j] = np.round(v, 1)
+        elif key.endswith("_mg"):
+            out[:, j] = np.round(v)
+        else:
+            out[:, j] = np.where(v < 0.5, 0, np.where(v < 5, np.round(v * 2) / 2, np.round(v)))
+    return out
+
+
+def micros_line(values: Dict[str, float]) -> str:
+    return " | ".join(f"{label} {recipe_schema._fmt(values[key])}{unit}" for key, label, unit in MICRO_FIELDS)
+
+
+# ==============================
+# ESTIMATION
+# ==============================
+def _empty_frame(index) -> pd.DataFrame:
+    out = pd.DataFrame(0.0, index=index, columns=NUTRIENT_KEYS)
+    out["items"] = 0
+    out["matched"] = 0
+    out["coverage"] = 0.0
+    out["additives"] = ""
+    return out
+
+
+def estimate_frame(df: pd.DataFrame, bariatric: bool = False) -> pd.DataFrame:
+    """Per-serving nutrition for every row of a DataFrame with Ingredients (and Servings) columns.
+
+    Returns one row per input row: rounded nutrient columns, item/matched counts,
+    ``coverage`` (matched share of items) and the ``macros``, ``micros`` and
+    ``additives`` card lines.
+    """
+    table = get_table()
+    df = df.reset_index(drop=True)
+    out = _empty_frame(df.index)
+    items = df["Ingredients"].fillna("").astype(str).str.split(";").explode().str.strip()
+    items = items[items.str.len() > 0]
+    if len(items):
+        codes, uniques = pd.factorize(items)
+        parsed = np.array([parse_ingredient(u) for u in uniques], dtype=float).reshape(-1, 2)
+        food = parsed[codes, 0].astype(int)
+        grams = parsed[codes, 1]
+        row = items.index.to_numpy()
+        hit = food >= 0
+        contrib = table.matrix[np.where(hit, food, 0)] * (np.where(hit, grams, 0.0) / 100.0)[:, None]
+        totals = np.column_stack([np.bincount(row, weights=contrib[:, j], minlength=len(df))
+                                  for j in range(len(NUTRIENT_KEYS))])
+        servings = df["Servings"].map(parse_servings).to_numpy(dtype=float) if "Servings" in df else 1.0
+        per_serving = totals / np.reshape(servings, (-1, 1))
+        out[NUTRIENT_KEYS] = _round(per_serving, NUTRIENT_KEYS)
+        out["items"] = np.bincount(row, minlength=len(df))
+        out["matched"] = np.bincount(row, weights=hit, minlength=len(df)).astype(int)
+        out["coverage"] = out["matched"] / out["items"].clip(lower=1)
+
+        labelled = {}
+        for r, f, name in zip(row[hit], food[hit], items.to_numpy()[hit]):
+            label = table.additive[f]
+            if label:
+                labelled.setdefault(r, {}).setdefault(label, []).append(table.names[f])
+        out.loc[list(labelled), "additives"] = [
+            " | ".join(f"{label.capitalize()} ({', '.join(dict.fromkeys(names))})" for label, names in groups.items())
+            for groups in labelled.values()]
+
+    values = out[NUTRIENT_KEYS].to_dict("records")
+    out["macros"] = [recipe_schema.nutrition_line(v, bariatric) for v in values]
+    out["micros"] = [micros_line(v) for v in values]
+    return out
+
+
+def estimate(ingredients: Any, servings: Any = 1, bariatric: bool = False) -> Dict[str, Any]:
+    """``estimate_frame`` for one recipe; ``ingredients`` is a ``;``-separated string or a list."""
+    frame = pd.DataFrame({"Ingredients": ["; ".join(split_ingredients(ingredients))], "Servings": [servings]})
+    return estimate_frame(frame, bariatric).iloc[0].to_dict()
+
+
+def fill_card(recipe: Dict[str, Any]) -> Dict[str, Any]:
+    """Replace a structured card's ``nutrition`` with the local estimate when enough ingredients matched."""
+    facts = estimate(recipe.get("ingredients", []), recipe.get("yields", 1))
+    if facts["items"] and facts["coverage"] >= MIN_COVERAGE:
+        recipe["nutrition"] = {key: facts[key] for key in MACRO_KEYS}
+    return recipe
+
+
+_MD_SECTION_RE = re.compile(r"^\*\*([^*]+):\*\*\s*(.*)$")
+
+
+def fill_markdown(md: str, bariatric: bool = False) -> str:
+    """Rewrite the line after **Nutritional Facts per Serving:** of a markdown card from its ingredient bullets."""
+    if not md or "Nutritional Facts per Serving" not in md:
+        return md
+    lines = md.split("\n")
+    section, ingredients, servings, target, inline = None, [], 1, None, False
+    for i, line in enumerate(lines):
+        m = _MD_SECTION_RE.match(line.strip())
+        if m:
+            section = m.group(1).strip().lower()
+            if section == "yields":
+                servings = m.group(2)
+            elif section == "nutritional facts per serving":
+                inline = bool(m.group(2))
+                target = i if inline else i + 1
+            continue
+        if section == "ingredients" and line.strip().startswith(("•", "-", "*")):
+            ingredients.append(line.strip())
+    if target is None or target >= len(lines) or not ingredients:
+        return md
+    facts = estimate(ingredients, servings, bariatric)
+    if facts["coverage"] < MIN_COVERAGE:
+        return md
+    if inline:
+        lines[target] = "**Nutritional Facts per Serving:** " + facts["macros"]
+    else:
+        lines[target] = facts["macros"]
+    return "\n".join(lines)
+
+
+# ==============================
+# RUN
+# ==============================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate nutrition facts for a recipe databank.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_est = sub.add_parser("estimate", help="print the per-serving estimate for every row")
+    p_est.add_argument("--unmatched", action="store_true", help="list ingredients that matched no food")
+    p_bench = sub.add_parser("bench", help="time the estimator on the databank repeated to --rows rows")
+    p_bench.add_argument("--rows", type=int, default=10000)
+    for p in (p_est, p_bench):
+        p.add_argument("--input", default="master_recipes.csv")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.input)
+    if args.cmd == "estimate":
+        out = estimate_frame(df)
+        out.insert(0, "Title", df["Title"].to_numpy())
+        print(out[["Title", "coverage", "macros"]].to_string(index=False))
+        if args.unmatched:
+            items = df["Ingredients"].fillna("").astype(str).str.split(";").explode().str.strip()
+            for item in sorted({i for i in items if i and parse_ingredient(i)[0] < 0}):
+                print(f"   ✗ {item}")
+    else:
+        big = pd.concat([df] * max(1, -(-args.rows // max(len(df), 1))), ignore_index=True).head(args.rows)
+        parse_ingredient.cache_clear()
+        start = time.perf_counter()
+        estimate_frame(big)
+        secs = time.perf_counter() - start
+        print(f"⏱️ {len(big)} rows in {secs:.2f}s ({secs / max(len(big), 1) * 1e6:.1f} µs/row)")
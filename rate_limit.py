@@ -0,0 +1,217 @@
+# rate_limit.py
+import os, re, time, threading
+from typing import Optional
+
+# ================= config =================
+OPENAI_RPM = float(os.environ.get("OPENAI_RPM", 500))             # chat requests per minute
+OPENAI_TPM = float(os.environ.get("OPENAI_TPM", 200000))          # chat tokens per minute
+OPENAI_IMAGE_RPM = float(os.environ.get("OPENAI_IMAGE_RPM", 50))  # image requests per minute
+BREAKER_THRESHOLD = int(os.environ.get("BREAKER_THRESHOLD", 5))   # consecutive outage-class failures
+BREAKER_COOLDOWN = float(os.environ.get("BREAKER_COOLDOWN", 30))  # seconds before a trial call
+MAX_RETRY_AFTER = float(os.environ.get("MAX_RETRY_AFTER", 60))    # cap on server-requested waits
+
+RETRYABLE = {"rate_limit", "server", "connection", "timeout", "unknown"}
+OUTAGE = {"server", "connection", "timeout"}  # failures that count toward the breaker
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+# ================= error classification =================
+def classify_error(exc: BaseException) -> str:
+    """Map an OpenAI SDK (or httpx) exception to rate_limit/server/connection/timeout/client/unknown."""
+    if isinstance(exc, CircuitOpenError):
+        return "circuit_open"
+    name = type(exc).__name__
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    if status == 429 or name == "RateLimitError":
+        return "rate_limit"
+    if isinstance(status, int) and status >= 500:
+        return "server"
+    if "Timeout" in name:
+        return "timeout"
+    if "Connection" in name or isinstance(exc, ConnectionError):
+        return "connection"
+    if isinstance(status, int) and 400 <= status < 500:
+        return "client"  # bad request, auth, not found: retrying will not help
+    return "unknown"
+
+
+def _duration_seconds(value: str) -> Optional[float]:
+    """Parse '1.5', '250ms', '6m0s' or '1h2m3.5s' style durations."""
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r"([\d.]+)\s*(ms|h|m|s)", value)
+    if not parts:
+        return None
+    scale = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+    return sum(float(n) * scale[u] for n, u in parts)
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """Server wait hint from retry-after-ms, retry-after or x-ratelimit-reset-* headers."""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    for name in ("retry-after-ms", "retry-after", "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        raw = headers.get(name)
+        if raw is None:
+            continue
+        secs = _duration_seconds(raw)
+        if secs is None:
+            continue
+        if name == "retry-after-ms":
+            secs /= 1000.0
+        return min(max(secs, 0.0), MAX_RETRY_AFTER)
+    return None
+
+
+# ================= token bucket =================
+class TokenBucket:
+    """Thread-safe token bucket. ``reserve`` debits immediately and returns how long to wait."""
+
+    def __init__(self, per_minute: float, burst: Optional[float] = None):
+        self.rate = max(per_minute, 1.0) / 60.0
+        self.capacity = burst if burst is not None else max(per_minute / 6.0, 1.0)  # ~10s of quota
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float = 1.0, not_before: float = 0.0) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.level -= min(amount, self.capacity)
+            wait = -self.level / self.rate if self.level < 0 else 0.0
+            return max(wait, not_before - now)
+
+
+class AdaptiveRateLimiter:
+    """Request and token buckets sized to the account quota.
+
+    A 429 pauses every caller for the server's Retry-After and cuts the effective
+    rate (multiplicative decrease); successes restore it gradually.
+    """
+
+    def __init__(self, rpm: float, tpm: Optional[float] = None, floor: float = 0.1):
+        self.rpm, self.tpm, self.floor = rpm, tpm, floor
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.factor = 1.0
+        self.paused_until = 0.0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def _set_factor(self, factor: float) -> None:
+        self.factor = min(1.0, max(self.floor, factor))
+        self.requests.rate = self.rpm * self.factor / 60.0
+        if self.tokens:
+            self.tokens.rate = self.tpm * self.factor / 60.0
+
+    def reserve(self, tokens: float = 0.0) -> float:
+        """Seconds the caller should wait before sending a request of ~``tokens`` tokens."""
+        wait = self.requests.reserve(1.0, not_before=self.paused_until)
+        if self.tokens and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        return wait
+
+    def on_success(self) -> None:
+        if self.factor < 1.0:
+            with self._lock:
+                self._set_factor(self.factor + 0.02)
+
+    def on_rate_limited(self, retry_after: Optional[float]) -> float:
+        with self._lock:
+            self.throttled += 1
+            self._set_factor(self.factor * 0.7)
+            pause = retry_after if retry_after is not None else 1.0 / self.requests.rate
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+            return pause
+
+    def snapshot(self) -> dict:
+        return {"rpm": round(self.rpm * self.factor, 1), "factor": round(self.factor, 3),
+                "throttled": self.throttled, "paused_for": max(0.0, round(self.paused_until - time.monotonic(), 2))}
+
+
+# ================= circuit breaker =================
+class CircuitBreaker:
+    """Opens after ``threshold`` consecutive outage-class failures; fails fast until ``cooldown`` passes."""
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def check(self) -> bool:
+        """Raise CircuitOpenError while open; True when the caller is the half-open trial call."""
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            if time.monotonic() - self.opened_at < self.cooldown or self.trial_in_flight:
+                raise CircuitOpenError("OpenAI API looks unavailable; failing fast until it recovers")
+            self.trial_in_flight = True  # half-open: let one call through
+            return True
+
+    def release(self) -> None:
+        """End a trial without an outcome (it was cancelled), so the next call can try instead."""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record(self, kind: Optional[str]) -> None:
+        with self._lock:
+            self.trial_in_flight = False
+            if kind is None or kind not in OUTAGE:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+
+# ================= retry policy =================
+def estimate_tokens(*texts: str, completion: int = 0) -> int:
+    """Rough prompt + completion size for TPM accounting (~4 characters per token)."""
+    return sum(len(t or "") for t in texts) // 4 + completion
+
+
+def next_delay(exc: BaseException, attempt: int, base: float, jitter: float,
+               limiter: Optional[AdaptiveRateLimiter]) -> Optional[float]:
+    """Delay before retrying after ``exc``, or None if the error should not be retried."""
+    kind = classify_error(exc)
+    if kind not in RETRYABLE:
+        return None
+    hint = retry_after_seconds(exc)
+    if kind == "rate_limit" and limiter is not None:
+        return limiter.on_rate_limited(hint) + jitter
+    if hint is not None:
+        return hint + jitter
+    return base * (2 ** attempt) + jitter
+
+
+chat_limiter = AdaptiveRateLimiter(OPENAI_RPM, OPENAI_TPM)
+image_limiter = AdaptiveRateLimiter(OPENAI_IMAGE_RPM)
+breaker = CircuitBreaker()
+
+
+def snapshot() -> dict:
+    return {"chat": chat_limiter.snapshot(), "image": image_limiter.snapshot(), "breaker": breaker.state}
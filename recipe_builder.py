@@ -1,7 +1,15 @@
-import os, re
+import os, re, io, csv, json, time, hashlib, argparse
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 import pandas as pd
-from docxtpl import DocxTemplate
+from docx.shared import Mm
+from docxtpl import DocxTemplate, InlineImage
+
+import image_store
+import layout_estimator
+import metrics
+import nutrition
 
 # ==============================
 # CONFIG
@@ -11,9 +19,29 @@ TEMPLATE_FILE = "recipe_template.docx"   # Word template with {{placeholders}}
 OUTPUT_DIR = Path("recipes_docx")
 OUTPUT_DIR.mkdir(exist_ok=True)
 OUTPUT_CANVA = "recipes_canva.csv"
+MANIFEST_FILE = OUTPUT_DIR / ".build_manifest.json"   # per-card content hashes for incremental rebuilds
+SUMMARY_FILE = OUTPUT_DIR / "build_summary.json"       # counts and per-stage timings of the last build
+STAGE_METRIC = "recipe_build_stage_seconds"
+
+# Overflow and page count come from layout_estimator, which models the
+# template's text boxes (font metrics, wrapping, one line per ingredient).
+# Nutrition lines come from nutrition (bundled nutrient table, no API calls);
+# rows it cannot cover fall back to their Nutrition column, if any.
+
+# Parallel rendering: one process per core by default
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# Streaming mode: rows read from the databank per chunk
+DEFAULT_CHUNKSIZE = 500
+
+# Photos: rows without a Photo use the stored print-resolution image for their
+# title (see image_store); existing image files are embedded at this width.
+PHOTO_WIDTH_MM = 80
 
-# Threshold for when to trigger overflow
-OVERFLOW_THRESHOLD = 1800  # total characters of ingredients + directions
+CANVA_COLUMNS = [
+    "Title", "Servings", "PrepTime", "CookTime", "ServingSize", "Ingredients_P1", "Directions_P1",
+    "Nutrition_Macros", "Nutrition_Micros", "Nutrition_Additives", "Image", "Overflow",
+]
 
 
 # ==============================
@@ -23,87 +51,356 @@ def slugify(s):
     return re.sub(r"[^a-z0-9]+", "-", s.lower()).strip("-")
 
 
+def _csv_value(v):
+    # Match DataFrame.to_csv, which writes missing values as empty cells.
+    return "" if isinstance(v, float) and v != v else v
+
+
+def iter_records(df):
+    """Yield (row dict, layout estimate, nutrition facts) without building a Series per row (unlike iterrows)."""
+    cols = list(df.columns)
+    layouts = layout_estimator.estimate_frame(df).to_dict("records")
+    facts = nutrition.estimate_frame(df)[["coverage", "macros", "micros", "additives"]].to_dict("records")
+    for values, layout, fact in zip(df.itertuples(index=False, name=None), layouts, facts):
+        yield dict(zip(cols, values)), layout, fact
+
+
+def nutrition_lines(row, facts=None):
+    """(macros, micros, additives) card lines for a row, estimated unless too few ingredients matched."""
+    if facts is None:
+        facts = nutrition.estimate(row.get("Ingredients", ""), row.get("Servings", 1))
+    if facts["coverage"] >= nutrition.MIN_COVERAGE:
+        return facts["macros"], facts["micros"], facts["additives"]
+    return str(_csv_value(row.get("Nutrition", "")) or ""), "", ""
+
+
 def needs_overflow(ingredients: str, directions: str) -> bool:
     """Return True if recipe text is too long for one page."""
-    total_len = len(str(ingredients)) + len(str(directions))
-    return total_len > OVERFLOW_THRESHOLD
+    return layout_estimator.estimate(ingredients, directions)["overflow"]
+
+
+# ==============================
+# RENDER WORKERS
+# ==============================
+_template_bytes = None  # template file contents, loaded once per worker process
+
+
+def _init_worker(template_bytes: bytes):
+    global _template_bytes
+    _template_bytes = template_bytes
+
+
+def _render_card(fname: str, context: dict):
+    """Render one card from the in-memory template and save it. Returns (fname, render seconds, save seconds)."""
+    start = time.perf_counter()
+    doc = DocxTemplate(io.BytesIO(_template_bytes))
+    photo = context.get("photo")
+    if photo and os.path.isfile(photo):
+        context = dict(context, photo=InlineImage(doc, photo, width=Mm(PHOTO_WIDTH_MM)))
+    doc.render(context)
+    rendered = time.perf_counter()
+    doc.save(OUTPUT_DIR / fname)
+    return fname, rendered - start, time.perf_counter() - rendered
+
+
+def _render_chunk(chunk):
+    return [_render_card(fname, context) for fname, context in chunk]
 
 
 # ==============================
 # MAIN BUILDER
 # ==============================
-def build_outputs(df):
-    canva_rows = []
-
-    for i, (_, row) in enumerate(df.iterrows()):
-        title = str(row["Title"])
-        servings = row.get("Servings", "")
-        prep_time = row.get("PrepTime", "")
-        cook_time = row.get("CookTime", "")
-        serving_size = row.get("ServingSize", "")
-        ingredients = str(row["Ingredients"])
-        directions = str(row["Directions"])
-        photo_path = str(row.get("Photo", "")).strip()
-
-        print(f"⚙️ Building recipe card for: {title}")
-
-        # Determine if overflow is needed
-        overflow = needs_overflow(ingredients, directions)
-
-        # Context for Word template
-        context = {
-            "title": title,
-            "servings": servings,
-            "prep_time": prep_time,
-            "cook_time": cook_time,
-            "serving_size": serving_size,
-            "ingredients": ingredients,
-            "directions": directions,
-            "ingredients_overflow": ingredients if overflow else "",
-            "directions_overflow": directions if overflow else "",
-            "notes_page1": "",
-            "notes_page2": "",
-            "notes_page3": "",
-            "nutrition_macros": "Placeholder for Macros",
-            "nutrition_micros": "Placeholder for Micros",
-            "nutrition_additives": "Placeholder for Additives",
-            "photo": photo_path,
-            "overflow": "Yes" if overflow else "No",
-        }
-
-        # Load and render template
-        doc = DocxTemplate(TEMPLATE_FILE)
-        doc.render(context)
-
-        # Save Word doc
-        fname = f"{i+1:03d}-{slugify(title)}.docx"
-        doc.save(OUTPUT_DIR / fname)
-
-        # Add to Canva CSV
-        canva_rows.append({
-            "Title": title,
-            "Servings": servings,
-            "PrepTime": prep_time,
-            "CookTime": cook_time,
-            "ServingSize": serving_size,
-            "Ingredients_P1": ingredients,
-            "Directions_P1": directions,
-            "Nutrition_Macros": "Placeholder for Macros",
-            "Nutrition_Micros": "Placeholder for Micros",
-            "Nutrition_Additives": "Placeholder for Additives",
-            "Image": photo_path,
-            "Overflow": "Yes" if overflow else "No"
-        })
-
-    # Export Canva CSV
-    pd.DataFrame(canva_rows).to_csv(OUTPUT_CANVA, index=False)
+def build_card(i, row, layout=None, facts=None):
+    """Return (docx filename, template context, Canva row) for the i-th recipe row.
+
+    ``layout`` and ``facts`` are the row's layout_estimator and nutrition results
+    when already computed for the chunk.
+    """
+    title = str(row["Title"])
+    servings = row.get("Servings", "")
+    prep_time = row.get("PrepTime", "")
+    cook_time = row.get("CookTime", "")
+    serving_size = row.get("ServingSize", "")
+    ingredients = str(row["Ingredients"])
+    directions = str(row["Directions"])
+    photo_path = str(_csv_value(row.get("Photo", ""))).strip() or image_store.photo_path(title)
+
+    # Determine if overflow is needed
+    if layout is None:
+        layout = layout_estimator.estimate(ingredients, directions)
+    overflow = bool(layout["overflow"])
+    macros, micros, additives = nutrition_lines(row, facts)
+
+    # Context for Word template
+    context = {
+        "title": title,
+        "servings": servings,
+        "prep_time": prep_time,
+        "cook_time": cook_time,
+        "serving_size": serving_size,
+        "ingredients": ingredients,
+        "directions": directions,
+        "ingredients_overflow": ingredients if overflow else "",
+        "directions_overflow": directions if overflow else "",
+        "notes_page1": "",
+        "notes_page2": "",
+        "notes_page3": "",
+        "nutrition_macros": macros,
+        "nutrition_micros": micros,
+        "nutrition_additives": additives,
+        "photo": photo_path,
+        "overflow": "Yes" if overflow else "No",
+        "pages": int(layout["pages"]),
+    }
+
+    canva_row = {
+        "Title": title,
+        "Servings": servings,
+        "PrepTime": prep_time,
+        "CookTime": cook_time,
+        "ServingSize": serving_size,
+        "Ingredients_P1": ingredients,
+        "Directions_P1": directions,
+        "Nutrition_Macros": macros,
+        "Nutrition_Micros": micros,
+        "Nutrition_Additives": additives,
+        "Image": photo_path,
+        "Overflow": "Yes" if overflow else "No"
+    }
+
+    fname = f"{i+1:03d}-{slugify(title)}.docx"
+    return fname, context, canva_row
+
+
+def _render_jobs(jobs, workers, pool, template_bytes, stats):
+    """Render one batch of (fname, context) jobs; returns summed per-card seconds.
+
+    Render and save times measured in the workers are recorded in ``stats``.
+    """
+    def _done(fname, render_secs, save_secs):
+        stats.observe(STAGE_METRIC, render_secs, stage="render")
+        stats.observe(STAGE_METRIC, save_secs, stage="save")
+        print(f"⚙️ Built {fname} in {(render_secs + save_secs) * 1000:.0f} ms")
+        return render_secs + save_secs
+
+    card_seconds = 0.0
+    if pool is None:
+        _init_worker(template_bytes)
+        for fname, context in jobs:
+            card_seconds += _done(*_render_card(fname, context))
+        return card_seconds
+
+    # Each file name is fixed up front, so cards can finish in any order.
+    # Jobs go out in chunks to keep inter-process overhead per card low.
+    size = max(1, len(jobs) // (workers * 4))
+    futures = [pool.submit(_render_chunk, jobs[k:k + size]) for k in range(0, len(jobs), size)]
+    for fut in as_completed(futures):
+        for result in fut.result():
+            card_seconds += _done(*result)
+    return card_seconds
+
+
+# ==============================
+# INCREMENTAL BUILD MANIFEST
+# ==============================
+def _hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _context_hash(context: dict) -> str:
+    return _hash_bytes(json.dumps(context, sort_keys=True, default=str).encode("utf-8"))
+
+
+def load_manifest():
+    """Return (template hash, {docx filename: content hash}) from the last build."""
+    try:
+        data = json.loads(MANIFEST_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None, {}
+    return data.get("template"), data.get("cards", {})
+
+
+def save_manifest(template_hash: str, cards: dict):
+    tmp = MANIFEST_FILE.with_suffix(".tmp")
+    tmp.write_text(json.dumps({"template": template_hash, "cards": cards}, indent=0), encoding="utf-8")
+    os.replace(tmp, MANIFEST_FILE)
+
+
+def plan_build(targets: dict, previous: dict):
+    """Work out what a rebuild has to do.
+
+    Returns (render, moves, stale): filenames that need rendering, (old, new)
+    renames for unchanged cards whose number shifted, and outputs to delete.
+    """
+    keep = {f for f, h in targets.items() if previous.get(f) == h and (OUTPUT_DIR / f).exists()}
+    spare = {}
+    for f, h in previous.items():
+        if f not in keep and (OUTPUT_DIR / f).exists():
+            spare.setdefault(h, []).append(f)
+
+    render, moves = set(), []
+    for f, h in targets.items():
+        if f in keep:
+            continue
+        if spare.get(h):
+            moves.append((spare[h].pop(), f))
+        else:
+            render.add(f)
+
+    moved_from = {src for src, _ in moves}
+    stale = [f for f in previous if f not in targets and f not in moved_from and (OUTPUT_DIR / f).exists()]
+    return render, moves, stale
+
+
+def _apply_moves(moves):
+    # Two steps, so a card can move onto a name another moved card is leaving.
+    for src, dst in moves:
+        os.replace(OUTPUT_DIR / src, OUTPUT_DIR / (dst + ".moving"))
+    for _, dst in moves:
+        os.replace(OUTPUT_DIR / (dst + ".moving"), OUTPUT_DIR / dst)
+
+
+# ==============================
+# BUILD
+# ==============================
+def _timed_chunks(chunks, stats):
+    """Iterate ``chunks``, recording the time spent reading each one as the "read" stage."""
+    it = iter(chunks)
+    while True:
+        with metrics.timed(STAGE_METRIC, registry=stats, stage="read"):
+            chunk = next(it, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def _records(chunk, stats):
+    """iter_records for a whole chunk, timed as the "estimate" stage (layout and nutrition)."""
+    with metrics.timed(STAGE_METRIC, registry=stats, stage="estimate"):
+        return list(iter_records(chunk))
+
+
+def write_summary(summary: dict, stats, path=None):
+    """Write the build counts and per-stage timings as JSON; returns the path."""
+    path = Path(path or SUMMARY_FILE)
+    summary = dict(summary, stages=stats.histogram_summary(STAGE_METRIC, "stage"))
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+    return path
+
+
+def build_outputs_streaming(read_chunks, workers=DEFAULT_WORKERS, incremental=True, summary_path=None):
+    """Build cards from DataFrame chunks; ``read_chunks()`` returns a fresh chunk iterator.
+
+    Only one chunk is held in memory at a time, and each chunk's Canva rows are
+    appended to OUTPUT_CANVA and flushed before the next chunk is read. With
+    ``incremental`` a first pass hashes every card against the build manifest so
+    only new or changed cards are rendered, renumbered ones are renamed, and
+    outputs for removed rows are deleted. Counts and stage timings go to
+    ``summary_path`` (SUMMARY_FILE by default) as JSON.
+    """
+    stats = metrics.Registry()
+    template_bytes = Path(TEMPLATE_FILE).read_bytes()
+    template_hash = _hash_bytes(template_bytes)
+    workers = max(1, int(workers or 1))
+    start = time.perf_counter()
+    card_seconds = 0.0
+    n = rendered = 0
+
+    # Pass 1: hash every card (cheap) and plan the rebuild.
+    targets = {}
+    for chunk in _timed_chunks(read_chunks(), stats):
+        records = _records(chunk, stats)
+        with metrics.timed(STAGE_METRIC, registry=stats, stage="hash"):
+            for row, layout, facts in records:
+                fname, context, _ = build_card(n, row, layout, facts)
+                targets[fname] = _context_hash(context)
+                n += 1
+    with metrics.timed(STAGE_METRIC, registry=stats, stage="plan"):
+        previous_template, previous = load_manifest()
+        if incremental and previous_template == template_hash:
+            render, moves, stale = plan_build(targets, previous)
+        else:
+            render, moves = set(targets), []
+            stale = [f for f in previous if f not in targets and (OUTPUT_DIR / f).exists()]
+        _apply_moves(moves)
+        for f in stale:
+            (OUTPUT_DIR / f).unlink()
+    unchanged = n - len(render) - len(moves)
+    print(f"🧮 {len(render)} to render, {len(moves)} renumbered, {unchanged} unchanged, {len(stale)} removed")
+
+    # Pass 2: render what changed and write the Canva CSV.
+    n = 0
+    done = {f: h for f, h in targets.items() if f not in render}
+    with ExitStack() as stack:
+        pool = None
+        if workers > 1 and len(render) > 1:
+            pool = stack.enter_context(ProcessPoolExecutor(
+                max_workers=min(workers, len(render)), initializer=_init_worker, initargs=(template_bytes,)))
+        out = stack.enter_context(open(OUTPUT_CANVA, "w", newline="", encoding="utf-8"))
+        writer = csv.DictWriter(out, fieldnames=CANVA_COLUMNS, lineterminator="\n")
+        writer.writeheader()
+
+        for chunk in _timed_chunks(read_chunks(), stats):
+            jobs, canva_rows = [], []
+            for row, layout, facts in _records(chunk, stats):
+                fname, context, canva_row = build_card(n, row, layout, facts)
+                if fname in render:
+                    jobs.append((fname, context))
+                canva_rows.append(canva_row)
+                n += 1
+            if jobs:
+                card_seconds += _render_jobs(jobs, workers, pool, template_bytes, stats)
+                rendered += len(jobs)
+                done.update((fname, targets[fname]) for fname, _ in jobs)
+                with metrics.timed(STAGE_METRIC, registry=stats, stage="manifest"):
+                    save_manifest(template_hash, done)
+
+            # Export Canva rows for this chunk
+            with metrics.timed(STAGE_METRIC, registry=stats, stage="csv"):
+                writer.writerows({k: _csv_value(v) for k, v in r.items()} for r in canva_rows)
+                out.flush()
+
+    save_manifest(template_hash, targets)
+    total = time.perf_counter() - start
+    if rendered:
+        print(f"📊 Rendered {rendered} of {n} cards with {workers} worker(s) in {total:.2f}s "
+              f"({rendered / total:.1f} cards/s, avg {card_seconds / rendered * 1000:.0f} ms/card)")
+    else:
+        print(f"📊 All {n} cards up to date ({total:.2f}s)")
+    path = write_summary({
+        "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "cards": n, "rendered": rendered,
+        "renumbered": len(moves), "unchanged": unchanged, "removed": len(stale), "workers": workers,
+        "incremental": bool(incremental), "wall_seconds": round(total, 3),
+        "cards_per_second": round(rendered / total, 2) if rendered and total else 0.0,
+    }, stats, summary_path)
+    print(f"🧾 Build summary written to {path}")
+
+
+def build_outputs(df, workers=DEFAULT_WORKERS, incremental=True, summary_path=None):
+    build_outputs_streaming(lambda: [df], workers=workers, incremental=incremental, summary_path=summary_path)
+
+
+def build_outputs_from_csv(path=INPUT_CSV, chunksize=DEFAULT_CHUNKSIZE, workers=DEFAULT_WORKERS, incremental=True,
+                           summary_path=None):
+    build_outputs_streaming(lambda: pd.read_csv(path, chunksize=chunksize), workers=workers, incremental=incremental,
+                            summary_path=summary_path)
 
 
 # ==============================
 # RUN
 # ==============================
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build recipe card DOCX files and the Canva CSV.")
+    parser.add_argument("--input", default=INPUT_CSV, help="recipe databank CSV")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="render processes (default: CPU count)")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="rows read per chunk")
+    parser.add_argument("--full", action="store_true", help="ignore the build manifest and re-render every card")
+    parser.add_argument("--summary", default=str(SUMMARY_FILE), help="JSON file for build counts and stage timings")
+    args = parser.parse_args()
+
     print("🚀 Recipe builder started...")
-    df = pd.read_csv(INPUT_CSV)
-    build_outputs(df)
+    build_outputs_from_csv(args.input, chunksize=args.chunksize, workers=args.workers, incremental=not args.full,
+                           summary_path=args.summary)
     print("✅ Finished building all recipe cards and Canva CSV.")
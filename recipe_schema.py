@@ -0,0 +1,354 @@
+# recipe_schema.py
+"""Structured recipe cards: JSON schema, validation and rendering.
+
+The model returns one JSON object per card. ``validate`` normalizes it and names
+the fields that still need fixing; markdown, plain text and databank rows are all
+rendered from the same parsed object, so no regex post-processing is needed.
+"""
+import re, json
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+SCHEMA_VERSION = 1  # part of the cache key; bump when fields change
+
+STAGES = ["Stage 1", "Stage 2", "Stage 3", "Stage 4"]
+
+# (key, label, unit) in the order the card prints them.
+NUTRITION_FIELDS = [
+    ("calories", "Calories", ""), ("protein_g", "Protein", " g"), ("total_fat_g", "Total Fat", " g"),
+    ("saturated_fat_g", "sat", " g"), ("trans_fat_g", "trans", " g"), ("carbohydrates_g", "Carbohydrates", " g"),
+    ("fiber_g", "Fiber", " g"), ("sugar_g", "Sugar", " g"), ("sodium_mg", "Sodium", " mg"),
+]
+
+TEXT_FIELDS = ["title", "summary", "yields", "prep_time", "cook_time", "serving_size"]
+LIST_FIELDS = ["ingredients", "directions", "storage"]
+BARIATRIC_FIELDS = ["bariatric_stages", "substitutions"]
+MIN_ITEMS = {"ingredients": 3, "directions": 1, "storage": 1, "substitutions": 1, "bariatric_stages": 1}
+
+
+def fields(bariatric: bool) -> List[str]:
+    return TEXT_FIELDS + LIST_FIELDS + (BARIATRIC_FIELDS if bariatric else []) + ["nutrition"]
+
+
+# ================= schema =================
+_DESCRIPTIONS = {
+    "summary": "A concise two sentence summary of the dish.",
+    "yields": "e.g. '4 servings'.",
+    "prep_time": "e.g. '10 minutes'.",
+    "cook_time": "e.g. '25 minutes'.",
+    "serving_size": "e.g. '1 serving ~6 oz | 1 cup'.",
+    "ingredients": "Every ingredient with its quantity, one per item, no bullets.",
+    "directions": "Short, clear steps in order.",
+    "storage": "Storage notes, e.g. 'Refrigerate up to 3 days.'",
+    "bariatric_stages": "Stages that suit the recipe's texture and ingredients.",
+    "substitutions": "Bariatric-friendly substitutions.",
+}
+
+
+def _property(name: str) -> Dict[str, Any]:
+    if name == "nutrition":
+        props = {key: {"type": "number"} for key, _, _ in NUTRITION_FIELDS}
+        return {"type": "object", "description": "Estimated nutrition per serving.", "properties": props,
+                "required": list(props), "additionalProperties": False}
+    if name == "bariatric_stages":
+        prop: Dict[str, Any] = {"type": "array", "items": {"type": "string", "enum": STAGES}}
+    elif name in LIST_FIELDS or name in BARIATRIC_FIELDS:
+        prop = {"type": "array", "items": {"type": "string"}}
+    else:
+        prop = {"type": "string"}
+    if name in _DESCRIPTIONS:
+        prop["description"] = _DESCRIPTIONS[name]
+    return prop
+
+
+def recipe_schema(bariatric: bool, only: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    """JSON schema for a card (or just the ``only`` fields, for repair requests)."""
+    names = [f for f in fields(bariatric) if only is None or f in only]
+    return {"type": "object", "properties": {n: _property(n) for n in names},
+            "required": names, "additionalProperties": False}
+
+
+def response_format(bariatric: bool, only: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    """``response_format`` argument for chat.completions.create (strict structured output)."""
+    name = ("bariatric_" if bariatric else "") + ("recipe_fix" if only else "recipe_card")
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True,
+                                                   "schema": recipe_schema(bariatric, only)}}
+
+
+def pack_response_format(bariatric: bool) -> Dict[str, Any]:
+    """``response_format`` for a packed request: ``{"recipes": [card, ...]}``, one card per title."""
+    schema = {"type": "object", "properties": {"recipes": {"type": "array", "items": recipe_schema(bariatric)}},
+              "required": ["recipes"], "additionalProperties": False}
+    name = ("bariatric_" if bariatric else "") + "recipe_pack"
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
+
+
+def pair_response_format() -> Dict[str, Any]:
+    """``response_format`` for both variants of one title: ``{"standard": card, "bariatric": card}``."""
+    schema = {"type": "object", "properties": {"standard": recipe_schema(False), "bariatric": recipe_schema(True)},
+              "required": ["standard", "bariatric"], "additionalProperties": False}
+    return {"type": "json_schema", "json_schema": {"name": "recipe_pair", "strict": True, "schema": schema}}
+
+# ================= parsing =================
+_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$")
+_NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+_BULLET_RE = re.compile(r"^\s*(?:[•\-*]|\d+[.)])\s*")
+
+
+def parse(text: str) -> Dict[str, Any]:
+    """Parse a complete response; raises ValueError when it is not a JSON object."""
+    data = json.loads(_FENCE_RE.sub("", text or ""))
+    if not isinstance(data, dict):
+        raise ValueError("recipe JSON is not an object")
+    return data
+
+
+def _close(text: str) -> str:
+    """Close the open strings, arrays and objects of a JSON prefix."""
+    stack: List[str] = []
+    in_str = esc = False
+    for ch in text:
+        if in_str:
+            if esc:
+                esc = False
+            elif ch == "\\":
+                esc = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+    if esc:
+        text = text[:-1]
+    return text + ('"' if in_str else "") + "".join(reversed(stack))
+
+
+def parse_partial(text: str) -> Dict[str, Any]:
+    """Best-effort parse of a streamed JSON prefix; returns whatever fields are readable so far."""
+    text = _FENCE_RE.sub("", text or "")
+    start = text.find("{")
+    if start < 0:
+        return {}
+    text = text[start:]
+    for _ in range(8):
+        try:
+            data = json.loads(_close(text))
+            return data if isinstance(data, dict) else {}
+        except ValueError:
+            # Drop the unfinished key or value and try again.
+            cut = max(text.rfind(","), text.rfind("{"), text.rfind("["))
+            if cut <= 0:
+                return {}
+            text = text[:cut] if text[cut] == "," else text[:cut + 1]
+    return {}
+
+
+def parse_pack(text: str) -> List[Dict[str, Any]]:
+    """Card objects of a packed response, in order.
+
+    Objects are read one by one, so a malformed card or a truncated last card is
+    dropped without losing the complete ones around it.
+    """
+    text = _FENCE_RE.sub("", text or "")
+    start = text.find("[", max(text.find('"recipes"'), 0))
+    cards: List[Dict[str, Any]] = []
+    if start < 0:
+        return cards
+    depth, obj_start, in_str, esc = 0, -1, False, False
+    for i in range(start + 1, len(text)):
+        ch = text[i]
+        if in_str:
+            if esc:
+                esc = False
+            elif ch == "\\":
+                esc = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch in "{[":
+            if depth == 0 and ch == "{":
+                obj_start = i
+            depth += 1
+        elif ch in "}]":
+            if depth == 0:
+                break  # end of the recipes array
+            depth -= 1
+            if depth == 0 and obj_start >= 0:
+                try:
+                    card = json.loads(text[obj_start:i + 1])
+                except ValueError:
+                    card = None
+                if isinstance(card, dict):
+                    cards.append(card)
+                obj_start = -1
+    return cards
+
+# ================= validation =================
+def _text(value: Any) -> Optional[str]:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        value = str(value)
+    if not isinstance(value, str):
+        return None
+    value = re.sub(r"[*_`]", "", value).strip()
+    return value or None
+
+
+def _items(value: Any) -> Optional[List[str]]:
+    if isinstance(value, str):
+        value = [ln for ln in value.splitlines() if ln.strip()]
+    if not isinstance(value, list):
+        return None
+    out = [_BULLET_RE.sub("", t) for t in (_text(v) for v in value) if t]
+    return [t for t in out if t] or None
+
+
+def _stage(value: str) -> Optional[str]:
+    m = re.search(r"[1-4]", value)
+    return f"Stage {m.group(0)}" if m else None
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) if value >= 0 else None
+    m = _NUMBER_RE.search(str(value))
+    return float(m.group(0)) if m and float(m.group(0)) >= 0 else None
+
+
+def validate(data: Dict[str, Any], bariatric: bool,
+             only: Optional[Sequence[str]] = None) -> Tuple[Dict[str, Any], List[str]]:
+    """Normalize ``data`` and return (recipe, invalid field names).
+
+    Valid fields are kept even when others fail, so a repair request only has to
+    ask for the invalid ones.
+    """
+    recipe: Dict[str, Any] = {}
+    invalid: List[str] = []
+    for name in fields(bariatric):
+        if only is not None and name not in only:
+            continue
+        raw = data.get(name) if isinstance(data, dict) else None
+        if name == "nutrition":
+            raw = raw if isinstance(raw, dict) else {}
+            values = {key: _number(raw.get(key)) for key, _, _ in NUTRITION_FIELDS}
+            value: Any = values if all(v is not None for v in values.values()) else None
+        elif name == "bariatric_stages":
+            stages = sorted({s for s in (_stage(t) for t in (_items(raw) or [])) if s})
+            value = stages or None
+        elif name in TEXT_FIELDS:
+            value = _text(raw)
+        else:
+            value = _items(raw)
+        if value is None or (isinstance(value, list) and len(value) < MIN_ITEMS.get(name, 1)):
+            invalid.append(name)
+        else:
+            recipe[name] = value
+    return recipe, invalid
+
+
+def preview(data: Dict[str, Any], bariatric: bool) -> Dict[str, Any]:
+    """Lenient ``validate`` for rendering a card that is still streaming in."""
+    out: Dict[str, Any] = {}
+    for name in fields(bariatric):
+        raw = data.get(name)
+        if raw is None:
+            continue
+        if name == "nutrition":
+            raw = raw if isinstance(raw, dict) else {}
+            value: Any = {k: _number(raw[k]) for k, _, _ in NUTRITION_FIELDS if k in raw}
+        elif name == "bariatric_stages":
+            value = [s for s in (_stage(t) for t in (_items(raw) or [])) if s]
+        elif name in TEXT_FIELDS:
+            value = _text(raw)
+        else:
+            value = _items(raw)
+        if value:
+            out[name] = value
+    return out
+
+
+def repair_prompt(title: str, recipe: Dict[str, Any], invalid: Sequence[str]) -> str:
+    return (
+        f"The recipe card titled '{title}' below is missing or has invalid fields: {', '.join(invalid)}.\n"
+        f"Return a JSON object with only those fields, consistent with the rest of the card.\n\n"
+        + json.dumps(recipe, ensure_ascii=False)
+    )
+
+
+# ================= rendering =================
+def _fmt(value: float) -> str:
+    return f"{value:g}"
+
+
+def nutrition_line(nutrition: Dict[str, Any], bariatric: bool = False) -> str:
+    n = {key: _fmt(nutrition[key]) if isinstance(nutrition.get(key), (int, float)) else "X"
+         for key, _, _ in NUTRITION_FIELDS}
+    fat = "Fat" if bariatric else "Total Fat"
+    return (f"Calories {n['calories']} | Protein {n['protein_g']} g | "
+            f"{fat} {n['total_fat_g']} g ({n['saturated_fat_g']} g sat | {n['trans_fat_g']} g trans) | "
+            f"Carbohydrates {n['carbohydrates_g']} g | Fiber {n['fiber_g']} g | Sugar {n['sugar_g']} g | "
+            f"Sodium {n['sodium_mg']} mg")
+
+
+def _render(recipe: Dict[str, Any], bariatric: bool, plain: bool) -> str:
+    bold = (lambda s: s) if plain else (lambda s: f"**{s}**")
+    bullet = "- " if plain else "• "
+
+    def _label(name: str, value: Any) -> Optional[str]:
+        return f"{bold(name + ':')} {value}" if value else None
+
+    def _list(name: str, items: Any) -> Optional[str]:
+        return "\n".join([bold(name + ":")] + [bullet + t for t in items]) if items else None
+
+    head = [bold(recipe["title"])] if recipe.get("title") else []
+    if bariatric and recipe.get("bariatric_stages"):
+        head.append(_label("Bariatric Stage(s)", ", ".join(recipe["bariatric_stages"])))
+    times = [_label("Yields", recipe.get("yields")), _label("Prep time", recipe.get("prep_time")),
+             _label("Cook time", recipe.get("cook_time"))]
+    blocks = [
+        "\n".join(head),
+        recipe.get("summary"),
+        "\n".join(t for t in times if t),
+        _list("Ingredients", recipe.get("ingredients")),
+        f"{bold('Directions:')}\n{' '.join(recipe['directions'])}" if recipe.get("directions") else None,
+        _list("Substitutions Bariatric", recipe.get("substitutions")) if bariatric else None,
+        _list("Storage", recipe.get("storage")),
+        _label("Serving size", recipe.get("serving_size")),
+        f"{bold('Nutritional Facts per Serving:')}\n{nutrition_line(recipe['nutrition'], bariatric)}"
+        if isinstance(recipe.get("nutrition"), dict) and recipe["nutrition"] else None,
+    ]
+    return "\n\n".join(b for b in blocks if b)
+
+
+def render_markdown(recipe: Dict[str, Any], bariatric: bool = False) -> str:
+    """The card in the same markdown layout the prompt templates describe."""
+    return _render(recipe, bariatric, plain=False)
+
+
+def render_text(recipe: Dict[str, Any], bariatric: bool = False) -> str:
+    """Plain-text copy of the card (what _strip_markdown makes of the markdown)."""
+    return _render(recipe, bariatric, plain=True)
+
+
+def to_row(recipe: Dict[str, Any], bariatric: bool = False) -> Dict[str, str]:
+    """Databank row with the columns batch_pipeline and recipe_builder.build_outputs use."""
+    servings = re.match(r"\d+", recipe.get("yields", ""))
+    return {
+        "Title": recipe.get("title", ""),
+        "Servings": servings.group(0) if servings else recipe.get("yields", ""),
+        "PrepTime": recipe.get("prep_time", ""),
+        "CookTime": recipe.get("cook_time", ""),
+        "ServingSize": recipe.get("serving_size", ""),
+        "Ingredients": "; ".join(recipe.get("ingredients", [])),
+        "Directions": " ".join(recipe.get("directions", [])),
+        "Photo": "",
+        "Summary": recipe.get("summary", ""),
+        "Storage": "; ".join(recipe.get("storage", [])),
+        "Substitutions": "; ".join(recipe.get("substitutions", [])),
+        "BariatricStages": ", ".join(recipe.get("bariatric_stages", [])),
+        "Nutrition": nutrition_line(recipe["nutrition"], bariatric) if recipe.get("nutrition") else "",
+    }
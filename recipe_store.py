@@ -0,0 +1,331 @@
+# recipe_store.py
+"""Permanent, searchable store of every generated recipe card.
+
+Unlike the response cache (which expires and evicts), cards written here are
+kept: one row per title and variant, with the structured card (when generated
+as JSON), its markdown and the databank row recipe_builder consumes. An FTS5
+index over title, ingredients and directions makes searching hundreds of
+thousands of recipes a millisecond-range query.
+
+    python recipe_store.py search "peach cobbler"
+    python recipe_store.py export recipes.csv --variant standard   # CSV for recipe_builder
+    python recipe_store.py import master_recipes.csv               # bring a hand-kept databank in
+"""
+import os, re, csv, json, time, sqlite3, argparse, threading, traceback
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import recipe_schema
+from batch_pipeline import BUILDER_COLUMNS, EXTRA_COLUMNS, parse_recipe_card
+
+# ================= config =================
+STORE_PATH = os.environ.get("RECIPE_STORE_PATH", os.path.join(".cache", "recipes.sqlite3"))
+STORE_DISABLED = os.environ.get("RECIPE_STORE_DISABLED", "").lower() in ("1", "true", "yes")
+SEARCH_LIMIT = 50
+COUNT_CAP = 10000   # search totals stop counting here ("10000+"), so broad queries stay fast
+RANK_CAP = 5000     # more matches than this are listed most recently added first, unranked
+
+VARIANTS = ("standard", "bariatric")
+EXPORT_COLUMNS = BUILDER_COLUMNS + EXTRA_COLUMNS
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS recipes (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    title_key TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    model TEXT NOT NULL DEFAULT '',
+    source TEXT NOT NULL DEFAULT 'generated',
+    card TEXT,
+    markdown TEXT NOT NULL DEFAULT '',
+    row TEXT NOT NULL,
+    ingredients TEXT NOT NULL DEFAULT '',
+    directions TEXT NOT NULL DEFAULT '',
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE (title_key, variant)
+);
+CREATE INDEX IF NOT EXISTS recipes_variant ON recipes(variant, id);
+CREATE VIRTUAL TABLE IF NOT EXISTS recipes_fts USING fts5(
+    title, ingredients, directions, content='recipes', content_rowid='id', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS recipes_ai AFTER INSERT ON recipes BEGIN
+    INSERT INTO recipes_fts(rowid, title, ingredients, directions)
+    VALUES (new.id, new.title, new.ingredients, new.directions);
+END;
+CREATE TRIGGER IF NOT EXISTS recipes_ad AFTER DELETE ON recipes BEGIN
+    INSERT INTO recipes_fts(recipes_fts, rowid, title, ingredients, directions)
+    VALUES ('delete', old.id, old.title, old.ingredients, old.directions);
+END;
+CREATE TRIGGER IF NOT EXISTS recipes_au AFTER UPDATE ON recipes BEGIN
+    INSERT INTO recipes_fts(recipes_fts, rowid, title, ingredients, directions)
+    VALUES ('delete', old.id, old.title, old.ingredients, old.directions);
+    INSERT INTO recipes_fts(rowid, title, ingredients, directions)
+    VALUES (new.id, new.title, new.ingredients, new.directions);
+END;
+"""
+
+
+def title_key(title: str) -> str:
+    return " ".join(str(title).lower().split())
+
+
+def _variant(bariatric: bool) -> str:
+    return "bariatric" if bariatric else "standard"
+
+
+def fts_query(text: str) -> str:
+    """User search text as an FTS5 query: every word must match, the last one as a prefix."""
+    words = re.findall(r"\w+", str(text).lower())
+    terms = [f'"{w}"' for w in words]
+    if terms:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+def _row_markdown(row: Dict[str, str]) -> str:
+    """Minimal card for imported databank rows, which have no generated markdown."""
+    parts = [f"**{row.get('Title', '')}**"]
+    for label, col in (("Yields", "Servings"), ("Prep time", "PrepTime"), ("Cook time", "CookTime"),
+                       ("Serving size", "ServingSize")):
+        if row.get(col):
+            parts.append(f"**{label}:** {row[col]}")
+    ingredients = [i.strip() for i in str(row.get("Ingredients", "")).split(";") if i.strip()]
+    if ingredients:
+        parts.append("**Ingredients:**\n" + "\n".join(f"• {i}" for i in ingredients))
+    if row.get("Directions"):
+        parts.append(f"**Directions:**\n{row['Directions']}")
+    return "\n\n".join(parts)
+
+
+# ================= store =================
+class RecipeStore:
+    def __init__(self, path: str = STORE_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    # ---------- writes ----------
+    def _upsert(self, conn: sqlite3.Connection, title: str, variant: str, row: Dict[str, str], markdown: str,
+                card: Optional[Dict[str, Any]], model: str, source: str, now: float) -> int:
+        row = {col: str(row.get(col, "") or "") for col in EXPORT_COLUMNS}
+        row.update(Title=title, Variant=variant)
+        conn.execute(
+            "INSERT INTO recipes(title, title_key, variant, model, source, card, markdown, row, ingredients,"
+            " directions, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT(title_key, variant) DO UPDATE SET title=excluded.title, model=excluded.model,"
+            " source=excluded.source, card=excluded.card, markdown=excluded.markdown, row=excluded.row,"
+            " ingredients=excluded.ingredients, directions=excluded.directions, updated_at=excluded.updated_at",
+            (title, title_key(title), variant, model, source,
+             json.dumps(card, ensure_ascii=False) if card is not None else None, markdown,
+             json.dumps(row, ensure_ascii=False), row["Ingredients"], row["Directions"], now, now),
+        )
+        return conn.execute("SELECT id FROM recipes WHERE title_key = ? AND variant = ?",
+                            (title_key(title), variant)).fetchone()[0]
+
+    def put(self, title: str, bariatric: bool, card: Union[Dict[str, Any], str], model: str = "") -> int:
+        """Store a generated card (structured dict or markdown), replacing this title/variant; returns its id."""
+        if isinstance(card, dict):
+            markdown = recipe_schema.render_markdown(card, bariatric)
+            row, structured = recipe_schema.to_row(card, bariatric), card
+        else:
+            markdown = card
+            row, structured = parse_recipe_card(card), None
+        with self._lock:
+            return self._upsert(self._db(), title.strip(), _variant(bariatric), row, markdown, structured,
+                                model, "generated", time.time())
+
+    def import_rows(self, rows: Iterator[Dict[str, str]], source: str = "import") -> int:
+        """Add databank rows (e.g. a hand-kept CSV) without overwriting generated cards."""
+        n = 0
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            conn.execute("BEGIN")
+            try:
+                for row in rows:
+                    title = str(row.get("Title", "")).strip()
+                    variant = str(row.get("Variant", "") or "standard").strip().lower()
+                    if not title or variant not in VARIANTS:
+                        continue
+                    exists = conn.execute("SELECT 1 FROM recipes WHERE title_key = ? AND variant = ?",
+                                          (title_key(title), variant)).fetchone()
+                    if exists is None:
+                        self._upsert(conn, title, variant, row, _row_markdown(row), None, "", source, now)
+                        n += 1
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return n
+
+    def import_csv(self, path: str) -> int:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            return self.import_rows(csv.DictReader(f), source=os.path.basename(path))
+
+    # ---------- reads ----------
+    def get(self, title: str, bariatric: bool = False) -> Optional[Dict[str, Any]]:
+        """The stored record for a title/variant: id, title, variant, card (dict or None), markdown, row."""
+        with self._lock:
+            rec = self._db().execute("SELECT * FROM recipes WHERE title_key = ? AND variant = ?",
+                                     (title_key(title), _variant(bariatric))).fetchone()
+        return self._record(rec) if rec is not None else None
+
+    def get_by_id(self, recipe_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            rec = self._db().execute("SELECT * FROM recipes WHERE id = ?", (int(recipe_id),)).fetchone()
+        return self._record(rec) if rec is not None else None
+
+    @staticmethod
+    def _record(rec: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "id": rec["id"], "title": rec["title"], "variant": rec["variant"], "model": rec["model"],
+            "source": rec["source"], "card": json.loads(rec["card"]) if rec["card"] else None,
+            "markdown": rec["markdown"], "row": json.loads(rec["row"]), "updated_at": rec["updated_at"],
+        }
+
+    def card(self, title: str, bariatric: bool = False, structured: bool = True) -> Optional[Union[Dict[str, Any], str]]:
+        """A generated card to serve instead of regenerating: the dict when ``structured``, else markdown."""
+        rec = self.get(title, bariatric)
+        if rec is None or rec["source"] != "generated":
+            return None
+        if structured:
+            return rec["card"]
+        return rec["markdown"] or None
+
+    @staticmethod
+    def _from(query: str, variant: Optional[str]) -> Tuple[str, List[Any]]:
+        """FROM/WHERE clause (and its arguments) selecting the recipes that match a search."""
+        clauses, args = [], []
+        match = fts_query(query)
+        source = " FROM recipes"
+        if match:
+            # CROSS JOIN keeps the FTS index as the outer loop, so LIMITs stop the scan early.
+            source = " FROM recipes_fts CROSS JOIN recipes ON recipes.id = recipes_fts.rowid"
+            clauses.append("recipes_fts MATCH ?")
+            args.append(match)
+        if variant in VARIANTS:
+            clauses.append("recipes.variant = ?")
+            args.append(variant)
+        return source + ((" WHERE " + " AND ".join(clauses)) if clauses else ""), args
+
+    def search(self, query: str = "", variant: Optional[str] = None, limit: int = SEARCH_LIMIT,
+               offset: int = 0) -> Tuple[List[Dict[str, Any]], int]:
+        """(page of matches, total matches up to COUNT_CAP + 1).
+
+        With a query, best matches first (bm25, title weighted highest) unless
+        there are more than RANK_CAP of them; otherwise most recently added first.
+        """
+        source, args = self._from(query, variant)
+        columns = "SELECT recipes.id, recipes.title, recipes.variant, recipes.updated_at"
+        with self._lock:
+            conn = self._db()
+            total = conn.execute(f"SELECT COUNT(*) FROM (SELECT 1{source} LIMIT ?)", args + [COUNT_CAP + 1]).fetchone()[0]
+            if not fts_query(query):
+                order = " ORDER BY recipes.id DESC"
+            elif total <= RANK_CAP:
+                order = " ORDER BY bm25(recipes_fts, 10.0, 2.0, 1.0)"
+            else:
+                order = " ORDER BY recipes_fts.rowid DESC"
+            rows = conn.execute(columns + source + order + " LIMIT ? OFFSET ?", args + [int(limit), int(offset)]).fetchall()
+        return [dict(r) for r in rows], total
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db().execute("SELECT COUNT(*) FROM recipes").fetchone()[0]
+
+    # ---------- export ----------
+    def export_csv(self, path: str, query: str = "", variant: Optional[str] = None) -> Tuple[str, int]:
+        """Write matching recipes as the databank CSV recipe_builder reads; returns (path, rows written)."""
+        source, args = self._from(query, variant)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        n = 0
+        with self._lock:
+            cur = self._db().execute(f"SELECT recipes.row{source} ORDER BY recipes.title_key, recipes.variant", args)
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=EXPORT_COLUMNS, extrasaction="ignore")
+                writer.writeheader()
+                for (row,) in cur:
+                    writer.writerow(json.loads(row))
+                    n += 1
+        return path, n
+
+
+_default_store: Optional[RecipeStore] = None
+_default_lock = threading.Lock()
+
+
+def get_store() -> RecipeStore:
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = RecipeStore()
+        return _default_store
+
+
+def lookup(title: str, bariatric: bool, structured: bool) -> Optional[Union[Dict[str, Any], str]]:
+    """Stored card for app's generation paths; store problems never block generation."""
+    if STORE_DISABLED:
+        return None
+    try:
+        return get_store().card(title, bariatric, structured)
+    except Exception:
+        traceback.print_exc()
+        return None
+
+
+def save(title: str, bariatric: bool, card: Union[Dict[str, Any], str, None], model: str = "") -> None:
+    if STORE_DISABLED or not card:
+        return
+    try:
+        get_store().put(title, bariatric, card, model)
+    except Exception:
+        traceback.print_exc()
+
+
+# ================= cli =================
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Search, export and import the recipe store.")
+    parser.add_argument("--db", default=STORE_PATH, help="store path")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_search = sub.add_parser("search", help="full-text search over titles, ingredients and directions")
+    p_search.add_argument("query", nargs="?", default="")
+    p_search.add_argument("--variant", choices=VARIANTS)
+    p_search.add_argument("--limit", type=int, default=20)
+    p_export = sub.add_parser("export", help="write a databank CSV for recipe_builder")
+    p_export.add_argument("path")
+    p_export.add_argument("--query", default="")
+    p_export.add_argument("--variant", choices=VARIANTS)
+    p_import = sub.add_parser("import", help="add the rows of a databank CSV")
+    p_import.add_argument("path")
+    args = parser.parse_args(argv)
+
+    store = RecipeStore(args.db)
+    if args.cmd == "search":
+        t0 = time.perf_counter()
+        rows, total = store.search(args.query, args.variant, limit=args.limit)
+        for r in rows:
+            print(f"{r['id']:>8}  {r['variant']:<9}  {r['title']}")
+        print(f"🔎 {total} matches ({(time.perf_counter() - t0) * 1000:.1f} ms)")
+    elif args.cmd == "export":
+        path, n = store.export_csv(args.path, args.query, args.variant)
+        print(f"💾 {n} recipes written to {path}")
+    else:
+        print(f"📥 {store.import_csv(args.path)} recipes imported from {args.path}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
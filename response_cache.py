@@ -0,0 +1,220 @@
+# response_cache.py
+import os, json, time, sqlite3, hashlib, threading, traceback
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+# ================= config =================
+CACHE_PATH = os.environ.get("RECIPE_CACHE_PATH", os.path.join(".cache", "responses.sqlite3"))
+CACHE_MAX_BYTES = int(os.environ.get("RECIPE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+CACHE_TTL = float(os.environ.get("RECIPE_CACHE_TTL", 30 * 24 * 3600))  # seconds
+CACHE_MEMORY_ITEMS = int(os.environ.get("RECIPE_CACHE_MEMORY_ITEMS", 512))
+CACHE_DISABLED = os.environ.get("RECIPE_CACHE_DISABLED", "").lower() in ("1", "true", "yes")
+CACHE_PURGE_INTERVAL = float(os.environ.get("RECIPE_CACHE_PURGE_INTERVAL", 600))  # seconds between expiry sweeps
+EVICT_BATCH = 64  # rows deleted per query when over max_bytes
+
+
+def make_key(*parts: Any) -> str:
+    """Content address for a response: sha256 over the JSON of everything that shapes it."""
+    blob = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+# ================= cache =================
+class ResponseCache:
+    """SQLite-backed response cache with an in-memory LRU in front.
+
+    Entries expire after their TTL; once the on-disk payload exceeds ``max_bytes``
+    the least recently used rows are evicted. The payload size is kept as a running
+    total, expired rows are swept every ``CACHE_PURGE_INTERVAL`` seconds (lookups
+    already skip them), and memory hits bump ``accessed_at`` in a batch before eviction.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, max_bytes: int = CACHE_MAX_BYTES,
+                 ttl: float = CACHE_TTL, memory_items: int = CACHE_MEMORY_ITEMS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.memory_items = memory_items
+        self._lock = threading.RLock()
+        self._mem: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._disk_failed = False
+        self._bytes = 0  # payload bytes on disk
+        self._next_purge = 0.0
+        self._touched: Dict[str, float] = {}  # memory hits whose accessed_at is not yet on disk
+        self._stats: Dict[str, int] = dict(memory_hits=0, disk_hits=0, misses=0, stores=0, evictions=0)
+
+    # ---------- storage ----------
+    def _db(self) -> Optional[sqlite3.Connection]:
+        if self._conn is not None or self._disk_failed:
+            return self._conn
+        try:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+                " expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_expires ON responses(expires_at)")
+            self._bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            self._next_purge = time.time() + CACHE_PURGE_INTERVAL
+            self._conn = conn
+        except Exception:
+            # Fall back to memory-only caching rather than failing generation.
+            traceback.print_exc()
+            self._disk_failed = True
+        return self._conn
+
+    def _remember(self, key: str, expires_at: float, value: Any) -> None:
+        self._mem[key] = (expires_at, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.memory_items:
+            self._mem.popitem(last=False)
+
+    def _purge(self, conn: sqlite3.Connection, now: float) -> None:
+        """Sweep expired rows and resync the byte total (other processes may share the file)."""
+        self._next_purge = now + CACHE_PURGE_INTERVAL
+        self._stats["evictions"] += conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,)).rowcount
+        self._bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        now = time.time()
+        if now >= self._next_purge:
+            self._purge(conn, now)
+        if self._bytes <= self.max_bytes:
+            return
+        if self._touched:
+            conn.executemany("UPDATE responses SET accessed_at = ? WHERE key = ?",
+                             [(t, k) for k, t in self._touched.items()])
+            self._touched.clear()
+        while self._bytes > self.max_bytes:
+            rows = conn.execute("SELECT key, size FROM responses ORDER BY accessed_at LIMIT ?",
+                                (EVICT_BATCH,)).fetchall()
+            if not rows:
+                self._bytes = 0
+                break
+            victims = []
+            for key, size in rows:
+                if self._bytes <= self.max_bytes:
+                    break
+                victims.append((key,))
+                self._mem.pop(key, None)
+                self._bytes -= size
+            conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+            self._stats["evictions"] += len(victims)
+
+    # ---------- public API ----------
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit is not None:
+                if hit[0] > now:
+                    self._mem.move_to_end(key)
+                    if self._conn is not None:
+                        self._touched[key] = now
+                    self._stats["memory_hits"] += 1
+                    return hit[1]
+                del self._mem[key]
+            conn = self._db()
+            if conn is not None:
+                row = conn.execute(
+                    "SELECT value, expires_at FROM responses WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                    value = json.loads(row[0])
+                    self._remember(key, row[1], value)
+                    self._stats["disk_hits"] += 1
+                    return value
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        blob = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._remember(key, expires_at, value)
+            self._stats["stores"] += 1
+            conn = self._db()
+            if conn is not None:
+                size = len(blob.encode("utf-8"))
+                old = conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses(key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, blob, size, expires_at, now),
+                )
+                self._touched.pop(key, None)
+                self._bytes += size - (old[0] if old else 0)
+                self._evict(conn)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any], ttl: Optional[float] = None,
+                       refresh: bool = False) -> Any:
+        """Return the cached value for ``key`` or compute and store it.
+
+        ``refresh=True`` skips the lookup but still stores the fresh result. ``None``
+        results (failed generations) are never cached.
+        """
+        if not refresh:
+            value = self.get(key)
+            if value is not None:
+                return value
+        value = compute()
+        if value is not None:
+            self.set(key, value, ttl=ttl)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            self._touched.clear()
+            conn = self._db()
+            if conn is not None:
+                conn.execute("DELETE FROM responses")
+                self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._stats)
+            hits = out["memory_hits"] + out["disk_hits"]
+            lookups = hits + out["misses"]
+            out["hits"] = hits
+            out["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+            out["memory_items"] = len(self._mem)
+            conn = self._db()
+            if conn is not None:
+                n, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+                out["disk_items"], out["disk_bytes"] = n, size
+            return out
+
+
+class _NullCache(ResponseCache):
+    """Used when RECIPE_CACHE_DISABLED is set: every lookup misses, nothing is stored."""
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        pass
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        return None
+
+
+_default_cache: Optional[ResponseCache] = None
+_default_lock = threading.Lock()
+
+
+def get_cache() -> ResponseCache:
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = _NullCache() if CACHE_DISABLED else ResponseCache()
+        return _default_cache
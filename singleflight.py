@@ -0,0 +1,127 @@
+# singleflight.py
+"""Coalescing of identical in-flight work: concurrent callers with the same key share one result.
+
+A ``SingleFlight`` keeps one Future per key while its work runs. Threads join it
+with ``do``; coroutines with ``ado`` (the Future is awaited, shielded, so one
+caller going away does not cancel the work for the others). Work that resolves
+several keys at once (a packed call) ``claim``s them first and ``resolve``s each.
+
+``SharedStream`` is the streaming counterpart for the UI: the source runs once in
+its own task and every follower sees its latest snapshot.
+"""
+import asyncio, threading
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+import metrics
+
+metrics.describe("recipe_coalesced_total", "counter", "Requests served by joining identical in-flight work, by kind.")
+
+
+class SingleFlight:
+    def __init__(self, kind: str):
+        self.kind = kind
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+
+    def pending(self, key: str) -> Optional[Future]:
+        with self._lock:
+            return self._calls.get(key)
+
+    def claim(self, key: str) -> Tuple[Future, bool]:
+        """(future for ``key``, True when the caller must produce it and ``resolve`` it)."""
+        with self._lock:
+            fut = self._calls.get(key)
+            if fut is not None:
+                metrics.inc("recipe_coalesced_total", kind=self.kind)
+                return fut, False
+            fut = self._calls[key] = Future()
+            return fut, True
+
+    def resolve(self, key: str, fut: Future, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            if self._calls.get(key) is fut:
+                del self._calls[key]
+        if not fut.done():
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(result)
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        fut, leader = self.claim(key)
+        if not leader:
+            return fut.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            self.resolve(key, fut, error=e)
+            raise
+        self.resolve(key, fut, result)
+        return result
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        fut, leader = self.claim(key)
+        if not leader:
+            return await asyncio.shield(asyncio.wrap_future(fut))
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            self.resolve(key, fut, error=RuntimeError("cancelled by the request that started it"))
+            raise
+        except BaseException as e:
+            self.resolve(key, fut, error=e)
+            raise
+        self.resolve(key, fut, result)
+        return result
+
+
+class SharedStream:
+    """Runs an async iterator of cumulative snapshots once and lets any number of handlers follow it.
+
+    Followers get the latest snapshot whenever a new one arrives (intermediate ones may be
+    skipped), then the source's error if it failed. ``on_done(error)`` runs once the source ends.
+    """
+
+    def __init__(self, source: AsyncIterator[Any], on_done: Optional[Callable[[Optional[BaseException]], None]] = None):
+        self.latest: Any = None
+        self.count = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+        self._on_done = on_done
+        self.task = asyncio.create_task(self._pump(source))
+
+    def _wake(self) -> None:
+        event, self._changed = self._changed, asyncio.Event()
+        event.set()
+
+    async def _pump(self, source: AsyncIterator[Any]) -> None:
+        try:
+            async for item in source:
+                self.latest, self.count = item, self.count + 1
+                self._wake()
+        except asyncio.CancelledError:
+            self.error = RuntimeError("stream cancelled")  # followers fail; the task itself stays cancelled
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._wake()
+            if self._on_done:
+                self._on_done(self.error)
+
+    async def follow(self) -> AsyncIterator[Any]:
+        seen = 0
+        while True:
+            changed = self._changed
+            if self.count > seen:
+                seen = self.count
+                yield self.latest
+                continue
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
@@ -0,0 +1,5 @@
+# tests/conftest.py
+# The modules are flat files at the repository root; make them importable from tests/.
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
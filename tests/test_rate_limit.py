@@ -0,0 +1,85 @@
+# tests/test_rate_limit.py
+import asyncio
+import time
+
+import pytest
+
+import app
+import rate_limit
+from rate_limit import CircuitBreaker, CircuitOpenError
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    b = CircuitBreaker(threshold=1, cooldown=0.05)
+    monkeypatch.setattr(rate_limit, "breaker", b)
+    return b
+
+
+def _open(b):
+    b.record("connection")
+    with pytest.raises(CircuitOpenError):
+        b.check()
+    time.sleep(0.06)
+
+
+def test_breaker_opens_and_half_opens_for_one_trial(breaker):
+    assert breaker.check() is False
+    _open(breaker)
+    assert breaker.check() is True
+    with pytest.raises(CircuitOpenError):
+        breaker.check()  # only one trial at a time
+    breaker.record(None)
+    assert breaker.check() is False
+
+
+def test_failed_trial_reopens(breaker):
+    _open(breaker)
+    assert breaker.check() is True
+    breaker.record("server")
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_released_trial_lets_the_next_call_try(breaker):
+    _open(breaker)
+    assert breaker.check() is True
+    breaker.release()
+    assert breaker.check() is True
+
+
+def test_cancelled_async_trial_is_released(breaker):
+    _open(breaker)
+    started = asyncio.Event()
+
+    async def hang():
+        started.set()
+        await asyncio.sleep(60)
+
+    async def ok():
+        return "card"
+
+    async def main():
+        task = asyncio.create_task(app._safe_backoff_async(hang, retries=1))
+        await started.wait()
+        with pytest.raises(CircuitOpenError):
+            breaker.check()  # the trial is in flight
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return await app._safe_backoff_async(ok, retries=1)
+
+    assert asyncio.run(main()) == "card"
+    assert breaker.opened_at is None
+
+
+def test_interrupted_sync_trial_is_released(breaker):
+    _open(breaker)
+
+    def interrupted():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        app._safe_backoff(interrupted, retries=1)
+    assert breaker.trial_in_flight is False
+    assert app._safe_backoff(lambda: "card", retries=1) == "card"
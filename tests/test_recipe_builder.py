@@ -0,0 +1,60 @@
+# tests/test_recipe_builder.py
+import pytest
+
+import recipe_builder
+from recipe_builder import plan_build
+
+
+@pytest.fixture
+def out(tmp_path, monkeypatch):
+    monkeypatch.setattr(recipe_builder, "OUTPUT_DIR", tmp_path)
+    def _write(*names):
+        for name in names:
+            (tmp_path / name).write_bytes(b"docx")
+    return _write
+
+
+def test_unchanged_cards_are_kept(out):
+    out("001_Peach_Pie.docx", "002_Lemon_Tart.docx")
+    previous = {"001_Peach_Pie.docx": "h1", "002_Lemon_Tart.docx": "h2"}
+    assert plan_build(dict(previous), previous) == (set(), [], [])
+
+
+def test_changed_and_new_cards_are_rendered(out):
+    out("001_Peach_Pie.docx", "002_Lemon_Tart.docx")
+    previous = {"001_Peach_Pie.docx": "h1", "002_Lemon_Tart.docx": "h2"}
+    targets = {"001_Peach_Pie.docx": "h1-edited", "002_Lemon_Tart.docx": "h2", "003_Plum_Cake.docx": "h3"}
+    render, moves, stale = plan_build(targets, previous)
+    assert render == {"001_Peach_Pie.docx", "003_Plum_Cake.docx"}
+    assert moves == [] and stale == []
+
+
+def test_missing_outputs_are_rendered_again(out):
+    out("002_Lemon_Tart.docx")
+    previous = {"001_Peach_Pie.docx": "h1", "002_Lemon_Tart.docx": "h2"}
+    assert plan_build(dict(previous), previous) == ({"001_Peach_Pie.docx"}, [], [])
+
+
+def test_renumbered_cards_are_moved_not_rendered(out):
+    out("001_Peach_Pie.docx", "002_Lemon_Tart.docx")
+    previous = {"001_Peach_Pie.docx": "h1", "002_Lemon_Tart.docx": "h2"}
+    targets = {"001_Plum_Cake.docx": "h3", "002_Peach_Pie.docx": "h1", "003_Lemon_Tart.docx": "h2"}
+    render, moves, stale = plan_build(targets, previous)
+    assert render == {"001_Plum_Cake.docx"}
+    assert sorted(moves) == [("001_Peach_Pie.docx", "002_Peach_Pie.docx"),
+                             ("002_Lemon_Tart.docx", "003_Lemon_Tart.docx")]
+    assert stale == []
+
+
+def test_removed_cards_are_stale(out):
+    out("001_Peach_Pie.docx", "002_Lemon_Tart.docx")
+    previous = {"001_Peach_Pie.docx": "h1", "002_Lemon_Tart.docx": "h2"}
+    render, moves, stale = plan_build({"001_Peach_Pie.docx": "h1"}, previous)
+    assert (render, moves, stale) == (set(), [], ["002_Lemon_Tart.docx"])
+
+
+def test_manifest_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(recipe_builder, "MANIFEST_FILE", tmp_path / ".build_manifest.json")
+    assert recipe_builder.load_manifest() == (None, {})
+    recipe_builder.save_manifest("template", {"001_Peach_Pie.docx": "h1"})
+    assert recipe_builder.load_manifest() == ("template", {"001_Peach_Pie.docx": "h1"})
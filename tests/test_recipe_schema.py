@@ -0,0 +1,81 @@
+# tests/test_recipe_schema.py
+import json
+
+import pytest
+
+import recipe_schema
+from recipe_schema import parse, parse_partial, validate
+
+NUTRITION = {"calories": 320, "protein_g": 21, "total_fat_g": 9, "saturated_fat_g": 3, "trans_fat_g": 0,
+             "carbohydrates_g": 38, "fiber_g": 4, "sugar_g": 12, "sodium_mg": 410}
+
+
+def card(**overrides):
+    data = {"title": "Peach Pie", "summary": "A pie. With peaches.", "yields": "8 servings",
+            "prep_time": "20 minutes", "cook_time": "45 minutes", "serving_size": "1 slice",
+            "ingredients": ["4 peaches", "1 cup flour", "1/2 cup sugar"], "directions": ["Bake."],
+            "storage": ["Refrigerate up to 3 days."], "nutrition": dict(NUTRITION)}
+    data.update(overrides)
+    return data
+
+
+def test_a_complete_card_is_valid():
+    recipe, invalid = validate(card(), False)
+    assert invalid == []
+    assert set(recipe) == set(recipe_schema.fields(False))
+    assert recipe["nutrition"]["calories"] == 320.0
+
+
+def test_values_are_normalized():
+    recipe, invalid = validate(card(title="**Peach Pie**", ingredients="- 4 peaches\n• 1 cup flour\n2. 1/2 cup sugar",
+                                    nutrition=dict(NUTRITION, protein_g="21 g")), False)
+    assert invalid == []
+    assert recipe["title"] == "Peach Pie"
+    assert recipe["ingredients"] == ["4 peaches", "1 cup flour", "1/2 cup sugar"]
+    assert recipe["nutrition"]["protein_g"] == 21.0
+
+
+def test_invalid_fields_are_named_and_valid_ones_kept():
+    recipe, invalid = validate(card(ingredients=["4 peaches"], summary="", nutrition=dict(NUTRITION, sodium_mg=-1)),
+                               False)
+    assert invalid == ["summary", "ingredients", "nutrition"]
+    assert recipe["directions"] == ["Bake."] and "ingredients" not in recipe
+
+
+def test_bariatric_fields_and_stages():
+    _, invalid = validate(card(), True)
+    assert invalid == ["bariatric_stages", "substitutions"]
+    recipe, invalid = validate(card(bariatric_stages=["stage 3 (soft)", "Stage 2", "pureed"],
+                                    substitutions=["Greek yogurt for cream"]), True)
+    assert invalid == []
+    assert recipe["bariatric_stages"] == ["Stage 2", "Stage 3"]
+
+
+def test_only_validates_the_requested_fields():
+    recipe, invalid = validate({"ingredients": ["a", "b", "c"]}, False, only=["ingredients", "storage"])
+    assert recipe == {"ingredients": ["a", "b", "c"]}
+    assert invalid == ["storage"]
+
+
+def test_parse_strips_code_fences_and_rejects_non_objects():
+    assert parse("```json\n" + json.dumps(card()) + "\n```")["title"] == "Peach Pie"
+    with pytest.raises(ValueError):
+        parse("[1, 2]")
+    with pytest.raises(ValueError):
+        parse("not json")
+
+
+def test_parse_partial_reads_every_prefix():
+    text = json.dumps(card())
+    for end in range(len(text) + 1):
+        data = parse_partial(text[:end])
+        assert isinstance(data, dict)
+    assert parse_partial(text) == card()
+
+
+def test_parse_partial_keeps_finished_fields_and_open_values():
+    data = parse_partial('{"title": "Peach Pie", "ingredients": ["4 peaches", "1 cup fl')
+    assert data["title"] == "Peach Pie"
+    assert data["ingredients"][0] == "4 peaches"
+    assert parse_partial('{"title": "Peach Pie", "summ') == {"title": "Peach Pie"}
+    assert parse_partial("") == {} and parse_partial("no object yet") == {}
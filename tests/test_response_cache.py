@@ -0,0 +1,92 @@
+# tests/test_response_cache.py
+import time
+
+import pytest
+
+from response_cache import ResponseCache, make_key
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "responses.sqlite3")
+
+
+def test_make_key_covers_every_part():
+    assert make_key("recipe", "Peach Pie", False) == make_key("recipe", "Peach Pie", False)
+    assert make_key("recipe", "Peach Pie", False) != make_key("recipe", "Peach Pie", True)
+    assert make_key({"a": 1, "b": 2}) == make_key({"b": 2, "a": 1})
+
+
+def test_values_persist_across_instances(path):
+    ResponseCache(path).set("card", {"title": "Peach Pie", "ingredients": ["peaches"]})
+    cache = ResponseCache(path)
+    assert cache.get("card") == {"title": "Peach Pie", "ingredients": ["peaches"]}
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_expired_entries_miss_in_memory_and_on_disk(path):
+    cache = ResponseCache(path, ttl=0.05)
+    cache.set("card", "text")
+    cache.set("kept", "text", ttl=60)
+    time.sleep(0.1)
+    assert cache.get("card") is None
+    assert ResponseCache(path).get("card") is None
+    assert cache.get("kept") == "text"
+
+
+def test_memory_lru_keeps_the_most_recently_used(path):
+    cache = ResponseCache(path, memory_items=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)  # pushes out "b", the least recently used
+    assert cache.stats()["memory_items"] == 2
+    assert cache.get("b") == 2
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_disk_evicts_least_recently_used_past_max_bytes(path):
+    value = "x" * 100
+    cache = ResponseCache(path, max_bytes=250)
+    cache.set("a", value)
+    time.sleep(0.01)
+    cache.set("b", value)
+    time.sleep(0.01)
+    assert cache.get("a") == value  # "b" is now the least recently used
+    time.sleep(0.01)
+    cache.set("c", value)
+    assert cache.get("b") is None
+    assert cache.get("a") == value and cache.get("c") == value
+    assert cache.stats()["evictions"] == 1
+
+
+def test_byte_total_follows_replace_and_clear(path):
+    cache = ResponseCache(path)
+    cache.set("a", "x" * 100)
+    cache.set("a", "x" * 10)  # replacing frees the old payload
+    cache.set("b", "x" * 50)
+    assert cache.stats()["disk_bytes"] == cache._bytes == 12 + 52
+    assert ResponseCache(path).stats()["disk_bytes"] == 64
+    cache.clear()
+    assert cache._bytes == 0
+
+
+def test_eviction_deletes_in_batches_until_under_max_bytes(path):
+    cache = ResponseCache(path, max_bytes=10_000, memory_items=4)
+    for i in range(200):
+        cache.set(f"k{i}", "x" * 98)  # 100 bytes of JSON each
+    stats = cache.stats()
+    assert stats["disk_bytes"] <= 10_000 and stats["disk_items"] == 100
+    assert stats["evictions"] == 100
+    assert cache.get("k0") is None and cache.get("k199") == "x" * 98
+
+
+def test_get_or_compute_skips_none_and_honours_refresh(path):
+    cache = ResponseCache(path)
+    calls = []
+    assert cache.get_or_compute("k", lambda: calls.append(1)) is None
+    assert cache.get_or_compute("k", lambda: "fresh") == "fresh"
+    assert cache.get_or_compute("k", lambda: "recomputed") == "fresh"
+    assert cache.get_or_compute("k", lambda: "recomputed", refresh=True) == "recomputed"
+    assert cache.get("k") == "recomputed"
+    assert calls == [1]
@@ -0,0 +1,166 @@
+# tests/test_singleflight.py
+import asyncio
+import threading
+
+import pytest
+
+import app
+from singleflight import SharedStream, SingleFlight
+
+
+def test_claim_makes_one_leader_per_key():
+    flight = SingleFlight("test")
+    fut, leader = flight.claim("k")
+    again, follower_leads = flight.claim("k")
+    assert leader and not follower_leads and again is fut
+    flight.resolve("k", fut, "card")
+    assert fut.result() == "card"
+    assert flight.pending("k") is None
+    assert flight.claim("k")[1]  # resolved keys can be claimed afresh
+
+
+def test_resolve_hands_errors_to_followers():
+    flight = SingleFlight("test")
+    fut, _ = flight.claim("k")
+    flight.resolve("k", fut, error=ValueError("api down"))
+    with pytest.raises(ValueError, match="api down"):
+        fut.result()
+
+
+class _Flight(SingleFlight):
+    """Signals when a caller joins work already in flight."""
+
+    def __init__(self):
+        super().__init__("test")
+        self.joined = threading.Event()
+
+    def claim(self, key):
+        fut, leader = super().claim(key)
+        if not leader:
+            self.joined.set()
+        return fut, leader
+
+
+def test_do_runs_concurrent_calls_once():
+    flight = _Flight()
+    started, release = threading.Event(), threading.Event()
+    calls, results = [], []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "card"
+
+    leader = threading.Thread(target=lambda: results.append(flight.do("k", work)))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(flight.do("k", work)))
+    follower.start()
+    assert flight.joined.wait(5)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert results == ["card", "card"] and calls == [1]
+
+
+def test_ado_follower_outlives_a_cancelled_caller():
+    flight = SingleFlight("test")
+
+    async def main():
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return "card"
+
+        leader = asyncio.create_task(flight.ado("k", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.ado("k", work))
+        await asyncio.sleep(0)
+        follower.cancel()  # a follower leaving does not cancel the work
+        release.set()
+        assert await leader == "card"
+        with pytest.raises(asyncio.CancelledError):
+            await follower
+
+    asyncio.run(main())
+
+
+async def _snapshots(n, error=None, gate=None):
+    for i in range(1, n + 1):
+        if gate is not None:
+            await gate.wait()
+        yield "x" * i
+        await asyncio.sleep(0)
+    if error is not None:
+        raise error
+
+
+async def _collect(stream):
+    return [s async for s in stream.follow()]
+
+
+def test_shared_stream_followers_end_on_the_last_snapshot():
+    async def main():
+        stream = SharedStream(_snapshots(5))
+        a, b = await asyncio.gather(_collect(stream), _collect(stream))
+        assert a[-1] == b[-1] == "xxxxx"
+        assert await _collect(stream) == ["xxxxx"]  # late followers get the result
+
+    asyncio.run(main())
+
+
+def test_shared_stream_failure_reaches_followers_and_on_done():
+    ended = []
+
+    async def main():
+        stream = SharedStream(_snapshots(2, ValueError("api down")), on_done=ended.append)
+        with pytest.raises(ValueError, match="api down"):
+            await _collect(stream)
+
+    asyncio.run(main())
+    assert isinstance(ended[0], ValueError)
+
+
+def test_cancelled_shared_stream_fails_followers_and_stays_cancelled():
+    ended = []
+
+    async def main():
+        gate = asyncio.Event()
+        stream = SharedStream(_snapshots(2, gate=gate), on_done=ended.append)
+        follower = asyncio.create_task(_collect(stream))
+        await asyncio.sleep(0)
+        stream.task.cancel()
+        with pytest.raises(RuntimeError, match="stream cancelled"):
+            await follower
+        with pytest.raises(asyncio.CancelledError):
+            await stream.task
+
+    asyncio.run(main())
+    assert isinstance(ended[0], RuntimeError)
+
+
+def test_prefetch_skips_jobs_queued_before_cancel(monkeypatch):
+    monkeypatch.setattr(app, "_existing_card", lambda *args: None)
+    prefetcher = app._Prefetcher(workers=1)
+    busy, release, finished = threading.Event(), threading.Event(), threading.Event()
+    ran = []
+
+    def run(titles, bariatric):
+        ran.append(titles[0])
+        if titles[0] == "Busy":
+            busy.set()
+            release.wait(5)
+        if titles[0] == "After":
+            finished.set()
+
+    monkeypatch.setattr(prefetcher, "_run", run)
+    prefetcher.submit("other", ["Busy"], False)
+    assert busy.wait(5)  # the only worker is taken, so the next jobs stay queued
+    prefetcher.submit("s", ["Before"], False)
+    prefetcher.cancel("s")
+    prefetcher.submit("s", ["After"], False)
+    release.set()
+    assert finished.wait(5)
+    assert ran == ["Busy", "After"]
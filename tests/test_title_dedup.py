@@ -0,0 +1,56 @@
+# tests/test_title_dedup.py
+import title_dedup
+from title_dedup import TitleCorpus, TitleDeduper, dedupe, normalize
+
+
+def test_normalize_ignores_order_case_plurals_and_stopwords():
+    assert normalize("The Best Peach Cobblers") == normalize("peach cobbler")
+    assert normalize("Peach Cobbler (Classic)") == normalize("Classic Peach Cobbler")
+    assert normalize("Berries & Cream") == normalize("berry cream")
+    assert normalize("The Classic") == frozenset({"the", "classic"})  # nothing but stopwords
+
+
+def test_dedupe_keeps_the_first_of_each_near_duplicate_in_order():
+    titles = ["Classic Peach Cobbler", "Lemon Tart", "Peach Cobbler (Classic)", "Easy Peach Cobblers",
+              "Lemon Tarts", "Plum Cake"]
+    assert dedupe(titles) == ["Classic Peach Cobbler", "Lemon Tart", "Plum Cake"]
+
+
+def test_dedupe_keeps_titles_below_the_threshold():
+    titles = ["Peach Cobbler", "Peach Cobbler with Almonds"]  # Jaccard 2/3
+    assert dedupe(titles) == titles
+    assert dedupe(titles, threshold=0.6) == ["Peach Cobbler"]
+
+
+def test_dedupe_finds_near_duplicates_among_many_titles():
+    words = ["almond", "basil", "cherry", "date", "fennel", "ginger", "hazelnut", "lime", "mango", "nutmeg",
+             "orange", "pecan", "quince", "rhubarb", "sage", "thyme", "vanilla", "walnut", "yuzu", "zucchini"]
+    titles = [f"{a} {b} {c} cake" for a in words for b in words for c in ("tart", "loaf") if a < b]
+    dupes = [f"fresh {t.split()[1]} {t.split()[0]} {t.split()[2]} cakes" for t in titles[::7]]  # Jaccard 0.8
+    deduper = TitleDeduper()
+    kept = deduper.filter(titles + dupes)
+    assert kept[:len(titles)] == titles  # no false positives
+    assert len(deduper.dropped) >= 0.9 * len(dupes)  # LSH is approximate right at the threshold
+
+
+def test_deduper_filters_across_batches_and_records_drops():
+    deduper = TitleDeduper()
+    assert deduper.filter(["Peach Cobbler", "Lemon Tart"]) == ["Peach Cobbler", "Lemon Tart"]
+    assert deduper.filter(["Lemon Tarts", "Plum Cake", "Apple Pie"], limit=1) == ["Plum Cake"]
+    assert deduper.dropped == [("Lemon Tarts", "Lemon Tart")]
+
+
+def test_corpus_persists_and_filters_later_lists(tmp_path):
+    path = str(tmp_path / "titles.sqlite3")
+    corpus = TitleCorpus(path)
+    assert corpus.add(["Peach Cobbler", "Lemon Tart"], "desserts") == 2
+    assert corpus.add(["Peach Cobblers"], "desserts") == 0  # same normalized title
+    reopened = TitleCorpus(path)
+    assert len(reopened) == 2
+    assert dedupe(["Classic Peach Cobbler", "Plum Cake"], corpus=reopened) == ["Plum Cake"]
+
+
+def test_lsh_params_stay_within_the_signature():
+    for threshold in (0.5, 0.8, 0.95):
+        bands, rows = title_dedup.lsh_params(threshold)
+        assert bands * rows <= title_dedup.NUM_PERM
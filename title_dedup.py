@@ -0,0 +1,264 @@
+# title_dedup.py
+"""Near-duplicate detection for recipe titles.
+
+Titles are normalized to a set of stemmed tokens without stopwords, so
+"Classic Peach Cobbler" and "Peach Cobbler (Classic)" compare equal. Similar
+titles are found with MinHash signatures and LSH banding in roughly linear time,
+then confirmed by exact Jaccard similarity against TITLE_DEDUP_THRESHOLD. A
+persistent corpus of titles already produced can be checked as well.
+"""
+import os, re, time, zlib, sqlite3, threading
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+
+# ================= config =================
+DEDUP_THRESHOLD = float(os.environ.get("TITLE_DEDUP_THRESHOLD", 0.8))  # Jaccard over normalized tokens
+NUM_PERM = int(os.environ.get("TITLE_DEDUP_PERMUTATIONS", 64))
+CORPUS_PATH = os.environ.get("TITLE_CORPUS_PATH", os.path.join(".cache", "titles.sqlite3"))
+
+_SEED = 1729
+_PRIME = (1 << 31) - 1
+_CHUNK = 4096  # titles per vectorized signature block, bounds memory on large corpora
+
+_STOPWORDS = frozenset(
+    "a an and the with of in on for to from or style recipe classic easy simple quick best homemade "
+    "perfect ultimate delicious favorite my our".split()
+)
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+# ================= normalization =================
+@lru_cache(maxsize=65536)
+def _stem(word: str) -> str:
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and re.search(r"(?:ch|sh|x|ss|o)es$", word):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    if len(word) > 5 and word.endswith("ed") and word[-3] not in "aeiou":
+        return word[:-2]
+    return word
+
+
+def normalize(title: str) -> FrozenSet[str]:
+    """Stemmed token set of ``title`` (order-insensitive, stopwords removed)."""
+    words = _WORD_RE.findall(str(title).lower().replace("&", " and "))
+    tokens = frozenset(_stem(w) for w in words if w not in _STOPWORDS)
+    return tokens or frozenset(words)
+
+
+def title_key(tokens: Iterable[str]) -> str:
+    return " ".join(sorted(tokens))
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    inter = len(a & b)
+    union = len(a) + len(b) - inter
+    return inter / union if union else 1.0
+
+
+# ================= minhash =================
+_rng = np.random.RandomState(_SEED)
+_A = _rng.randint(1, _PRIME, NUM_PERM).astype(np.uint64)
+_B = _rng.randint(0, _PRIME, NUM_PERM).astype(np.uint64)
+_MIX = _rng.randint(1, 1 << 62, NUM_PERM, dtype=np.int64).astype(np.uint64) | np.uint64(1)  # band row weights
+_token_hashes: Dict[str, int] = {}
+
+
+def _token_hash(token: str) -> int:
+    h = _token_hashes.get(token)
+    if h is None:
+        h = _token_hashes[token] = zlib.crc32(token.encode("utf-8"))
+    return h
+
+
+def signatures(token_sets: Sequence[FrozenSet[str]]) -> np.ndarray:
+    """MinHash signatures, one row of NUM_PERM uint32 values per token set (all at once, in numpy)."""
+    out = np.full((len(token_sets), NUM_PERM), _PRIME, dtype=np.uint32)
+    for lo in range(0, len(token_sets), _CHUNK):
+        block = token_sets[lo:lo + _CHUNK]
+        lens = np.fromiter((len(t) for t in block), dtype=np.int64, count=len(block))
+        if not lens.any():
+            continue
+        hashes = np.fromiter((_token_hash(tok) for t in block for tok in t), dtype=np.uint64, count=int(lens.sum()))
+        values = (hashes[:, None] * _A[None, :] + _B[None, :]) % _PRIME
+        starts = np.cumsum(lens) - lens
+        nonempty = lens > 0
+        out[lo + np.flatnonzero(nonempty)] = np.minimum.reduceat(values, starts[nonempty], axis=0)
+    return out
+
+
+def lsh_params(threshold: float, num_perm: int = NUM_PERM) -> Tuple[int, int]:
+    """(bands, rows) whose S-curve midpoint (1/b)^(1/r) sits a little below ``threshold``."""
+    target = max(0.05, threshold * 0.85)
+    options = [(num_perm // r, r) for r in range(1, num_perm + 1) if num_perm // r >= 1]
+    return min(options, key=lambda br: abs((1.0 / br[0]) ** (1.0 / br[1]) - target))
+
+
+def band_keys(sigs: np.ndarray, bands: int, rows: int) -> List[List[int]]:
+    """One 64-bit key per LSH band and signature, mixed in numpy (wrapping uint64 arithmetic)."""
+    used = sigs[:, :bands * rows].astype(np.uint64).reshape(len(sigs), bands, rows)
+    with np.errstate(over="ignore"):
+        keys = (used * _MIX[:bands * rows].reshape(bands, rows)).sum(axis=2, dtype=np.uint64)
+    return keys.tolist()
+
+
+class MinHashIndex:
+    """LSH buckets over MinHash signatures with exact-Jaccard confirmation of candidates."""
+
+    def __init__(self, threshold: float = DEDUP_THRESHOLD):
+        self.threshold = threshold
+        self.bands, self.rows = lsh_params(threshold)
+        self.titles: List[str] = []
+        self.tokens: List[FrozenSet[str]] = []
+        self._exact: Dict[FrozenSet[str], int] = {}
+        self._buckets: List[Dict[int, List[int]]] = [{} for _ in range(self.bands)]
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def keys(self, sigs: np.ndarray) -> List[List[int]]:
+        return band_keys(sigs, self.bands, self.rows)
+
+    def match(self, tokens: FrozenSet[str], keys: List[int]) -> Optional[str]:
+        """An indexed title at least ``threshold`` similar to ``tokens``, if any."""
+        hit = self._exact.get(tokens)
+        if hit is not None:
+            return self.titles[hit]
+        if self.threshold >= 1.0:
+            return None
+        seen = set()
+        for band, key in zip(self._buckets, keys):
+            for idx in band.get(key, ()):
+                if idx not in seen:
+                    seen.add(idx)
+                    if jaccard(tokens, self.tokens[idx]) >= self.threshold:
+                        return self.titles[idx]
+        return None
+
+    def insert(self, title: str, tokens: FrozenSet[str], keys: List[int]) -> None:
+        idx = len(self.titles)
+        self.titles.append(title)
+        self.tokens.append(tokens)
+        self._exact.setdefault(tokens, idx)
+        for band, key in zip(self._buckets, keys):
+            band.setdefault(key, []).append(idx)
+
+
+# ================= corpus =================
+class TitleCorpus:
+    """Every title produced so far, persisted in SQLite and indexed in memory on first use."""
+
+    def __init__(self, path: str = CORPUS_PATH, threshold: float = DEDUP_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._index: Optional[MinHashIndex] = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS titles ("
+                         " key TEXT PRIMARY KEY, title TEXT NOT NULL, subject TEXT, created_at REAL NOT NULL)")
+            self._conn = conn
+        return self._conn
+
+    @property
+    def index(self) -> MinHashIndex:
+        with self._lock:
+            if self._index is None:
+                rows = self._db().execute("SELECT key, title FROM titles ORDER BY rowid").fetchall()
+                index = MinHashIndex(self.threshold)
+                token_sets = [frozenset(key.split()) for key, _ in rows]
+                for (_, title), tokens, keys in zip(rows, token_sets, index.keys(signatures(token_sets))):
+                    index.insert(title, tokens, keys)
+                self._index = index
+            return self._index
+
+    def match(self, tokens: FrozenSet[str], sigs: np.ndarray) -> List[Optional[str]]:
+        """Corpus title matching each of ``tokens`` (a list of token sets) or None."""
+        with self._lock:
+            index = self.index
+            return [index.match(t, k) for t, k in zip(tokens, index.keys(sigs))]
+
+    def add(self, titles: Sequence[str], subject: str = "") -> int:
+        """Record produced titles; returns how many were new to the corpus."""
+        token_sets = [normalize(t) for t in titles]
+        sigs = signatures(token_sets)
+        now = time.time()
+        added = 0
+        with self._lock:
+            index = self.index
+            conn = self._db()
+            conn.execute("BEGIN")
+            try:
+                for title, tokens, keys in zip(titles, token_sets, index.keys(sigs)):
+                    cur = conn.execute("INSERT OR IGNORE INTO titles(key, title, subject, created_at) VALUES (?, ?, ?, ?)",
+                                       (title_key(tokens), title, subject, now))
+                    if cur.rowcount:
+                        index.insert(title, tokens, keys)
+                        added += 1
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return added
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self.index)
+
+
+_default_corpus: Optional[TitleCorpus] = None
+_default_lock = threading.Lock()
+
+
+def get_corpus() -> TitleCorpus:
+    global _default_corpus
+    with _default_lock:
+        if _default_corpus is None:
+            _default_corpus = TitleCorpus()
+        return _default_corpus
+
+
+# ================= dedup =================
+class TitleDeduper:
+    """Keeps titles that are not near-duplicates of each other or of the corpus.
+
+    One instance lives for one request; ``filter`` can be called repeatedly as
+    batches arrive.
+    """
+
+    def __init__(self, threshold: Optional[float] = None, corpus: Optional[TitleCorpus] = None):
+        self.threshold = DEDUP_THRESHOLD if threshold is None else threshold
+        self.corpus = corpus
+        self.local = MinHashIndex(self.threshold)
+        self.dropped: List[Tuple[str, str]] = []  # (title, the title it duplicates)
+
+    def filter(self, titles: Sequence[str], limit: Optional[int] = None) -> List[str]:
+        token_sets = [normalize(t) for t in titles]
+        sigs = signatures(token_sets)
+        known = self.corpus.match(token_sets, sigs) if self.corpus is not None else [None] * len(titles)
+        kept: List[str] = []
+        for title, tokens, keys, dup in zip(titles, token_sets, self.local.keys(sigs), known):
+            if limit is not None and len(kept) >= limit:
+                break
+            dup = dup or self.local.match(tokens, keys)
+            if dup is not None:
+                self.dropped.append((title, dup))
+                continue
+            self.local.insert(title, tokens, keys)
+            kept.append(title)
+        return kept
+
+
+def dedupe(titles: Sequence[str], threshold: Optional[float] = None,
+           corpus: Optional[TitleCorpus] = None) -> List[str]:
+    """Titles in order, without near-duplicates (of each other, and of ``corpus`` if given)."""
+    return TitleDeduper(threshold, corpus).filter(titles)
@@ -0,0 +1,176 @@
+# token_budget.py
+"""Local token counts for prompts and replies, for planning without calling the API.
+
+Counts use tiktoken's encoding for the model when tiktoken is installed (optional:
+``pip install tiktoken``), otherwise ~4 characters per token like rate_limit. The CLI
+lists every prompt kind app.py sends with its size, the static prefix provider-side
+prompt caching can reuse, and its output budget, then plans a batch. Providers only
+cache prompts of PROMPT_CACHE_MIN tokens or more, and most single-card and pack prompts
+are shorter: the "cacheable" column is 0 for every kind that gains nothing.
+
+    python token_budget.py
+    python token_budget.py --titles 400 --variants standard bariatric --no-pack
+"""
+import os, sys, json, argparse
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence
+
+DEFAULT_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
+PROMPT_CACHE_MIN = int(os.environ.get("PROMPT_CACHE_MIN_TOKENS", 1024))  # shortest prompt the provider caches
+PROMPT_CACHE_BLOCK = 128  # cached prefixes are reported in steps of this many tokens
+MESSAGE_OVERHEAD = 4      # role and separator tokens per chat message
+REPLY_PRIMING = 3         # tokens that start the assistant's reply
+
+SAMPLE_TITLE = "Spiced Peach Cobbler with Almond Crumble"
+
+
+# ================= counting =================
+@lru_cache(maxsize=8)
+def _encoding(model: str) -> Any:
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None  # the encoding files could not be fetched (offline)
+
+
+def tokenizer(model: str = DEFAULT_MODEL) -> str:
+    enc = _encoding(model)
+    return enc.name if enc is not None else "~4 characters per token"
+
+
+def count(text: str, model: str = DEFAULT_MODEL) -> int:
+    enc = _encoding(model)
+    if enc is None:
+        return len(text or "") // 4
+    return len(enc.encode(text or "", disallowed_special=()))
+
+
+def prompt_tokens(system: str, user: str, response_format: Optional[dict] = None, model: str = DEFAULT_MODEL) -> int:
+    """Prompt tokens of one system + user chat call; a structured-output schema counts as prompt."""
+    n = count(system, model) + count(user, model) + 2 * MESSAGE_OVERHEAD + REPLY_PRIMING
+    if response_format:
+        n += count(json.dumps(response_format), model)
+    return n
+
+
+def cacheable(prefix: int, total: int) -> int:
+    """Prompt tokens a prefix cache can serve on repeat calls: whole blocks of the static prefix."""
+    if total < PROMPT_CACHE_MIN:
+        return 0
+    cached = prefix // PROMPT_CACHE_BLOCK * PROMPT_CACHE_BLOCK
+    return cached if cached >= PROMPT_CACHE_MIN else 0
+
+
+# ================= app prompts =================
+def _kind(kind: str, system: str, user: str, variable: str, response_format: Optional[dict],
+          budget: int, expected: int, model: str) -> Dict[str, Any]:
+    """Sizes of one prompt; everything before ``variable`` in the user message is its static prefix."""
+    total = prompt_tokens(system, user, response_format, model)
+    head = user[:max(user.find(variable), 0)]
+    prefix = prompt_tokens(system, head, response_format, model) - REPLY_PRIMING - MESSAGE_OVERHEAD // 2
+    return {"kind": kind, "prompt": total, "prefix": prefix, "cacheable": cacheable(prefix, total),
+            "budget": budget, "expected": expected}
+
+
+def prompt_kinds(title: str = SAMPLE_TITLE, pack_size: Optional[int] = None,
+                 model: str = DEFAULT_MODEL) -> List[Dict[str, Any]]:
+    """One row per prompt kind app.py sends, built by app's own request functions."""
+    import app
+    rows = []
+    subject = "peach desserts"
+    batch = app.TITLE_BATCH_SIZE
+    rows.append(_kind("titles", app.LIST_SYSTEM, app._title_batch_prompt(subject, batch, []), subject, None,
+                      app.TOKEN_BUDGET_PER_TITLE * batch + 32 if app.TOKEN_BUDGET_PER_TITLE else 0,
+                      batch * count(title + "\n", model), model))
+    for bariatric in (False, True):
+        if app._structured():
+            _, system, user = app._recipe_json_request(title, bariatric)
+            fmt = app.recipe_schema.response_format(bariatric)
+        else:
+            _, system, user = app._recipe_request(title, bariatric)
+            fmt = None
+        kind = app._card_kind(bariatric)
+        rows.append(_kind(kind, system, user, f"'{title}'", fmt, app.TOKEN_BUDGETS.get(kind, 0),
+                          int(app._pack_sizer.expected(bariatric, 1)), model))
+    system, user, fmt = app._pair_request(title)
+    rows.append(_kind("pair", system, user, f"'{title}'", fmt, app.TOKEN_BUDGETS.get("pair", 0),
+                      int(app._pack_sizer.expected(False, 1) + app._pack_sizer.expected(True, 1)), model))
+    for bariatric in (False, True):
+        size = pack_size or app.recipe_pack_size(bariatric)
+        titles = [f"{title} {i}" for i in range(1, size + 1)]
+        system, user, fmt = app._pack_request(titles, bariatric)
+        row = _kind("pack", system, user, f"1. '{titles[0]}'", fmt, app._pack_sizer.limit,
+                    app._pack_sizer.expected(bariatric, size), model)
+        row.update(kind=f"pack{'_bariatric' if bariatric else ''} x{size}", cards=size)
+        rows.append(row)
+    return rows
+
+
+def plan_batch(titles: int, variants: Sequence[str] = ("standard",), pack: bool = True,
+               model: str = DEFAULT_MODEL) -> Dict[str, Any]:
+    """Calls and tokens a batch_pipeline.run_batch of ``titles`` titles would spend (first attempts only)."""
+    rows = {r["kind"].split(" ")[0]: r for r in prompt_kinds(model=model)}
+    wanted = [v for v in ("standard", "bariatric") if v in variants] or ["standard"]
+    plan = {"calls": 0, "prompt": 0, "cached": 0, "expected": 0, "budget": 0}
+
+    def _add(row: Dict[str, Any], calls: int) -> None:
+        plan["calls"] += calls
+        plan["prompt"] += row["prompt"] * calls
+        plan["cached"] += row["cacheable"] * max(calls - 1, 0)  # the first call fills the cache
+        plan["expected"] += row["expected"] * calls
+        plan["budget"] += row["budget"] * calls
+
+    if pack:
+        for variant in wanted:
+            row = rows["pack_bariatric" if variant == "bariatric" else "pack"]
+            full, rest = divmod(titles, row["cards"])
+            _add(row, full)
+            if rest:
+                _add(dict(row, prompt=row["prompt"] * rest // row["cards"],
+                          expected=row["expected"] * rest // row["cards"]), 1)
+    elif len(wanted) == 2:
+        _add(rows["pair"], titles)
+    else:
+        _add(rows["card_bariatric" if wanted == ["bariatric"] else "card"], titles)
+    return plan
+
+
+# ================= CLI =================
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Token sizes of the app's prompts and batch plans, computed locally.")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--title", default=SAMPLE_TITLE, help="sample title for the prompts")
+    parser.add_argument("--titles", type=int, default=0, help="plan a batch of this many titles")
+    parser.add_argument("--variants", nargs="+", default=["standard"], choices=["standard", "bariatric"])
+    parser.add_argument("--no-pack", action="store_true", help="plan one call per card (or pair) instead of packs")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    rows = prompt_kinds(args.title, model=args.model)
+    plan = plan_batch(args.titles, args.variants, not args.no_pack, args.model) if args.titles > 0 else None
+    if args.json:
+        print(json.dumps({"tokenizer": tokenizer(args.model), "kinds": rows, "plan": plan}, indent=2))
+        return 0
+    print(f"🔢 {args.model}: {tokenizer(args.model)} | cacheable from {PROMPT_CACHE_MIN} prompt tokens")
+    print(f"{'kind':<20}{'prompt':>8}{'prefix':>8}{'cacheable':>11}{'budget':>8}{'expected':>10}")
+    for r in rows:
+        print(f"{r['kind']:<20}{r['prompt']:>8}{r['prefix']:>8}{r['cacheable']:>11}{r['budget']:>8}{r['expected']:>10}")
+    uncached = [r["kind"] for r in rows if not r["cacheable"]]
+    if uncached:
+        print(f"⚠️ Below the {PROMPT_CACHE_MIN}-token cache minimum, no prompt caching: {', '.join(uncached)}")
+    if plan:
+        print(f"\n📦 {args.titles} titles, {' + '.join(args.variants)}, {'one call each' if args.no_pack else 'packed'}: "
+              f"{plan['calls']} calls, {plan['prompt']} prompt tokens ({plan['cached']} cacheable), "
+              f"~{plan['expected']} completion tokens (budget {plan['budget']})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())